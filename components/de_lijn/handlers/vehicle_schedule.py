@@ -19,5 +19,5 @@ class DeLijnVehicleScheduleHandler(Handler):
         gtfs = gtfs[0]
 
         return schedule_from_gtfs(
-            load_gtfs_parquet_feed(gtfs.data), start_timestamp, end_timestamp
+            load_gtfs_parquet_feed(gtfs), start_timestamp, end_timestamp
         )
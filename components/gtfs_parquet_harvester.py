@@ -1,22 +1,55 @@
+import hashlib
+import json
 import logging
-import multiprocessing
-import os
-import tempfile
+import shutil
 import zipfile
+from contextlib import ExitStack
+from io import BytesIO
+from typing import Union
+
+from gtfs_parquet.schema import ALL_SCHEMAS
 
 from src.components import Harvester
+from src.utilities.gtfs_conversion import convert_gtfs_to_parquet
 
 logger = logging.getLogger(__name__)
 
 TIMEOUT_SECONDS = 1800
 
+# Content hash of each GTFS file the Parquet archive was converted from
+MANIFEST_NAME = "gtfs_manifest.json"
+
+# GTFS file name (e.g. "stops.txt") to table name (e.g. "stops")
+GTFS_TABLES = {schema.file_name: table_name for table_name, schema in ALL_SCHEMAS.items()}
+
+
+def _member_hashes(gtfs_zip: zipfile.ZipFile) -> dict:
+    """Hash the content of every GTFS table file of a zip archive."""
+    hashes = {}
+
+    for name in gtfs_zip.namelist():
+        if name not in GTFS_TABLES:
+            continue
+
+        digest = hashlib.md5()
+        with gtfs_zip.open(name) as member:
+            for chunk in iter(lambda: member.read(1 << 20), b""):
+                digest.update(chunk)
+        hashes[name] = digest.hexdigest()
 
-def _convert(gtfs_path, output_path):
-    """Run conversion in a subprocess so it can be hard-killed on timeout."""
-    from gtfs_parquet import parse_gtfs, write_parquet
+    return hashes
 
-    feed = parse_gtfs(gtfs_path)
-    write_parquet(feed, output_path)
+
+def _read_manifest(parquet_zip: zipfile.ZipFile) -> dict:
+    if MANIFEST_NAME not in parquet_zip.namelist():
+        return {}
+
+    return json.loads(parquet_zip.read(MANIFEST_NAME))
+
+
+def _zip_file(zip_data: Union[bytes, str]):
+    """The file to open a zip given as bytes or as a local path with."""
+    return zip_data if isinstance(zip_data, str) else BytesIO(zip_data)
 
 
 class GTFSParquetHarvester(Harvester):
@@ -25,37 +58,95 @@ class GTFSParquetHarvester(Harvester):
     Uses the gtfs-parquet library for conversion, producing strongly-typed Parquet
     files with zstd compression. This yields significant size reductions (40-75%)
     and enables efficient columnar reads with near-zero RAM overhead via Polars.
+    The conversion runs in a long-lived worker process (see gtfs_conversion).
+
+    The content hash of each GTFS file is stored in the archive. Given the previous
+    archive (as optional dependency on itself, see the configuration), only the files
+    that changed are converted again and the Parquet files of the others are reused
+    as is. Without it, every feed is converted in full.
+
+    When no file changed, None is returned: like any empty result, it is stored as a
+    null row (without blob), which moves the harvester past the source feed while the
+    previous archive stays the latest one with data, the one read by the handlers and
+    given back as previous archive.
     """
 
-    def run(self, source):
-        gtfs_bytes = source.data
+    def run(self, source, **previous_versions):
+        # A local zip is read in place (by path), otherwise it is downloaded
+        gtfs_zip = source.path or source.data
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            gtfs_path = os.path.join(tmpdir, "gtfs.zip")
-            with open(gtfs_path, "wb") as f:
-                f.write(gtfs_bytes)
+        previous = next(
+            (version for version in previous_versions.values() if version is not None),
+            None,
+        )
+
+        try:
+            with zipfile.ZipFile(_zip_file(gtfs_zip)) as source_zip:
+                hashes = _member_hashes(source_zip)
+        except zipfile.BadZipFile:
+            logger.warning("Source data is not a valid zip file, skipping")
+            return None
+
+        with ExitStack() as stack:
+            previous_zip = None
 
             try:
-                zipfile.ZipFile(gtfs_path).close()
-            except zipfile.BadZipFile:
-                logger.warning("Source data is not a valid zip file, skipping")
+                if previous:
+                    previous_zip = stack.enter_context(
+                        zipfile.ZipFile(_zip_file(previous.path or previous.data))
+                    )
+                previous_hashes = _read_manifest(previous_zip) if previous_zip else {}
+            except (zipfile.BadZipFile, ValueError):
+                previous_hashes = {}
+
+            changed = [
+                name for name, digest in hashes.items() if previous_hashes.get(name) != digest
+            ]
+
+            if not changed and hashes.keys() == previous_hashes.keys():
+                logger.info("GTFS feed unchanged since the previous version, skipping")
                 return None
 
-            output_path = os.path.join(tmpdir, "gtfs.parquet.zip")
-
-            proc = multiprocessing.Process(target=_convert, args=(gtfs_path, output_path))
-            proc.start()
-            proc.join(timeout=TIMEOUT_SECONDS)
+            if len(changed) < len(hashes):
+                logger.info(f"Converting changed GTFS files only: {changed}")
+                gtfs_zip = self._extract_members(gtfs_zip, changed)
 
-            if proc.is_alive():
-                proc.kill()
-                proc.join()
-                logger.warning("GTFS to Parquet conversion timed out after %ds, skipping", TIMEOUT_SECONDS)
+            try:
+                tables = convert_gtfs_to_parquet(gtfs_zip, TIMEOUT_SECONDS)
+            except (TimeoutError, RuntimeError) as e:
+                logger.warning(f"GTFS to Parquet conversion failed, skipping: {e}")
                 return None
 
-            if proc.exitcode != 0:
-                logger.warning("GTFS to Parquet conversion failed (exit code %d), skipping", proc.exitcode)
-                return None
+            output = BytesIO()
+
+            # Parquet is already compressed, store the members as is
+            with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as parquet_zip:
+                for name in hashes:
+                    table_name = GTFS_TABLES[name]
+                    member = f"{table_name}.parquet"
+
+                    if name in changed:
+                        if table_name in tables:
+                            parquet_zip.writestr(member, tables[table_name])
+                    elif member in previous_zip.namelist():
+                        parquet_zip.writestr(member, previous_zip.read(member))
+
+                parquet_zip.writestr(MANIFEST_NAME, json.dumps(hashes))
+
+        return output.getvalue()
+
+    @staticmethod
+    def _extract_members(gtfs_zip: Union[bytes, str], names: list) -> bytes:
+        """Copy some members of the GTFS zip (bytes or path) to a new (uncompressed) zip."""
+        output = BytesIO()
+
+        with zipfile.ZipFile(_zip_file(gtfs_zip)) as source_zip, zipfile.ZipFile(
+            output, "w", zipfile.ZIP_STORED
+        ) as partial_zip:
+            for name in names:
+                with source_zip.open(name) as src, partial_zip.open(
+                    name, "w", force_zip64=True
+                ) as dst:
+                    shutil.copyfileobj(src, dst)
 
-            with open(output_path, "rb") as f:
-                return f.read()
+        return output.getvalue()
@@ -0,0 +1,64 @@
+from datetime import datetime
+
+import pyarrow as pa
+
+from src.components import Handler, InvalidQuery
+from src.data.query import query_parquetize
+
+
+class ParquetizeQueryHandler(Handler):
+    """Generic handler querying the parquetize files of a component.
+
+    Returns the records between two timestamps as an Arrow IPC stream, read from the
+    Parquet files of the parquetize table only (never from the per-snapshot blobs).
+    `columns` is a comma separated projection and `filters` maps columns to their
+    accepted values, e.g. {"lineId": ["1", "7"]}. Missing or reversed timestamps,
+    unknown columns and values that cannot be cast to the type of their column are
+    answered with a 400.
+    """
+
+    TABLE: str = None
+
+    def run(
+        self,
+        start_timestamp: int = None,
+        end_timestamp: int = None,
+        columns: str = None,
+        filters: dict = None,
+    ):
+        if start_timestamp is None or end_timestamp is None:
+            raise InvalidQuery("Both start_timestamp and end_timestamp are required")
+
+        if start_timestamp >= end_timestamp:
+            raise InvalidQuery("The start_timestamp must be before the end_timestamp")
+
+        if filters is not None:
+            if not isinstance(filters, dict):
+                raise InvalidQuery("The filters must map columns to their accepted values")
+
+            filters = {
+                column: values if isinstance(values, list) else [values]
+                for column, values in filters.items()
+            }
+
+        # Unknown columns and values of the wrong type are errors of the query
+        try:
+            table = query_parquetize(
+                self.get_table_by_name(self.TABLE),
+                datetime.utcfromtimestamp(start_timestamp),
+                datetime.utcfromtimestamp(end_timestamp),
+                columns.split(",") if columns else None,
+                filters,
+            )
+        except ValueError as e:
+            raise InvalidQuery(str(e)) from e
+
+        if table is None:
+            return None
+
+        sink = pa.BufferOutputStream()
+
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+        return sink.getvalue().to_pybytes()
@@ -0,0 +1,5 @@
+from components.parquetize_query_handler import ParquetizeQueryHandler
+
+
+class STIBVehicleDistanceArchiveHandler(ParquetizeQueryHandler):
+    TABLE = "stib_vehicle_distance_parquetize"
@@ -0,0 +1,6 @@
+from components.trajectory_parquet_harvester import TrajectoryParquetHarvester
+
+
+class STIBTrajectoriesHarvester(TrajectoryParquetHarvester):
+    ID_COLUMN = "uuid"
+    COLUMNS_TO_DROP = ["distance", "distanceFromPoint", "pointId"]
@@ -1,12 +1,20 @@
 from src.components import Handler
+from src.data.retrieve import Cursor
 from src.utilities.mf_json import fetch_geojsons_and_return_mf_json
 
 
 class SNCBTripsHandler(Handler):
-    def run(self, start_timestamp: int = None, end_timestamp: int = None):
+    def run(
+        self,
+        start_timestamp: int = None,
+        end_timestamp: int = None,
+        cursor: Cursor = None,
+    ):
         return fetch_geojsons_and_return_mf_json(
             self.get_table_by_name("sncb_vehicle_position_geometry"),
             "trip_id",
             start_timestamp,
             end_timestamp,
+            trajectory_table=self.get_table_by_name("sncb_trajectories"),
+            cursor=cursor,
         )
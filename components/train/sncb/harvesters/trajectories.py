@@ -0,0 +1,5 @@
+from components.trajectory_parquet_harvester import TrajectoryParquetHarvester
+
+
+class SNCBTrajectoriesHarvester(TrajectoryParquetHarvester):
+    ID_COLUMN = "trip_id"
@@ -2,208 +2,189 @@ import json
 
 import geopandas as gpd
 import pandas as pd
+import shapely
+from gtfs_parquet.ops.stops import get_stop_times
 
 from src.components import Harvester
-from src.utilities.gtfs import (
-    load_gtfs_realtime_from_bytes_to_df,
-    load_gtfs_parquet_feed,
-)
-
-
-class _CachedStopTimes:
-    stop_times = None
-    date = None
-
-
-def _cached_stop_times(gtfs_feed, date):
-    """Get stop_times for a date, using gtfs_parquet Feed with datetime.date."""
-    if _CachedStopTimes.stop_times is None or _CachedStopTimes.date != date:
-        _CachedStopTimes.stop_times = gtfs_feed.get_stop_times(date).to_pandas()[
-            ["trip_id", "stop_id", "stop_sequence", "arrival_time", "departure_time"]
-        ].copy()
-        _CachedStopTimes.date = date
-
-    return _CachedStopTimes.stop_times
-
-
-class SNCBVehiclePositionGeometryHarvester(Harvester):
-    def run(self, source, sncb_gtfs_parquet, infrabel_segments, infrabel_operational_points):
-        operational_points = gpd.GeoDataFrame.from_features(
-            infrabel_operational_points.data["features"]
-        )[["longnamefrench", "ptcarid", "commerciallongnamefrench"]]
-
-        segments = gpd.GeoDataFrame.from_features(infrabel_segments.data["features"])
-
-        gtfs_static = load_gtfs_parquet_feed(sncb_gtfs_parquet.data)
-        gtfs_rt = load_gtfs_realtime_from_bytes_to_df(source.data)
-
-        current_date = source.date.date()
-
-        stop_times = _cached_stop_times(gtfs_static, current_date)
-
-        stop_times["arrival_delay"] = 0
-
-        # Only update arrival_delay from realtime data to avoid type clash
-        # between timedelta64 (arrival_time) and float64 columns in gtfs_rt
-        if "arrival_delay" in gtfs_rt.columns:
-            stop_times.update(gtfs_rt[["arrival_delay"]])
-
-        stop_times["next_stop_sequence"] = stop_times["stop_sequence"] + 1
-
-        # Merge with next stop
-        stop_times = stop_times.merge(
-            stop_times[["trip_id", "stop_sequence", "arrival_time", "stop_id"]],
-            left_on=["trip_id", "next_stop_sequence"],
-            right_on=["trip_id", "stop_sequence"],
-            suffixes=("", "_next"),
+from src.utilities.gtfs import load_gtfs_parquet_feed, IntervalIndex
+
+
+class _CachedLegs:
+    legs = None
+    index = None
+    key = None
+
+
+def _cached_legs(sncb_gtfs_parquet, infrabel_segments, infrabel_operational_points, date):
+    """
+    Get the legs (pairs of consecutive stops of a trip) running on a date, matched to
+    their infrabel segment. They only depend on the GTFS and infrabel versions and on
+    the date, so they are rebuilt only when one of those changes.
+    """
+    key = (
+        sncb_gtfs_parquet.hash,
+        infrabel_segments.hash,
+        infrabel_operational_points.hash,
+        date,
+    )
+
+    if _CachedLegs.legs is None or _CachedLegs.key != key:
+        _CachedLegs.legs = _build_legs(
+            load_gtfs_parquet_feed(sncb_gtfs_parquet),
+            infrabel_segments,
+            infrabel_operational_points,
+            date,
         )
-
-        stop_times["start_seconds"] = stop_times["arrival_time"].apply(
-            lambda x: pd.to_timedelta(x).total_seconds()
+        _CachedLegs.index = IntervalIndex(
+            _CachedLegs.legs["start_seconds"].values,
+            _CachedLegs.legs["end_seconds"].values,
         )
-        stop_times["end_seconds"] = stop_times["arrival_time_next"].apply(
-            lambda x: pd.to_timedelta(x).total_seconds()
-        )
-
-        fetch_time_in_seconds = source.date.time().strftime("%H:%M:%S")
-        fetch_time_in_seconds = pd.to_timedelta(fetch_time_in_seconds).total_seconds()
-
-        # Filter where fetch_time_in_seconds is between start_seconds and end_seconds
-        stop_times = stop_times[
-            (stop_times["start_seconds"] < fetch_time_in_seconds)
-            & (stop_times["end_seconds"] > fetch_time_in_seconds)
-        ]
-
-        # Compute percentage of completion between start_seconds and end_seconds based on fetch_time_in_seconds
-        stop_times["percentage"] = (
-            fetch_time_in_seconds - stop_times["start_seconds"]
-        ) / (stop_times["end_seconds"] - stop_times["start_seconds"])
-
-        stop_times = stop_times[
+        _CachedLegs.key = key
+
+    return _CachedLegs.legs, _CachedLegs.index
+
+
+def _build_legs(gtfs_static, infrabel_segments, infrabel_operational_points, date):
+    stop_times = get_stop_times(gtfs_static, date).to_pandas()[
+        ["trip_id", "stop_id", "stop_sequence", "arrival_time"]
+    ]
+
+    stop_times["start_seconds"] = stop_times["arrival_time"].dt.total_seconds()
+    stop_times["next_stop_sequence"] = stop_times["stop_sequence"] + 1
+
+    # Merge with next stop
+    legs = stop_times.merge(
+        stop_times[["trip_id", "stop_sequence", "start_seconds", "stop_id"]],
+        left_on=["trip_id", "next_stop_sequence"],
+        right_on=["trip_id", "stop_sequence"],
+        suffixes=("", "_next"),
+    ).rename(columns={"start_seconds_next": "end_seconds"})
+
+    # Merge with stops to get the names of both the start and the end stop
+    stops_df = gtfs_static.stops.to_pandas()[["stop_id", "stop_name"]]
+
+    legs = legs.merge(
+        stops_df.rename(columns={"stop_name": "stop_name_start"}), on="stop_id"
+    )
+    legs = legs.merge(
+        stops_df.rename(
+            columns={"stop_id": "stop_id_next", "stop_name": "stop_name_end"}
+        ),
+        on="stop_id_next",
+    )
+
+    legs["stop_name_start"] = (
+        legs["stop_name_start"]
+        .str.upper()
+        .str.replace(" ", "", regex=False)
+        .str.replace("(b)", "", regex=False)
+        .str.replace("(a)", "", regex=False)
+    )
+    legs["stop_name_end"] = legs["stop_name_end"].str.upper()
+
+    stop_names_clean = _clean_operational_point_names(infrabel_operational_points)
+
+    # Merge ptcarid on the cleaned names of both the start and the end stop
+    legs = legs.merge(
+        stop_names_clean, left_on="stop_name_start", right_on="name", how="left"
+    )
+    legs = legs.merge(
+        stop_names_clean,
+        left_on="stop_name_end",
+        right_on="name",
+        how="left",
+        suffixes=("_start", "_end"),
+    )
+
+    # Remove where either ptcarid_start or ptcarid_end is null
+    legs = legs[(legs["ptcarid_start"].notnull()) & (legs["ptcarid_end"].notnull())]
+
+    segments = gpd.GeoDataFrame.from_features(infrabel_segments.data["features"])
+
+    # Merge legs on stationfrom_id and stationto_id
+    legs = segments[["stationfrom_id", "stationto_id", "geometry"]].merge(
+        legs,
+        left_on=["stationfrom_id", "stationto_id"],
+        right_on=["ptcarid_start", "ptcarid_end"],
+    )
+
+    # Drop where geometry is null
+    legs = legs[legs["geometry"].notnull()]
+
+    # Merge with trips to get trip_headsign
+    trips_df = gtfs_static.trips.to_pandas()[["trip_id", "trip_headsign"]]
+    legs = legs.merge(trips_df, on="trip_id")
+
+    return gpd.GeoDataFrame(
+        legs[
             [
                 "trip_id",
-                "stop_id",
-                "stop_id_next",
-                "arrival_time",
-                "arrival_time_next",
-                "percentage",
+                "trip_headsign",
+                "name_start",
+                "name_end",
+                "ptcarid_start",
+                "ptcarid_end",
+                "start_seconds",
+                "end_seconds",
+                "geometry",
             ]
-        ]
-
-        # Rename stop_id to start_stop_id and stop_id_next to end_stop_id. Also rename arrival_time to start_time and arrival_time_next to end_time.
-        stop_times = stop_times.rename(
-            columns={
-                "stop_id": "start_stop_id",
-                "stop_id_next": "end_stop_id",
-                "arrival_time": "start_time",
-                "arrival_time_next": "end_time",
-            }
-        )
+        ].reset_index(drop=True)
+    )
 
-        # Merge with stops to get stop lat/lon and name for both start and end
-        stops_df = gtfs_static.stops.to_pandas()[["stop_id", "stop_name", "stop_lat", "stop_lon"]]
 
-        stop_times = stop_times.merge(
-            stops_df,
-            left_on="start_stop_id",
-            right_on="stop_id",
-        )
+def _clean_operational_point_names(infrabel_operational_points):
+    """Map both the french and the commercial french names of operational points to their ptcarid."""
+    operational_points = gpd.GeoDataFrame.from_features(
+        infrabel_operational_points.data["features"]
+    )
 
-        stop_times = stop_times.merge(
-            stops_df,
-            left_on="end_stop_id",
-            right_on="stop_id",
-            suffixes=("_start", "_end"),
-        )
-
-        rows = []
-
-        for index, row in operational_points.iterrows():
-            rows.append(
-                {
-                    "name": row["longnamefrench"]
-                    .upper()
-                    .replace(" ", "")
-                    .replace("'", ""),
-                    "ptcarid": row["ptcarid"],
-                }
-            )
-            rows.append(
-                {
-                    "name": row["commerciallongnamefrench"]
-                    .upper()
-                    .replace(" ", "")
-                    .replace("'", ""),
-                    "ptcarid": row["ptcarid"],
-                }
-            )
-
-        stop_names_clean = pd.DataFrame(rows).drop_duplicates()
-
-        work = stop_times[
-            ["trip_id", "stop_name_start", "stop_name_end", "percentage"]
-        ].copy()
-        # Convert both to uppercase
-        work["stop_name_start"] = work["stop_name_start"].apply(lambda x: x.upper())
-        work["stop_name_end"] = work["stop_name_end"].apply(lambda x: x.upper())
-
-        work["stop_name_start"] = work["stop_name_start"].apply(
-            lambda x: x.replace(" ", "").replace("(b)", "").replace("(a)", "")
-        )
+    names = pd.concat(
+        [
+            operational_points[[column, "ptcarid"]].rename(columns={column: "name"})
+            for column in ["longnamefrench", "commerciallongnamefrench"]
+        ],
+        ignore_index=True,
+    )
 
-        # Merge shortnamefrench on stop_name_start
-        work = work.merge(
-            stop_names_clean[["name", "ptcarid"]],
-            left_on="stop_name_start",
-            right_on="name",
-            how="left",
-        )
+    names["name"] = (
+        names["name"]
+        .str.upper()
+        .str.replace(" ", "", regex=False)
+        .str.replace("'", "", regex=False)
+    )
 
-        # Merge name on stop_name_end
-        work = work.merge(
-            stop_names_clean[["name", "ptcarid"]],
-            left_on="stop_name_end",
-            right_on="name",
-            how="left",
-            suffixes=("_start", "_end"),
-        )
+    return names.drop_duplicates()
 
-        # Remove where either ptcarid_start or ptcarid_end is null
-        work = work[(work["ptcarid_start"].notnull()) & (work["ptcarid_end"].notnull())]
 
-        # Merge work on stationfrom_id and stationto_id
-        final = segments.merge(
-            work,
-            left_on=["stationfrom_id", "stationto_id"],
-            right_on=["ptcarid_start", "ptcarid_end"],
+class SNCBVehiclePositionGeometryHarvester(Harvester):
+    def run(self, source, sncb_gtfs_parquet, infrabel_segments, infrabel_operational_points):
+        legs, legs_index = _cached_legs(
+            sncb_gtfs_parquet,
+            infrabel_segments,
+            infrabel_operational_points,
+            source.date.date(),
         )
 
-        # Drop where geometry is null
-        final = final[final["geometry"].notnull()]
+        time = source.date.time()
+        fetch_time_in_seconds = time.hour * 3600 + time.minute * 60 + time.second
+
+        # Legs where fetch_time_in_seconds is between start_seconds and end_seconds
+        final = legs.iloc[legs_index.active_at(fetch_time_in_seconds)]
 
         if final.empty:
             return
 
-        # Interpolate point using geometry (linestring) and percentage
-        final["geometry"] = final.apply(
-            lambda row: row["geometry"].interpolate(row["percentage"], normalized=True),
-            axis=1,
+        # Compute percentage of completion between start_seconds and end_seconds based on fetch_time_in_seconds
+        percentage = (fetch_time_in_seconds - final["start_seconds"].values) / (
+            final["end_seconds"].values - final["start_seconds"].values
         )
 
-        # Merge with trips to get trip_headsign
-        trips_df = gtfs_static.trips.to_pandas()[["trip_id", "trip_headsign"]]
-        final = final.merge(trips_df, on="trip_id")
-
-        final = final[
-            [
-                "trip_id",
-                "trip_headsign",
-                "name_start",
-                "name_end",
-                "ptcarid_start",
-                "ptcarid_end",
-                "geometry",
-            ]
-        ]
+        # Interpolate point using geometry (linestring) and percentage
+        final = final.drop(columns=["start_seconds", "end_seconds"]).reset_index(
+            drop=True
+        )
+        final["geometry"] = shapely.line_interpolate_point(
+            final["geometry"].values, percentage, normalized=True
+        )
 
         return json.loads(final.to_json())
@@ -0,0 +1,26 @@
+from src.components import Harvester
+from src.utilities.trajectory import (
+    geojsons_to_trajectory_frame,
+    trajectory_frame_to_parquet,
+)
+
+
+class TrajectoryParquetHarvester(Harvester):
+    """Generic harvester that materialises an hour of identified vehicle positions.
+
+    The per-snapshot GeoJSON point collections of the source are flattened into a
+    single Parquet file (one row per position, sorted by date then vehicle id), so
+    trips handlers can read a whole hour at once with a pushed-down date filter
+    instead of re-parsing every snapshot on each request.
+    """
+
+    ID_COLUMN: str = None
+    COLUMNS_TO_DROP: list = None
+
+    def run(self, sources):
+        df = geojsons_to_trajectory_frame(sources, self.COLUMNS_TO_DROP)
+
+        if df.empty or self.ID_COLUMN not in df.columns:
+            return None
+
+        return trajectory_frame_to_parquet(df, self.ID_COLUMN)
@@ -18,6 +18,8 @@ if load_dotenv():
         run_harvester_on_schedule,
         run_parquetize_on_schedule,
         run_parquetize,
+        run_retention_on_schedule,
+        run_retention,
     )
 
 
@@ -125,6 +127,30 @@ def launch_parquetize(args, config, processes, tables):
             processes.append(process)
 
 
+def launch_retention(args, config, processes, tables):
+    """
+    Launch retention processes.
+
+    Parameters:
+        args (argparse.Namespace): Parsed command-line arguments.
+        config: Configuration object.
+        processes (list): List to append the created processes.
+        tables (dict): Tables from the database synchronization.
+    """
+    retention_names_to_run = (
+        config.retention.keys() if "all" in args.retention else args.retention
+    )
+
+    for name, retention_config in config.retention.items():
+        if name in retention_names_to_run:
+            process = Process(
+                target=run_retention if args.now else run_retention_on_schedule,
+                args=(retention_config, config.harvesters, tables),
+            )
+            process.start()
+            processes.append(process)
+
+
 def main():
     config = load_all_components()
     tables = sync_db_from_configuration(config)
@@ -145,6 +171,9 @@ def main():
     # Launch parquetize
     launch_parquetize(args, config, processes, tables)
 
+    # Launch retention
+    launch_retention(args, config, processes, tables)
+
     # If no processes were started, display a message
     if not processes:
         logging.warning("No handlers, collectors, or harvesters were specified to run.")
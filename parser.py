@@ -87,5 +87,11 @@ def parse_arguments():
         default=[],
         help="List of harvester names to run.",
     )
+    parser.add_argument(
+        "--retention",
+        nargs="*",
+        default=[],
+        help="List of component names whose raw blobs to release (see RETENTION).",
+    )
 
     return parser.parse_args()
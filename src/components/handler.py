@@ -4,6 +4,10 @@ from typing import Type, Dict
 from sqlalchemy import Table
 
 
+class InvalidQuery(ValueError):
+    """Raised by a handler when its query parameters are invalid, answered with a 400."""
+
+
 class Handler(abc.ABC):
     def __init__(self, tables: Dict[str, Table]):
         self._tables = tables
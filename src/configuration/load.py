@@ -8,7 +8,8 @@ from src.components import ComponentClass
 from src.configuration.model import (
     ComponentsConfiguration,
     ComponentConfiguration,
-    ComponentParquetizeConfig, ComponentParquetizeGroupConfig,
+    ComponentParquetizeConfig, ComponentParquetizeGroupConfig, ComponentParquetizeLayoutConfig,
+    ComponentRetentionConfig,
 )
 
 logger = logging.getLogger("Load")
@@ -109,12 +110,43 @@ def load_all_components(config_path: str = "configuration") -> ComponentsConfigu
         if component.parquetize is not None:
             parquetize[component.name] = component
 
+    retention = {}
+
+    for component in chain(collectors.values(), harvesters.values()):
+        if component.retention is not None:
+            retention[component.name] = component
 
     return ComponentsConfiguration(
         collectors=collectors,
         harvesters=harvesters,
         handlers=handlers,
-        parquetize=parquetize
+        parquetize=parquetize,
+        retention=retention,
+    )
+
+
+def load_parquetize_layout(
+    config: dict, default: ComponentParquetizeLayoutConfig
+) -> ComponentParquetizeLayoutConfig:
+    """
+    Load the layout of parquetize files (compression, row groups, sorting, statistics).
+    :param config: The PARQUETIZE block (batch files) or one of its GROUPS (group files)
+    :param default: The layout used for the keys that are not set
+    :return: The layout
+    """
+    compression = config.get("COMPRESSION", default.compression)
+
+    return ComponentParquetizeLayoutConfig(
+        compression=compression,
+        # The default level belongs to the default codec
+        compression_level=config.get(
+            "COMPRESSION_LEVEL",
+            default.compression_level if compression == default.compression else None,
+        ),
+        row_group_size=config.get("ROW_GROUP_SIZE", default.row_group_size),
+        sort=config.get("SORT", default.sort),
+        statistics=config.get("STATISTICS", default.statistics),
+        bloom_filter=config.get("BLOOM_FILTER", default.bloom_filter),
     )
 
 
@@ -136,10 +168,47 @@ def extract_components(
                     ComponentParquetizeGroupConfig(
                         group=group.get("GROUP", None),
                         keys=group.get("KEYS", None),
+                        layout=load_parquetize_layout(group, ComponentParquetizeLayoutConfig()),
                     ) for group in parquetize.get("GROUPS", [])
                 ],
                 schema=parquetize.get("SCHEMA", None),
+                dictionary=parquetize.get("DICTIONARY", []),
+                partitioning=parquetize.get("PARTITIONING", "flat"),
+                batch_layout=load_parquetize_layout(
+                    parquetize,
+                    ComponentParquetizeLayoutConfig(compression="snappy", compression_level=None),
+                ),
             ) if parquetize is not None else None
+        retention = component.get("RETENTION", None)
+        retention_config = ComponentRetentionConfig(
+            keep=retention["KEEP"],
+            action=retention.get("ACTION", "delete"),
+            tier=retention.get("TIER", "Archive"),
+        ) if retention is not None else None
+
+        if retention_config is not None and retention_config.action not in ("delete", "tier"):
+            raise ValueError(
+                f"Invalid retention action {retention_config.action} for {name}, "
+                "expected delete or tier"
+            )
+
+        if component.get("TABLE_PARTITIONING", None) not in (None, "month"):
+            raise ValueError(
+                f"Invalid table partitioning {component['TABLE_PARTITIONING']} for {name}, "
+                "expected month"
+            )
+
+        if component.get("STORAGE_CODEC", None) not in (None, "zstd", "gzip"):
+            raise ValueError(
+                f"Invalid storage codec {component['STORAGE_CODEC']} for {name}, "
+                "expected zstd or gzip"
+            )
+
+        if component.get("SOURCE_CURSOR", "date") not in ("date", "id"):
+            raise ValueError(
+                f"Invalid source cursor {component['SOURCE_CURSOR']} for {name}, "
+                "expected date or id"
+            )
 
         component_configuration = ComponentConfiguration(
             name=name,
@@ -150,12 +219,16 @@ def extract_components(
             source_range=component.get("SOURCE_RANGE", None),
             source=None,
             parquetize=parquetize_config,
+            retention=retention_config,
+            table_partitioning=component.get("TABLE_PARTITIONING", None),
+            storage_codec=component.get("STORAGE_CODEC", None),
             dependencies=[],
             dependencies_limit=component.get(
                 "DEPENDENCIES_LIMIT",
                 [1 for _ in range(len(component.get("DEPENDENCIES", [])))],
             ),
             source_range_strict=component.get("SOURCE_RANGE_STRICT", True),
+            source_cursor=component.get("SOURCE_CURSOR", "date"),
             multiple_results=component.get("MULTIPLE_RESULTS", False),
             query_parameters=component.get("QUERY_PARAMETERS", None),
             optional_dependencies=[],
@@ -4,10 +4,23 @@ from typing import List, Optional, Dict, Self, Any
 from src.components import ComponentClass
 
 
+@dataclass
+class ComponentParquetizeLayoutConfig:
+    compression: str = "gzip"
+    compression_level: Optional[int] = 9
+    row_group_size: Optional[int] = None
+    sort: List[str] = field(default_factory=list)
+    statistics: Optional[List[str]] = None
+    bloom_filter: List[str] = field(default_factory=list)
+
+
 @dataclass
 class ComponentParquetizeGroupConfig:
     group: str
     keys: Optional[List[str]] = None
+    layout: ComponentParquetizeLayoutConfig = field(
+        default_factory=ComponentParquetizeLayoutConfig
+    )
 
 
 @dataclass
@@ -15,6 +28,20 @@ class ComponentParquetizeConfig:
     batch: str
     groups: List[ComponentParquetizeGroupConfig]
     schema: Dict[str, Any]
+    dictionary: List[str] = field(default_factory=list)
+    partitioning: str = "flat"
+    batch_layout: ComponentParquetizeLayoutConfig = field(
+        default_factory=lambda: ComponentParquetizeLayoutConfig(
+            compression="snappy", compression_level=None
+        )
+    )
+
+
+@dataclass
+class ComponentRetentionConfig:
+    keep: str
+    action: str = "delete"
+    tier: str = "Archive"
 
 
 @dataclass
@@ -30,7 +57,11 @@ class ComponentConfiguration:
     source: Optional[Self]
     source_range: Optional[str]
     parquetize: Optional[ComponentParquetizeConfig] = None
+    retention: Optional[ComponentRetentionConfig] = None
+    table_partitioning: Optional[str] = None
+    storage_codec: Optional[str] = None
     source_range_strict: bool = True
+    source_cursor: str = "date"
     multiple_results: bool = False
     query_parameters: Optional[Dict[str, str]] = None
     optional_dependencies: List[Self] = field(default_factory=list)
@@ -49,4 +80,5 @@ class ComponentsConfiguration:
     handlers: Dict[str, ComponentConfiguration]
     harvesters: Dict[str, ComponentConfiguration]
     collectors: Dict[str, ComponentConfiguration]
-    parquetize: Dict[str, ComponentConfiguration]
\ No newline at end of file
+    parquetize: Dict[str, ComponentConfiguration]
+    retention: Dict[str, ComponentConfiguration]
\ No newline at end of file
@@ -0,0 +1,239 @@
+import gzip
+import logging
+import secrets
+import threading
+from typing import Optional, Tuple
+
+import zstandard
+
+from src.data.storage import storage_manager
+
+logger = logging.getLogger("Codec")
+
+# Codecs the blobs of a component can be stored with (STORAGE_CODEC), recorded in the
+# type of their rows as "<data type>+<codec>" (e.g. "json+zstd")
+STORAGE_CODECS = ("zstd", "gzip")
+
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+
+# Snapshots of a component a zstd dictionary is trained on, the first ones it writes
+ZSTD_DICTIONARY_SAMPLES = 100
+
+# Training attempts of the zstd dictionary of a component, each on ZSTD_DICTIONARY_SAMPLES
+# more snapshots, before its blobs are compressed without one
+ZSTD_DICTIONARY_ATTEMPTS = 5
+
+# Upper bound of the size of the zstd dictionaries, in bytes (the zstd default)
+ZSTD_DICTIONARY_SIZE = 112640
+
+# Directory of the zstd dictionaries in the storage: <id> is read by the frames
+# compressed with a dictionary, <component> is the current one of a component
+ZSTD_DICTIONARY_DIRECTORY = "zstd_dictionaries"
+
+
+class _CachedDictionaries:
+    # Dictionaries by id, for decompression
+    dictionaries = {}
+    # Current dictionary of each component writing in this process (None if not trained)
+    current = {}
+    # Snapshots collected to train the dictionary of a component
+    samples = {}
+    # Lock of each component, held while its dictionary is read or trained
+    locks = {}
+    # Lock of the caches
+    lock = threading.Lock()
+
+
+def split_data_type(data_type: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Split the type of a row into its data type and the codec of its blob.
+    :param data_type: The type of the row (e.g. "json+zstd")
+    :return: The data type and the codec, None if the blob is not compressed
+    """
+    if data_type is None or "+" not in data_type:
+        return data_type, None
+
+    data_type, codec = data_type.rsplit("+", 1)
+    return data_type, codec
+
+
+def encode_blob(component_name: str, data: bytes, codec: str) -> bytes:
+    """
+    Compress a blob of a component. With zstd, the blob is compressed with the dictionary
+    of the component once trained on its first ZSTD_DICTIONARY_SAMPLES blobs, and without
+    one until then (the frame records which dictionary it needs, see decode_blob).
+    :param component_name: The component name
+    :param data: The blob
+    :param codec: One of STORAGE_CODECS
+    :return: The compressed blob
+    """
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+    if codec != "zstd":
+        raise ValueError(f"Unknown storage codec {codec}, expected one of {STORAGE_CODECS}")
+
+    dictionary = _current_dictionary(component_name, data)
+
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary).compress(data)
+
+
+def decode_blob(data: bytes, data_type: Optional[str]) -> bytes:
+    """
+    Decompress a blob according to the type of its row (see split_data_type).
+    :param data: The blob, as stored
+    :param data_type: The type of its row
+    :return: The blob, decompressed
+    """
+    _, codec = split_data_type(data_type)
+
+    if codec is None or not data:
+        return data
+
+    if codec == "gzip":
+        return gzip.decompress(data)
+
+    if codec != "zstd":
+        raise ValueError(f"Unknown storage codec {codec}, expected one of {STORAGE_CODECS}")
+
+    dictionary_id = zstandard.get_frame_parameters(data).dict_id
+    dictionary = _dictionary(dictionary_id) if dictionary_id else None
+
+    return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(data)
+
+
+def _dictionary(dictionary_id: int) -> zstandard.ZstdCompressionDict:
+    """Get a zstd dictionary by id, read from the storage once per process."""
+    dictionary = _CachedDictionaries.dictionaries.get(dictionary_id)
+
+    if dictionary is None:
+        data = storage_manager.read(
+            storage_manager.url(f"{ZSTD_DICTIONARY_DIRECTORY}/{dictionary_id}")
+        )
+
+        # Read outside the lock, a concurrent read of the same id keeps the first one
+        with _CachedDictionaries.lock:
+            dictionary = _CachedDictionaries.dictionaries.setdefault(
+                dictionary_id, zstandard.ZstdCompressionDict(data)
+            )
+
+    return dictionary
+
+
+def _current_dictionary(
+    component_name: str, data: bytes
+) -> Optional[zstandard.ZstdCompressionDict]:
+    """
+    Get the current zstd dictionary of a component, read from the storage on the first
+    write of the process. Without one, the blob is kept as a training sample, and the
+    dictionary is trained once ZSTD_DICTIONARY_SAMPLES were collected, again on the
+    samples collected since if the training fails (up to ZSTD_DICTIONARY_ATTEMPTS times).
+    The writes of a component wait for its training, not the other reads and writes.
+    """
+    with _CachedDictionaries.lock:
+        component_lock = _CachedDictionaries.locks.setdefault(component_name, threading.Lock())
+
+    with component_lock:
+        if component_name not in _CachedDictionaries.current:
+            dictionary = _stored_dictionary(component_name)
+
+            if dictionary is None:
+                _CachedDictionaries.samples[component_name] = []
+
+            _CachedDictionaries.current[component_name] = dictionary
+
+        samples = _CachedDictionaries.samples.get(component_name)
+
+        if _CachedDictionaries.current[component_name] is None and samples is not None:
+            samples.append(data)
+
+            if len(samples) % ZSTD_DICTIONARY_SAMPLES == 0:
+                dictionary = _train_dictionary(component_name, samples)
+
+                if (
+                    dictionary is not None
+                    or len(samples) >= ZSTD_DICTIONARY_SAMPLES * ZSTD_DICTIONARY_ATTEMPTS
+                ):
+                    del _CachedDictionaries.samples[component_name]
+                    _CachedDictionaries.current[component_name] = dictionary
+
+        return _CachedDictionaries.current[component_name]
+
+
+def _stored_dictionary(component_name: str) -> Optional[zstandard.ZstdCompressionDict]:
+    """
+    Read the current zstd dictionary of a component from the storage.
+    :return: The dictionary, or None if the component has none yet
+    """
+    try:
+        data = storage_manager.read(
+            storage_manager.url(f"{ZSTD_DICTIONARY_DIRECTORY}/{component_name}")
+        )
+    except FileNotFoundError:
+        return None
+
+    dictionary = zstandard.ZstdCompressionDict(data)
+    # Prepared once, instead of by every compressor using it
+    dictionary.precompute_compress(level=ZSTD_LEVEL)
+
+    with _CachedDictionaries.lock:
+        _CachedDictionaries.dictionaries[dictionary.dict_id()] = dictionary
+
+    return dictionary
+
+
+def _train_dictionary(
+    component_name: str, samples: list
+) -> Optional[zstandard.ZstdCompressionDict]:
+    """
+    Train the zstd dictionary of a component on samples of its blobs, then store it
+    under its id (for decompression) and as the current dictionary of the component.
+    Both are only created, never overwritten: if another process stored the dictionary
+    of the component meanwhile, that one is used instead.
+    :return: The dictionary, or None if the samples are not enough to train one
+    """
+    while True:
+        # Ids are random, as the dictionaries of different components share the directory,
+        # out of the ranges the zstd format reserves (below 32768 and from 2**31)
+        dictionary_id = secrets.randbelow(2**31 - 32768) + 32768
+
+        try:
+            dictionary = zstandard.train_dictionary(
+                min(ZSTD_DICTIONARY_SIZE, sum(len(sample) for sample in samples) // 10),
+                samples,
+                dict_id=dictionary_id,
+                level=ZSTD_LEVEL,
+            )
+        except zstandard.ZstdError as e:
+            logger.warning(f"Cannot train a zstd dictionary for {component_name}: {e}")
+            return None
+
+        # Stored by id first, so no blob compressed with it is written before it can be read
+        try:
+            storage_manager.create(
+                f"{ZSTD_DICTIONARY_DIRECTORY}/{dictionary_id}", dictionary.as_bytes()
+            )
+            break
+        except FileExistsError:
+            logger.warning(f"The zstd dictionary id {dictionary_id} is taken, drawing another")
+
+    try:
+        storage_manager.create(
+            f"{ZSTD_DICTIONARY_DIRECTORY}/{component_name}", dictionary.as_bytes()
+        )
+    except FileExistsError:
+        logger.info(f"Using the zstd dictionary stored meanwhile for {component_name}")
+        return _stored_dictionary(component_name)
+
+    # Prepared once, instead of by every compressor using it
+    dictionary.precompute_compress(level=ZSTD_LEVEL)
+
+    with _CachedDictionaries.lock:
+        _CachedDictionaries.dictionaries[dictionary_id] = dictionary
+
+    logger.info(
+        f"Trained a zstd dictionary of {len(dictionary.as_bytes())} bytes for {component_name}"
+    )
+
+    return dictionary
@@ -0,0 +1,186 @@
+import logging
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import Table, func, select, text
+from sqlalchemy.exc import DBAPIError
+
+from src.data.engine import engine
+
+logger = logging.getLogger("Partition")
+
+# Monthly partitions created ahead of the current month by sync_db_from_configuration
+PARTITION_MONTHS_AHEAD = 1
+
+# Key of Table.info set on the tables range partitioned by month
+PARTITIONED_INFO_KEY = "partitioned"
+
+
+class _CachedPartitions:
+    partitions = set()
+
+
+def month_start(date: datetime) -> datetime:
+    """
+    Get the first instant of the month of a date.
+    :param date: The date
+    :return: The start of the month
+    """
+    return date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month_start(date: datetime) -> datetime:
+    """
+    Get the first instant of the month following the month of a date.
+    :param date: The date
+    :return: The start of the next month
+    """
+    start = month_start(date)
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+def partition_name(table_name: str, date: datetime) -> str:
+    """
+    Get the name of the monthly partition of a table holding a date.
+    :param table_name: The (partitioned) table name
+    :param date: The date
+    :return: The partition name, e.g. stib_vehicle_distance_p202405
+    """
+    return f"{table_name}_p{date.strftime('%Y%m')}"
+
+
+def is_partitioned(table: Table) -> bool:
+    """
+    Whether a table was created range partitioned (see sync_db_from_configuration).
+    :param table: The table
+    :return: Whether the table is partitioned
+    """
+    return table.info.get(PARTITIONED_INFO_KEY, False)
+
+
+def is_partitioned_in_database(table_name: str) -> bool:
+    """
+    Whether a table of the database is a partitioned table (Postgres only). Tables
+    created before their partitioning was configured are not, as a table cannot be
+    partitioned once created.
+    :param table_name: The table name
+    :return: Whether the table is partitioned
+    """
+    if engine.dialect.name != "postgresql":
+        return False
+
+    with engine.connect() as connection:
+        return (
+            connection.execute(
+                text(
+                    "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)"
+                ),
+                {"name": f'"{table_name}"'},
+            ).fetchone()
+            is not None
+        )
+
+
+def ensure_partition(table: Table, date: datetime):
+    """
+    Create the monthly partition of a partitioned table holding a date, if it does not
+    exist yet. Created partitions are cached by the process, so a write only costs a
+    statement on the first date of each month.
+    :param table: The partitioned table
+    :param date: The date
+    """
+    start = month_start(date)
+
+    if (table.name, start) in _CachedPartitions.partitions:
+        return
+
+    name = partition_name(table.name, start)
+
+    with engine.connect() as connection:
+        try:
+            connection.execute(
+                text(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table.name}" '
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{next_month_start(start).isoformat()}')"
+                )
+            )
+            connection.commit()
+        except DBAPIError as e:
+            # Another process created it at the same time
+            connection.rollback()
+            if (
+                connection.execute(
+                    select(func.to_regclass(f'"{name}"'))
+                ).scalar()
+                is None
+            ):
+                raise e
+
+    _CachedPartitions.partitions.add((table.name, start))
+
+
+def is_missing_partition_error(error: DBAPIError) -> bool:
+    """
+    Whether a failed insert into a partitioned table had no partition for its row.
+    :param error: The error of the insert
+    :return: Whether the partition of the row is missing
+    """
+    # check_violation, raised for a row no partition accepts
+    return getattr(error.orig, "pgcode", None) == "23514"
+
+
+def forget_partition(table: Table, date: datetime):
+    """
+    Remove the monthly partition of a date from the partitions cached by the process,
+    e.g. once it was dropped by another process (see drop_partition), so that the next
+    ensure_partition creates it again.
+    :param table: The partitioned table
+    :param date: The date
+    """
+    _CachedPartitions.partitions.discard((table.name, month_start(date)))
+
+
+def list_partitions(table: Table) -> List[Tuple[str, datetime, datetime]]:
+    """
+    Get the monthly partitions of a partitioned table.
+    :param table: The partitioned table
+    :return: The (name, start, end) of the partitions, ordered by start
+    """
+    with engine.connect() as connection:
+        names = connection.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass(:name)"
+            ),
+            {"name": f'"{table.name}"'},
+        ).scalars()
+
+        partitions = []
+
+        for name in names:
+            suffix = name[len(table.name) + 2 :]
+            start = datetime.strptime(suffix, "%Y%m")
+            partitions.append((name, start, next_month_start(start)))
+
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def drop_partition(table: Table, name: str):
+    """
+    Detach and drop a partition of a partitioned table, with its rows. The other
+    processes may still have it cached, their writes into it create it again (see
+    write_result).
+    :param table: The partitioned table
+    :param name: The partition name
+    """
+    with engine.connect() as connection:
+        connection.execute(text(f'ALTER TABLE "{table.name}" DETACH PARTITION "{name}"'))
+        connection.execute(text(f'DROP TABLE "{name}"'))
+        connection.commit()
+
+    _CachedPartitions.partitions = {
+        partition
+        for partition in _CachedPartitions.partitions
+        if partition_name(*partition) != name
+    }
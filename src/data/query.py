@@ -0,0 +1,355 @@
+import concurrent.futures
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pa_fs
+import pyarrow.parquet as pq
+from sqlalchemy import Table, select, func
+
+from src.configuration.model import ComponentConfiguration
+from src.data.engine import engine
+from src.data.storage import FileStorageManager, storage_manager
+from src.utilities.parquet_schema import (
+    DATASET_METADATA_NAME,
+    DATE_COLUMN,
+    DATE_TYPE,
+    PERIOD_START_PARTITION,
+    hive_directory,
+    parquetize_arrow_schema,
+)
+
+# Parquetize files are read concurrently by this many threads
+QUERY_READ_WORKERS = 8
+
+
+def select_parquetize_files(
+    parquetize_table: Table,
+    start_date: datetime,
+    end_date: datetime,
+    filters: Dict[str, list] = None,
+) -> List[Tuple[datetime, datetime, str]]:
+    """
+    Select the smallest set of parquetize files holding the records between two dates.
+    Coarser aggregations are preferred, a period of an aggregation being skipped when
+    coarser periods cover it. Keyed aggregations are only used when the filters give
+    the values of all their keys, in which case only the matching files are selected.
+    :param parquetize_table: The parquetize table of a component
+    :param start_date: The start date (excluded)
+    :param end_date: The end date (included)
+    :param filters: The accepted values of some columns
+    :return: The (start date, end date, URL) of the files, ordered by date
+    """
+    filters = filters or {}
+
+    with engine.connect() as connection:
+        # Periods of an aggregation follow each other, so the first one gives their length
+        periods = {
+            aggregation: end - start
+            for aggregation, start, end in connection.execute(
+                select(
+                    parquetize_table.c.aggregation,
+                    func.min(parquetize_table.c.start_date),
+                    func.min(parquetize_table.c.end_date),
+                ).group_by(parquetize_table.c.aggregation)
+            ).fetchall()
+        }
+
+        if not periods:
+            return []
+
+        longest_period = max(periods.values())
+
+        rows = connection.execute(
+            select(
+                parquetize_table.c.data,
+                parquetize_table.c.start_date,
+                parquetize_table.c.end_date,
+                parquetize_table.c.aggregation,
+                parquetize_table.c["keys"],
+            )
+            .where(parquetize_table.c.start_date <= end_date)
+            .where(parquetize_table.c.end_date >= start_date - longest_period)
+            .order_by(parquetize_table.c.start_date.asc())
+        ).fetchall()
+
+    # The files of each period of each usable aggregation
+    aggregations: Dict[str, Dict[tuple, List[str]]] = {}
+    unusable = set()
+
+    for row in rows:
+        # Bounds are inclusive when aggregating, so a file holds records up to the periods
+        # of the finer aggregations after its end (less than its own period)
+        if row.aggregation in unusable or row.end_date + periods[row.aggregation] < start_date:
+            continue
+
+        if row.keys and not row.keys.keys() <= filters.keys():
+            unusable.add(row.aggregation)
+            aggregations.pop(row.aggregation, None)
+            continue
+
+        files = aggregations.setdefault(row.aggregation, {}).setdefault(
+            (row.start_date, row.end_date), []
+        )
+
+        # A period of a keyed aggregation is covered even if no file matches the filters
+        if not row.keys or all(
+            str(value) in {str(accepted) for accepted in filters[key]}
+            for key, value in row.keys.items()
+        ):
+            files.append(row.data)
+
+    covered = []
+    selected = []
+
+    for aggregation in sorted(aggregations, key=periods.get, reverse=True):
+        for (start, end), files in aggregations[aggregation].items():
+            if _is_covered(covered, start, end):
+                continue
+
+            covered.append((start, end))
+            selected.extend((start, end, url) for url in files)
+
+    return sorted(selected, key=lambda item: (item[0], item[1]))
+
+
+def _is_covered(covered: List[tuple], start: datetime, end: datetime) -> bool:
+    """Whether a period is within the union of periods."""
+    position = start
+
+    for covered_start, covered_end in sorted(covered):
+        if covered_start <= position < covered_end:
+            position = covered_end
+        if position >= end:
+            return True
+
+    return False
+
+
+def query_parquetize(
+    parquetize_table: Table,
+    start_date: datetime,
+    end_date: datetime,
+    columns: Optional[List[str]] = None,
+    filters: Dict[str, list] = None,
+) -> Optional[pa.Table]:
+    """
+    Query the records of the parquetize files of a component between two dates. The
+    files are selected with the parquetize table (see select_parquetize_files) and read
+    with only the requested columns, the date range and the filters being pushed down
+    to skip the row groups whose statistics do not match. A snapshot held by files of
+    several periods (on their bounds) is only returned once.
+    :param parquetize_table: The parquetize table of a component
+    :param start_date: The start date (excluded)
+    :param end_date: The end date (included)
+    :param columns: The columns to return, all of them if None
+    :param filters: The accepted values of some columns
+    :return: The records, or None if no file covers the range
+    :raises ValueError: If a column is not in the schema of the component, or a value
+    cannot be cast to the type of its column
+    """
+    filters = filters or {}
+    schema = _parquetize_schema(parquetize_table)
+
+    if schema is None:
+        return None
+
+    filter_values = _validate_query(schema, columns, filters)
+    files = select_parquetize_files(parquetize_table, start_date, end_date, filters)
+
+    if not files:
+        return None
+
+    read_columns = None
+
+    if columns is not None:
+        read_columns = list(dict.fromkeys(list(columns) + [DATE_COLUMN]))
+
+    def read(file):
+        return _read_parquetize_file(
+            file[2], read_columns, start_date, end_date, filter_values
+        )
+
+    tables = []
+    seen_dates = np.array([], dtype=np.int64)
+    period = None
+    period_dates = []
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=QUERY_READ_WORKERS
+    ) as executor:
+        for (start, end, _), table in zip(files, executor.map(read, files)):
+            # The files of a period (keyed partitions) share their snapshots
+            if (start, end) != period:
+                for dates in period_dates:
+                    seen_dates = np.union1d(seen_dates, dates)
+                period = (start, end)
+                period_dates = []
+
+            dates = table[DATE_COLUMN].cast(pa.int64()).to_numpy()
+            duplicated = np.isin(dates, seen_dates)
+
+            if duplicated.any():
+                table = table.filter(pa.array(~duplicated))
+
+            period_dates.append(dates)
+            tables.append(table)
+
+    result = pa.concat_tables(tables, promote_options="permissive")
+
+    if columns is None:
+        return result
+
+    # Columns declared after all the files read were written
+    for column_name in columns:
+        if column_name not in result.column_names:
+            field = schema.field(column_name)
+            result = result.append_column(field, pa.nulls(result.num_rows, field.type))
+
+    return result.select(columns)
+
+
+def _parquetize_schema(parquetize_table: Table) -> Optional[pa.Schema]:
+    """Get the Arrow schema of the records of the latest parquetize file of a component."""
+    with engine.connect() as connection:
+        schema = connection.execute(
+            select(parquetize_table.c.schema)
+            .order_by(parquetize_table.c.end_date.desc())
+            .limit(1)
+        ).scalar()
+
+    return None if schema is None else parquetize_arrow_schema(schema)
+
+
+def _validate_query(
+    schema: pa.Schema, columns: Optional[List[str]], filters: Dict[str, list]
+) -> Dict[str, pa.Array]:
+    """
+    Check the columns of a query against the schema of the records, and cast the values
+    of its filters to the types of their columns (e.g. when given as query parameters).
+    :param schema: The schema of the records
+    :param columns: The columns to return
+    :param filters: The accepted values of some columns
+    :return: The accepted values of the filtered columns, cast
+    :raises ValueError: If a column is unknown or a value cannot be cast
+    """
+    unknown = [
+        column_name
+        for column_name in list(columns or []) + list(filters)
+        if column_name not in schema.names
+    ]
+
+    if unknown:
+        raise ValueError(f"Unknown columns {unknown}, the columns are {schema.names}")
+
+    filter_values = {}
+
+    for column_name, values in filters.items():
+        try:
+            filter_values[column_name] = _cast_values(values, schema.field(column_name).type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Invalid values {values} for the column {column_name}: {e}")
+
+    return filter_values
+
+
+def _cast_values(values, field_type: pa.DataType) -> pa.Array:
+    """Cast values to the (value) type of a column, stringified for a string column."""
+    if pa.types.is_dictionary(field_type):
+        field_type = field_type.value_type
+
+    if pa.types.is_string(field_type):
+        return pa.array([str(value) for value in values]).cast(field_type)
+
+    return pa.array(values).cast(field_type)
+
+
+def _read_parquetize_file(
+    url: str,
+    columns: Optional[List[str]],
+    start_date: datetime,
+    end_date: datetime,
+    filters: Dict[str, pa.Array],
+) -> pa.Table:
+    data = storage_manager.read_buffer(url)
+    schema = pq.read_schema(pa.BufferReader(data))
+
+    expression = (pc.field(DATE_COLUMN) > pa.scalar(start_date, DATE_TYPE)) & (
+        pc.field(DATE_COLUMN) <= pa.scalar(end_date, DATE_TYPE)
+    )
+
+    for column_name, values in filters.items():
+        if column_name not in schema.names:
+            # Written before the column was declared, none of its records match
+            expression = pc.scalar(False)
+            break
+
+        try:
+            values = _cast_values(values.to_pylist(), schema.field(column_name).type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Invalid values for the column {column_name} of {url}: {e}")
+
+        expression &= pc.field(column_name).isin(values)
+
+    if columns is not None:
+        columns = [column_name for column_name in columns if column_name in schema.names]
+
+    return pq.read_table(pa.BufferReader(data), columns=columns, filters=expression)
+
+
+def parquetize_dataset(
+    component_config: ComponentConfiguration,
+    aggregation: str,
+    filesystem: pa_fs.FileSystem = None,
+    root: str = None,
+) -> ds.Dataset:
+    """
+    Open the files of an aggregation written with the "hive" partitioning as a pyarrow
+    dataset, planned from its _metadata summary: no file is listed nor opened before
+    the scan, and the period_start and key partitions prune the files of a filtered scan.
+    :param component_config: The component configuration
+    :param aggregation: The aggregation (batch or group, e.g. "1d")
+    :param filesystem: The filesystem of the files, the local one if None
+    :param root: The root of the storage in the filesystem (e.g. the container with a blob
+    storage filesystem), the storage directory if None and the storage is local
+    :return: The dataset
+    :raises ValueError: If no root is given and the storage is not local
+    """
+    parquetize_config = component_config.parquetize
+    schema = parquetize_arrow_schema(
+        parquetize_config.schema, parquetize_config.dictionary
+    )
+    if root is None:
+        if filesystem is not None or not isinstance(storage_manager, FileStorageManager):
+            raise ValueError(
+                "The storage is not local, the filesystem and the root of the storage in it "
+                "(e.g. the container) must be given"
+            )
+        root = storage_manager.directory
+
+    directory = f"{root}/{hive_directory(component_config.name, aggregation)}"
+
+    keys = next(
+        (group.keys or [] for group in parquetize_config.groups if group.group == aggregation),
+        [],
+    )
+    partition_fields = [pa.field(PERIOD_START_PARTITION, pa.date32())]
+
+    for key in keys:
+        # Keys are file columns too, the partition only has their values
+        field_type = schema.field(key).type
+        if pa.types.is_dictionary(field_type):
+            field_type = field_type.value_type
+        partition_fields.append(pa.field(key, field_type))
+
+    return ds.parquet_dataset(
+        f"{directory}/{DATASET_METADATA_NAME}",
+        # The schema is given, since the partition and file types of the keys differ
+        schema=schema.append(partition_fields[0]),
+        filesystem=filesystem,
+        partitioning=ds.partitioning(pa.schema(partition_fields), flavor="hive"),
+        partition_base_dir=directory,
+    )
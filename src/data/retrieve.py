@@ -1,5 +1,6 @@
+import base64
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Union, List, Optional
 
@@ -7,6 +8,7 @@ from sqlalchemy import Table, select
 from sqlalchemy.orm import aliased
 from sqlalchemy.sql.functions import coalesce
 
+from src.data.codec import decode_blob, split_data_type
 from src.data.engine import engine
 from src.data.storage import storage_manager
 
@@ -16,18 +18,104 @@ class Data:
     date: datetime
     _url: str
     _data_type: str = None
+    id: Optional[int] = None
+    hash: Optional[str] = None
+    # Blob downloaded ahead by prefetch_data
+    _bytes: Optional[bytes] = field(default=None, repr=False, compare=False)
 
     @property
     def data(self) -> Union[str, bytes]:
-        bytes_data = storage_manager.read(self._url)
+        bytes_data = decode_blob(
+            self._bytes if self._bytes is not None else storage_manager.read(self._url),
+            self._data_type,
+        )
+        data_type, _ = split_data_type(self._data_type)
 
-        if self._data_type == "json":
+        if data_type == "json":
             return json.loads(bytes_data)
-        elif self._data_type == "text":
+        elif data_type == "text":
             return bytes_data.decode("utf-8")
 
         return bytes_data
 
+    @property
+    def buffer(self):
+        """
+        The raw data as a read-only buffer, memory-mapped when the storage is local (see
+        StorageManager.read_buffer), for the readers accepting one (e.g. pa.BufferReader).
+        Data stored compressed is decompressed to memory.
+        """
+        if self._bytes is not None:
+            return decode_blob(self._bytes, self._data_type)
+
+        if split_data_type(self._data_type)[1] is not None:
+            return decode_blob(storage_manager.read(self._url), self._data_type)
+
+        return storage_manager.read_buffer(self._url)
+
+    @property
+    def path(self) -> Optional[str]:
+        """
+        A path of the raw data on the local file system, or None if the storage is not
+        local (see StorageManager.local_path) or the data is stored compressed.
+        """
+        if split_data_type(self._data_type)[1] is not None:
+            return None
+
+        return storage_manager.local_path(self._url)
+
+
+@dataclass
+class Cursor:
+    """
+    Continuation point of a paginated query: everything up to `date` has been returned,
+    and if `id` is set, rows at exactly `date` have been returned up to that id.
+    """
+
+    date: datetime
+    id: Optional[int] = None
+
+    def encode(self) -> str:
+        """
+        Encode the cursor as an opaque, URL-safe token.
+        :return: The token
+        """
+        payload = json.dumps({"date": self.date.isoformat(), "id": self.id})
+        return base64.urlsafe_b64encode(payload.encode("utf-8")).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, token: str) -> "Cursor":
+        """
+        Decode a token produced by `encode`.
+        :param token: The token
+        :return: The cursor
+        :raises ValueError: If the token is malformed
+        """
+        try:
+            payload = json.loads(
+                base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            )
+            return cls(
+                date=datetime.fromisoformat(payload["date"]),
+                id=None if payload["id"] is None else int(payload["id"]),
+            )
+        except (KeyError, TypeError, UnicodeDecodeError) as e:
+            raise ValueError(f"Invalid cursor: {token}") from e
+
+
+def prefetch_data(datas: List[Data]):
+    """
+    Download the blobs of rows at once, their downloads being pipelined (see
+    StorageManager.read_many), so reading their data does not wait on the storage.
+    :param datas: The rows
+    """
+    pending = [data for data in datas if data._bytes is None and data._url is not None]
+
+    for data, bytes_data in zip(
+        pending, storage_manager.read_many([data._url for data in pending])
+    ):
+        data._bytes = bytes_data
+
 
 def data_result(func) -> Optional[Union[Data, List[Data]]]:
     def wrapper(*args, **kwargs):
@@ -38,10 +126,23 @@ def data_result(func) -> Optional[Union[Data, List[Data]]]:
 
         # If the result is a single row, return a single Data object
         if not isinstance(result, list):
-            return Data(date=result.date, _url=result.data, _data_type=result.type)
+            return Data(
+                date=result.date,
+                _url=result.data,
+                _data_type=result.type,
+                id=result.id,
+                hash=result.hash,
+            )
 
         return [
-            Data(date=row.date, _url=row.data, _data_type=row.type) for row in result
+            Data(
+                date=row.date,
+                _url=row.data,
+                _data_type=row.type,
+                id=row.id,
+                hash=row.hash,
+            )
+            for row in result
         ]
 
     return wrapper
@@ -63,6 +164,7 @@ def base_query(table: Table, with_null: bool = False):
         table.c.date,
         coalesce(t2.c.data, table.c.data).label("data"),
         table.c.type,
+        coalesce(t2.c.hash, table.c.hash).label("hash"),
     )
 
     if not with_null:
@@ -126,13 +228,30 @@ def retrieve_before_datetime(table: Table, date: datetime, limit: int) -> List[D
 
 @data_result
 def retrieve_between_datetime(
-    table: Table, start_date: datetime, end_date: datetime, limit: int
+    table: Table,
+    start_date: datetime,
+    end_date: datetime,
+    limit: int,
+    end_included: bool = False,
 ) -> List[Data]:
+    """
+    Get the rows between two dates ordered by date.
+    :param table: The table
+    :param start_date: The start date (excluded), None for no start
+    :param end_date: The end date (excluded unless end_included), None for no end
+    :param limit: The maximum number of rows, None for no limit
+    :param end_included: Whether the rows at the end date are included, e.g. for the
+    (start, end] periods of harvesters
+    :return: The rows
+    """
+    if end_date is not None:
+        before_end = (table.c.date <= end_date) if end_included else (table.c.date < end_date)
+
     with engine.connect() as connection:
         if start_date is None:
             return connection.execute(
                 base_query(table)
-                .where(table.c.date < end_date)
+                .where(before_end)
                 .order_by(table.c.date.asc())
                 .limit(limit)
             ).fetchall()
@@ -147,12 +266,44 @@ def retrieve_between_datetime(
             return connection.execute(
                 base_query(table)
                 .where(table.c.date > start_date)
-                .where(table.c.date < end_date)
+                .where(before_end)
                 .order_by(table.c.date.asc())
                 .limit(limit)
             ).fetchall()
 
 
+@data_result
+def retrieve_after_id(
+    table: Table,
+    after_id: int,
+    limit: Optional[int],
+    after_date: Optional[datetime] = None,
+    until_date: Optional[datetime] = None,
+) -> List[Data]:
+    """
+    Get the rows after an id ordered by id, the keyset of a source read by id (see the
+    SOURCE_CURSOR of harvesters). Unlike date comparisons, no row is skipped or read twice
+    when several rows share a date.
+    :param table: The table
+    :param after_id: The id of the last row read (excluded)
+    :param limit: The maximum number of rows, None for no limit
+    :param after_date: If set, only the rows after this date (excluded)
+    :param until_date: If set, only the rows up to this date (included)
+    :return: The rows
+    """
+    query = base_query(table).where(table.c.id > after_id)
+
+    if after_date is not None:
+        query = query.where(table.c.date > after_date)
+    if until_date is not None:
+        query = query.where(table.c.date <= until_date)
+
+    with engine.connect() as connection:
+        return connection.execute(
+            query.order_by(table.c.id.asc()).limit(limit)
+        ).fetchall()
+
+
 @data_result
 def retrieve_latest_rows_before_datetime(
     table: Table, date: datetime, limit: int
@@ -164,3 +315,38 @@ def retrieve_latest_rows_before_datetime(
             .order_by(table.c.date.desc())
             .limit(limit)
         ).fetchall()
+
+
+@data_result
+def retrieve_page_between_datetime(
+    table: Table,
+    start_date: datetime,
+    end_date: datetime,
+    limit: int,
+    after_id: Optional[int] = None,
+) -> List[Data]:
+    """
+    Get the rows between two dates ordered by (date, id). Unlike `retrieve_between_datetime`,
+    the order is total so the last row of a full page can be used as a keyset cursor.
+    :param table: The table
+    :param start_date: The start date (excluded)
+    :param end_date: The end date (included)
+    :param limit: The maximum number of rows
+    :param after_id: If set, rows at exactly start_date with a greater id are included
+    :return: The rows
+    """
+    after_start = table.c.date > start_date
+
+    if after_id is not None:
+        after_start = after_start | (
+            (table.c.date == start_date) & (table.c.id > after_id)
+        )
+
+    with engine.connect() as connection:
+        return connection.execute(
+            base_query(table)
+            .where(after_start)
+            .where(table.c.date <= end_date)
+            .order_by(table.c.date.asc(), table.c.id.asc())
+            .limit(limit)
+        ).fetchall()
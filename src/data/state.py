@@ -0,0 +1,168 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import Connection, MetaData, Table, case, func, insert, select, update
+
+from src.data.engine import engine
+from src.data.table import load_component_state_table
+
+state_metadata = MetaData()
+component_state_table = load_component_state_table(state_metadata)
+
+
+@dataclass
+class ComponentState:
+    name: str
+    first_date: Optional[datetime]
+    last_date: Optional[datetime]
+    last_id: Optional[int]
+    count: int
+    source_id: Optional[int] = None
+    source_date: Optional[datetime] = None
+
+
+def retrieve_component_state(name: str) -> Optional[ComponentState]:
+    """
+    Get the state of a component (see load_component_state_table).
+    :param name: The component name
+    :return: The state, or None if the component has none yet
+    """
+    with engine.connect() as connection:
+        row = connection.execute(
+            select(component_state_table).where(component_state_table.c.name == name)
+        ).fetchone()
+
+    return ComponentState(**row._mapping) if row else None
+
+
+def update_component_state(
+    connection: Connection,
+    name: str,
+    date: datetime,
+    row_id: int,
+    with_data: bool,
+    source_id: Optional[int] = None,
+    source_date: Optional[datetime] = None,
+):
+    """
+    Update the state of a component with a row written to its table. Executed in the
+    transaction of the write, so the state always matches the table.
+    :param connection: The connection of the write
+    :param name: The component name
+    :param date: The date of the row
+    :param row_id: The id of the row
+    :param with_data: Whether the row has data (is not a null row)
+    :param source_id: The id of the last source row processed, if any
+    :param source_date: The date of the last source row processed, if any
+    """
+    state = component_state_table
+    is_last = state.c.last_date.is_(None) | (state.c.last_date <= date)
+    values = {
+        "last_date": case((is_last, date), else_=state.c.last_date),
+        "last_id": case((is_last, row_id), else_=state.c.last_id),
+        "count": state.c.count + 1,
+    }
+
+    if with_data:
+        values["first_date"] = case(
+            (state.c.first_date.is_(None) | (state.c.first_date > date), date),
+            else_=state.c.first_date,
+        )
+
+    if source_id is not None:
+        values["source_id"] = source_id
+        values["source_date"] = source_date
+
+    result = connection.execute(update(state).where(state.c.name == name).values(**values))
+
+    if result.rowcount == 0:
+        connection.execute(
+            insert(state).values(
+                name=name,
+                first_date=date if with_data else None,
+                last_date=date,
+                last_id=row_id,
+                count=1,
+                source_id=source_id,
+                source_date=source_date,
+            )
+        )
+
+
+def update_released_component_state(name: str, table: Table, dropped_count: int = 0):
+    """
+    Update the state of a component after retention released rows of its table (nulled
+    their data) and dropped some of them with their partitions. The first date with data
+    is recomputed and the dropped rows are subtracted from the count. The last row is left
+    as is, as retention keeps the rows (and the partition of the latest one).
+    The state row is locked first (on PostgreSQL), so a write of the component waits for
+    the update instead of having its state overwritten with values read before it.
+    :param name: The component name
+    :param table: The component table
+    :param dropped_count: The number of rows dropped with their partitions
+    """
+    state = component_state_table
+
+    with engine.connect() as connection:
+        connection.execute(select(state.c.name).where(state.c.name == name).with_for_update())
+
+        first_date = connection.execute(
+            select(func.min(table.c.date)).where(
+                table.c.copy_id.isnot(None) | table.c.hash.isnot(None)
+            )
+        ).scalar()
+
+        connection.execute(
+            update(state)
+            .where(state.c.name == name)
+            .values(first_date=first_date, count=state.c.count - dropped_count)
+        )
+        connection.commit()
+
+
+def refresh_component_state(name: str, table: Table):
+    """
+    Recompute the state of a component from its table, for the tables written before the
+    state existed. It must not run while the component is written (see
+    update_released_component_state). The source of a harvester is kept.
+    :param name: The component name
+    :param table: The component table
+    """
+    state = component_state_table
+
+    with engine.connect() as connection:
+        first_date = connection.execute(
+            select(func.min(table.c.date)).where(
+                table.c.copy_id.isnot(None) | table.c.hash.isnot(None)
+            )
+        ).scalar()
+        last = connection.execute(
+            select(table.c.id, table.c.date).order_by(table.c.date.desc()).limit(1)
+        ).fetchone()
+        values = {
+            "first_date": first_date,
+            "last_date": last and last.date,
+            "last_id": last and last.id,
+            "count": connection.execute(select(func.count()).select_from(table)).scalar(),
+        }
+
+        result = connection.execute(update(state).where(state.c.name == name).values(**values))
+
+        if result.rowcount == 0:
+            connection.execute(insert(state).values(name=name, **values))
+
+        connection.commit()
+
+
+def initialize_component_states(tables: Dict[str, Table]):
+    """
+    Create the state of the components that have none, from their table.
+    :param tables: The component tables, by component name
+    """
+    with engine.connect() as connection:
+        existing = set(connection.execute(select(component_state_table.c.name)).scalars())
+
+    for name, table in tables.items():
+        if name not in existing:
+            refresh_component_state(name, table)
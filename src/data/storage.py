@@ -1,20 +1,342 @@
 import abc
+import asyncio
+import hashlib
+import mmap
 import os
+import re
+import tempfile
+import threading
+import uuid
+from typing import List, Optional, Tuple, Union
+from urllib.parse import unquote
 
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
 from azure.storage.blob import BlobServiceClient
+from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
+
+# Storage operations of a read_many or write_many call in flight at the same time
+STORAGE_CONCURRENCY = 32
+
+# Local directory of the read-through cache of the blobs (see CachingStorageManager),
+# disabled if not set
+STORAGE_CACHE_DIRECTORY = os.environ.get("STORAGE_CACHE_DIRECTORY")
+
+# Upper bound of the cached blobs on disk, in bytes
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get("STORAGE_CACHE_MAX_BYTES", 10 * 1024**3))
+
+# Share of STORAGE_CACHE_MAX_BYTES the cache is pruned down to when it exceeds it
+STORAGE_CACHE_PRUNE_RATIO = 0.9
+
+# Blobs rewritten in place, never cached since a rewrite only invalidates the cache of
+# the node writing it: the _metadata summaries of the hive datasets and the current zstd
+# dictionary of each component (the dictionaries stored by id never change)
+STORAGE_CACHE_EXCLUDED = re.compile(r"/_metadata$|/zstd_dictionaries/(?!\d+$)[^/]+$")
+
+
+class _CachedEventLoop:
+    # Event loop of the process running the async storage operations, in its own thread
+    loop = None
+    pid = None
+    lock = threading.Lock()
+
+
+def run_async(coroutine):
+    """
+    Run a coroutine on the storage event loop of the process and wait for its result.
+    The loop runs in a daemon thread started on the first call (and again in a forked
+    process, which does not inherit the thread), so the async clients it holds are
+    reused across calls and the coroutine can be run from any thread.
+    :param coroutine: The coroutine
+    :return: The result of the coroutine
+    """
+    with _CachedEventLoop.lock:
+        if _CachedEventLoop.pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True).start()
+
+            _CachedEventLoop.loop = loop
+            _CachedEventLoop.pid = os.getpid()
+
+    return asyncio.run_coroutine_threadsafe(coroutine, _CachedEventLoop.loop).result()
+
+
+class AsyncStorageManager(abc.ABC):
+    @abc.abstractmethod
+    async def write(self, file_name: str, data: bytes) -> str: ...
+
+    @abc.abstractmethod
+    async def read(self, file_name: str) -> bytes: ...
+
+    @abc.abstractmethod
+    async def delete(self, file_name: str): ...
+
+    async def read_many(self, file_names: List[str]) -> List[bytes]:
+        """
+        Read files concurrently, at most STORAGE_CONCURRENCY at a time.
+
+        :param file_names: Names of the files to read, as returned by write.
+        :return: Data read from the files, in the order of the names.
+        :raises FileNotFoundError: If a file does not exist.
+        """
+        return await self._gather(self.read, [(file_name,) for file_name in file_names])
+
+    async def write_many(self, files: List[Tuple[str, bytes]]) -> List[str]:
+        """
+        Write files concurrently, at most STORAGE_CONCURRENCY at a time.
+
+        :param files: Name and data of the files to create or update.
+        :return: Names of the files to read them, in the order of the files.
+        """
+        return await self._gather(self.write, files)
+
+    @staticmethod
+    async def _gather(function, arguments: List[tuple]) -> list:
+        semaphore = asyncio.Semaphore(STORAGE_CONCURRENCY)
+
+        async def call(*args):
+            async with semaphore:
+                return await function(*args)
+
+        return await asyncio.gather(*[call(*args) for args in arguments])
 
 
 class StorageManager(abc.ABC):
+    # Access tiers blobs can be moved to (see tier_many), none if the storage has no tiers
+    tiers = ()
+
+    # The async counterpart of the storage, behind read_many and write_many
+    aio: AsyncStorageManager
+
     @abc.abstractmethod
     def write(self, file_name: str, data: bytes): ...
 
+    @abc.abstractmethod
+    def create(self, file_name: str, data: bytes) -> str: ...
+
     @abc.abstractmethod
     def read(self, file_name: str) -> bytes: ...
 
     @abc.abstractmethod
     def delete(self, file_name: str): ...
 
+    @abc.abstractmethod
+    def url(self, file_name: str) -> str: ...
+
+    def read_buffer(self, file_name: str) -> Union[bytes, mmap.mmap]:
+        """
+        Read a file as a read-only buffer, given as is to the readers accepting one
+        (e.g. pa.BufferReader). Local files are memory-mapped instead of copied.
+
+        :param file_name: Name of the file to read, as returned by write.
+        :return: The buffer.
+        :raises FileNotFoundError: If the file does not exist.
+        """
+        return self.read(file_name)
+
+    def local_path(self, file_name: str) -> Optional[str]:
+        """
+        Get a path of a file on the local file system, for the readers opening files
+        by path (e.g. zip archives).
+
+        :param file_name: Name of the file, as returned by write.
+        :return: The path, or None if the storage is not local.
+        """
+        return None
+
+    def delete_many(self, file_names: List[str]):
+        """
+        Delete files, the missing ones being ignored.
+
+        :param file_names: Names of the files to delete, as returned by write.
+        """
+        for file_name in file_names:
+            try:
+                self.delete(file_name)
+            except FileNotFoundError:
+                pass
+
+    def tier_many(self, file_names: List[str], tier: str):
+        """
+        Move files to an access tier (e.g. "Archive").
+
+        :param file_names: Names of the files to move, as returned by write.
+        :param tier: One of the tiers of the storage.
+        """
+        raise NotImplementedError(f"{type(self).__name__} has no access tiers")
+
+    def read_many(self, file_names: List[str]) -> List[bytes]:
+        """
+        Read files, their downloads being pipelined on the async storage (see
+        AsyncStorageManager.read_many).
+
+        :param file_names: Names of the files to read, as returned by write.
+        :return: Data read from the files, in the order of the names.
+        :raises FileNotFoundError: If a file does not exist.
+        """
+        if not file_names:
+            return []
+
+        return run_async(self.aio.read_many(file_names))
+
+    def write_many(self, files: List[Tuple[str, bytes]]) -> List[str]:
+        """
+        Write files, their uploads being pipelined on the async storage (see
+        AsyncStorageManager.write_many).
+
+        :param files: Name and data of the files to create or update.
+        :return: Names of the files to read them (e.g. URLs), in the order of the files.
+        """
+        if not files:
+            return []
+
+        return run_async(self.aio.write_many(files))
+
+
+class AsyncAzureBlobManager(AsyncStorageManager):
+    def __init__(self, connection_string, container_name):
+        # The async Azure clients use aiohttp as transport, which fails on the first
+        # request otherwise
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                "The async Azure Blob Storage (read_many and write_many) requires aiohttp, "
+                "install it from requirements.txt"
+            ) from e
+
+        self.connection_string = connection_string
+        self.container_name = container_name
+        self._container_client = None
+        self._loop = None
+
+    @property
+    def container_client(self) -> AsyncContainerClient:
+        # The client (and its connection pool) is bound to the event loop it is used on
+        loop = asyncio.get_running_loop()
+
+        if self._loop is not loop:
+            self._container_client = AsyncContainerClient.from_connection_string(
+                self.connection_string, self.container_name
+            )
+            self._loop = loop
+
+        return self._container_client
+
+    async def write(self, file_name: str, data: bytes) -> str:
+        """
+        Write data to a blob in Azure Blob Storage.
+
+        :param file_name: Name of the blob to create or update.
+        :param data: Data to write to the blob.
+        :return: URL of the blob.
+        """
+        if data is None:
+            data = b""
+
+        blob_client = await self.container_client.upload_blob(
+            file_name, data, overwrite=True
+        )
+
+        return blob_client.url
+
+    async def read(self, file_name: str) -> bytes:
+        """
+        Read data from a blob in Azure Blob Storage.
+
+        :param file_name: URL of the blob, as returned by write.
+        :return: Data read from the blob as bytes.
+        :raises FileNotFoundError: If the blob does not exist.
+        """
+        try:
+            downloader = await self.container_client.download_blob(
+                _blob_name(file_name, self.container_name)
+            )
+            return await downloader.readall()
+        except ResourceNotFoundError as e:
+            raise FileNotFoundError(file_name) from e
+
+    async def delete(self, file_name: str):
+        """
+        Delete a blob in Azure Blob Storage.
+
+        :param file_name: URL of the blob, as returned by write.
+        """
+        await self.container_client.delete_blob(_blob_name(file_name, self.container_name))
+
+
+class AsyncFileStorageManager(AsyncStorageManager):
+    def __init__(self, storage: "FileStorageManager"):
+        self.storage = storage
+
+    # File operations are blocking, they are run in the threads of the event loop executor
+    async def write(self, file_name: str, data: bytes) -> str:
+        return await asyncio.to_thread(self.storage.write, file_name, data)
+
+    async def read(self, file_name: str) -> bytes:
+        return await asyncio.to_thread(self.storage.read, file_name)
+
+    async def delete(self, file_name: str):
+        await asyncio.to_thread(self.storage.delete, file_name)
+
+
+class AsyncCachingStorageManager(AsyncStorageManager):
+    def __init__(self, storage: "CachingStorageManager"):
+        self.storage = storage
+
+    # The cache is on the local disk, its blocking operations are run in the threads of
+    # the event loop executor
+    async def write(self, file_name: str, data: bytes) -> str:
+        url = await self.storage.storage.aio.write(file_name, data)
+        await asyncio.to_thread(self.storage._invalidate, url)
+        return url
+
+    async def read(self, file_name: str) -> bytes:
+        if not self.storage._is_cached(file_name):
+            return await self.storage.storage.aio.read(file_name)
+
+        data = await asyncio.to_thread(self.storage._read_cached, file_name)
+
+        if data is None:
+            data = await self.storage.storage.aio.read(file_name)
+            await asyncio.to_thread(self.storage._fill, file_name, data)
+
+        return data
+
+    async def delete(self, file_name: str):
+        await asyncio.to_thread(self.storage._invalidate, file_name)
+        await self.storage.storage.aio.delete(file_name)
+
+
+def _map_file(path: str) -> Union[bytes, mmap.mmap]:
+    """
+    Memory-map a file read-only. The mapping stays valid once the file is closed, and
+    after it is replaced or deleted (writes replace files, see FileStorageManager.write).
+    :param path: The path of the file
+    :return: The mapping, or empty bytes for an empty file (which cannot be mapped)
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _blob_name(url: str, container_name: str) -> str:
+    """
+    Get the name of a blob from its URL, as returned by write (the URL quotes it).
+    :param url: The URL of the blob
+    :param container_name: The container of the blob
+    :return: The blob name
+    """
+    return unquote(url.split(container_name + "/", 1)[1])
+
+
 class AzureBlobManager(StorageManager):
+    tiers = ("Hot", "Cool", "Cold", "Archive")
+
+    # Maximum number of sub-requests of a blob batch request
+    BATCH_SIZE = 256
+
     def __init__(self, connection_string, container_name):
         self.blob_service_client = BlobServiceClient.from_connection_string(
             connection_string
@@ -22,6 +344,18 @@ class AzureBlobManager(StorageManager):
         self.container_client = self.blob_service_client.get_container_client(
             container_name
         )
+        self.connection_string = connection_string
+        self._aio = None
+
+    @property
+    def aio(self) -> AsyncAzureBlobManager:
+        # Built on first use, so only the deployments using it require aiohttp
+        if self._aio is None:
+            self._aio = AsyncAzureBlobManager(
+                self.connection_string, self.container_client.container_name
+            )
+
+        return self._aio
 
     def write(self, file_name: str, data: bytes) -> str:
         """
@@ -41,18 +375,38 @@ class AzureBlobManager(StorageManager):
 
         return blob_client.url
 
+    def create(self, file_name: str, data: bytes) -> str:
+        """
+        Write data to a new blob in Azure Blob Storage, unless the blob already exists.
+
+        :param file_name: Name of the blob to create.
+        :param data: Data to write to the blob.
+        :return: URL of the blob.
+        :raises FileExistsError: If the blob already exists.
+        """
+        blob_client = self.container_client.get_blob_client(file_name)
+
+        try:
+            blob_client.upload_blob(data, overwrite=False)
+        except ResourceExistsError as e:
+            raise FileExistsError(blob_client.url) from e
+
+        return blob_client.url
+
     def read(self, file_name: str) -> bytes:
         """
         Read data from a blob in Azure Blob Storage.
 
         :param file_name: Name of the blob to read from.
         :return: Data read from the blob as bytes.
+        :raises FileNotFoundError: If the blob does not exist.
         """
-        blob_client = self.container_client.get_blob_client(
-            file_name.split(self.container_client.container_name + "/")[1]
-        )
-        blob_data = blob_client.download_blob().readall()
-        return blob_data
+        try:
+            return self.container_client.download_blob(
+                _blob_name(file_name, self.container_client.container_name)
+            ).readall()
+        except ResourceNotFoundError as e:
+            raise FileNotFoundError(file_name) from e
 
     def delete(self, file_name: str):
         """
@@ -60,14 +414,51 @@ class AzureBlobManager(StorageManager):
 
         :param file_name: Name of the blob to delete.
         """
-        blob_client = self.container_client.get_blob_client(
-            file_name.split(self.container_client.container_name + "/")[1]
+        self.container_client.delete_blob(
+            _blob_name(file_name, self.container_client.container_name)
         )
-        blob_client.delete_blob()
+
+    def url(self, file_name: str) -> str:
+        """
+        Get the URL of a blob, as returned by write.
+
+        :param file_name: Name of the blob.
+        :return: URL of the blob.
+        """
+        return self.container_client.get_blob_client(file_name).url
+
+    def delete_many(self, file_names: List[str]):
+        """
+        Delete blobs in Azure Blob Storage with batch requests, the missing ones being ignored.
+
+        :param file_names: Names of the blobs to delete, as returned by write.
+        """
+        for blobs in self._batches(file_names):
+            self.container_client.delete_blobs(*blobs, raise_on_any_failure=False)
+
+    def tier_many(self, file_names: List[str], tier: str):
+        """
+        Move blobs of Azure Blob Storage to an access tier with batch requests.
+
+        :param file_names: Names of the blobs to move, as returned by write.
+        :param tier: The access tier (Hot, Cool, Cold or Archive).
+        """
+        for blobs in self._batches(file_names):
+            self.container_client.set_standard_blob_tier_blobs(tier, *blobs)
+
+    def _batches(self, file_names: List[str]):
+        names = [
+            _blob_name(file_name, self.container_client.container_name)
+            for file_name in file_names
+        ]
+
+        for i in range(0, len(names), self.BATCH_SIZE):
+            yield names[i : i + self.BATCH_SIZE]
 
 class FileStorageManager(StorageManager):
     def __init__(self, directory):
         self.directory = directory
+        self.aio = AsyncFileStorageManager(self)
 
     def write(self, file_name: str, data: bytes) -> str:
         """
@@ -78,13 +469,51 @@ class FileStorageManager(StorageManager):
 
         :return: Path of the file.
         """
+        if data is None:
+            data = b""
+
         file_path = os.path.join(self.directory, file_name)
         # create directory if it does not exist
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
-        with open(file_path, "wb") as file:
+        # Written under a temporary name then renamed, so readers (memory-mapped ones
+        # included) never see a truncated file
+        tmp_path = os.path.join(
+            os.path.dirname(file_path), f".{os.path.basename(file_path)}.{uuid.uuid4().hex}"
+        )
+
+        with open(tmp_path, "wb") as file:
             file.write(data)
 
+        os.replace(tmp_path, file_path)
+
+        return file_path
+
+    def create(self, file_name: str, data: bytes) -> str:
+        """
+        Write data to a new file in the local file system, unless the file already exists.
+
+        :param file_name: Name of the file to create.
+        :param data: Data to write to the file.
+        :return: Path of the file.
+        :raises FileExistsError: If the file already exists.
+        """
+        file_path = os.path.join(self.directory, file_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        tmp_path = os.path.join(
+            os.path.dirname(file_path), f".{os.path.basename(file_path)}.{uuid.uuid4().hex}"
+        )
+
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+
+        # Linked rather than renamed, which fails if the file exists instead of replacing it
+        try:
+            os.link(tmp_path, file_path)
+        finally:
+            os.remove(tmp_path)
+
         return file_path
 
     def read(self, file_name: str) -> bytes:
@@ -97,6 +526,24 @@ class FileStorageManager(StorageManager):
         with open(file_name, "rb") as file:
             return file.read()
 
+    def read_buffer(self, file_name: str) -> Union[bytes, mmap.mmap]:
+        """
+        Read a file of the local file system as a read-only memory-mapped buffer.
+
+        :param file_name: Name of the file to read from.
+        :return: The buffer.
+        """
+        return _map_file(file_name)
+
+    def local_path(self, file_name: str) -> Optional[str]:
+        """
+        Get the path of a file in the local file system, as returned by write.
+
+        :param file_name: Name of the file.
+        :return: Path of the file.
+        """
+        return file_name
+
     def delete(self, file_name: str):
         """
         Delete a file in the local file system.
@@ -105,6 +552,282 @@ class FileStorageManager(StorageManager):
         """
         os.remove(file_name)
 
+    def url(self, file_name: str) -> str:
+        """
+        Get the path of a file, as returned by write.
+
+        :param file_name: Name of the file.
+        :return: Path of the file.
+        """
+        return os.path.join(self.directory, file_name)
+
+
+class CachingStorageManager(StorageManager):
+    """
+    Read-through cache of a storage on the local disk, shared by the processes of a
+    node, so a blob read repeatedly (e.g. the segments, stops and GTFS feeds used by
+    every harvest) is downloaded once per node. Blobs are assumed immutable once
+    written, writes and deletes through the cache invalidating their entry.
+
+    Entries are named by the hash of the blob URL and filled under a temporary name
+    then renamed, so concurrent processes never read a partial blob. Reads refresh the
+    modification time of the entries, the least recently read being pruned when the
+    cache grows beyond its size. The blobs rewritten in place (STORAGE_CACHE_EXCLUDED)
+    are always read from the storage. The size is tracked by each process from its own fills
+    and recomputed when pruning, so the cache can exceed it by the fills of the other
+    processes in the meantime.
+    """
+
+    def __init__(self, storage: StorageManager, directory: str, max_bytes: int):
+        self.storage = storage
+        self.cache_directory = directory
+        self.max_bytes = max_bytes
+        self.tiers = storage.tiers
+        self.aio = AsyncCachingStorageManager(self)
+        self._size = None
+        self._lock = threading.Lock()
+
+    def write(self, file_name: str, data: bytes) -> str:
+        """
+        Write data to the storage, invalidating its cached copy.
+
+        :param file_name: Name of the file to create or update.
+        :param data: Data to write to the file.
+        :return: Name of the file to read it, as returned by the storage.
+        """
+        url = self.storage.write(file_name, data)
+        self._invalidate(url)
+        return url
+
+    def create(self, file_name: str, data: bytes) -> str:
+        """
+        Write data to a new file of the storage, unless the file already exists.
+
+        :param file_name: Name of the file to create.
+        :param data: Data to write to the file.
+        :return: Name of the file to read it, as returned by the storage.
+        :raises FileExistsError: If the file already exists.
+        """
+        url = self.storage.create(file_name, data)
+        self._invalidate(url)
+        return url
+
+    def read(self, file_name: str) -> bytes:
+        """
+        Read data from the cache, or from the storage then fill the cache.
+
+        :param file_name: Name of the file to read, as returned by write.
+        :return: Data read from the file as bytes.
+        :raises FileNotFoundError: If the file does not exist.
+        """
+        if not self._is_cached(file_name):
+            return self.storage.read(file_name)
+
+        data = self._read_cached(file_name)
+
+        if data is None:
+            data = self.storage.read(file_name)
+            self._fill(file_name, data)
+
+        return data
+
+    def read_buffer(self, file_name: str) -> Union[bytes, mmap.mmap]:
+        """
+        Read a file as a read-only buffer memory-mapped from the cache, filling it first.
+
+        :param file_name: Name of the file to read, as returned by write.
+        :return: The buffer.
+        :raises FileNotFoundError: If the file does not exist.
+        """
+        if not self._is_cached(file_name):
+            return self.storage.read_buffer(file_name)
+
+        try:
+            return _map_file(self.local_path(file_name))
+        except FileNotFoundError:
+            # Pruned by another process meanwhile
+            return self.read(file_name)
+
+    def local_path(self, file_name: str) -> Optional[str]:
+        """
+        Get the path of the cached copy of a file, filling the cache first (always for
+        the blobs rewritten in place).
+
+        :param file_name: Name of the file, as returned by write.
+        :return: The path.
+        :raises FileNotFoundError: If the file does not exist.
+        """
+        path = self._path(file_name)
+
+        try:
+            if not self._is_cached(file_name):
+                raise FileNotFoundError(path)
+            os.utime(path)
+        except FileNotFoundError:
+            self._fill(file_name, self.storage.read(file_name))
+
+        return path
+
+    def delete(self, file_name: str):
+        """
+        Delete a file of the storage and its cached copy.
+
+        :param file_name: Name of the file to delete, as returned by write.
+        """
+        self._invalidate(file_name)
+        self.storage.delete(file_name)
+
+    def url(self, file_name: str) -> str:
+        """
+        Get the name of a file to read it, as returned by write.
+
+        :param file_name: Name of the file.
+        :return: Name of the file in the storage.
+        """
+        return self.storage.url(file_name)
+
+    def read_many(self, file_names: List[str]) -> List[bytes]:
+        """
+        Read files from the cache, the missing ones being read at once from the storage
+        (see StorageManager.read_many) then cached.
+
+        :param file_names: Names of the files to read, as returned by write.
+        :return: Data read from the files, in the order of the names.
+        :raises FileNotFoundError: If a file does not exist.
+        """
+        datas = [
+            self._read_cached(file_name) if self._is_cached(file_name) else None
+            for file_name in file_names
+        ]
+        missing = [file_name for file_name, data in zip(file_names, datas) if data is None]
+        fetched = dict(zip(missing, self.storage.read_many(missing)))
+
+        for file_name, data in fetched.items():
+            if self._is_cached(file_name):
+                self._fill(file_name, data)
+
+        return [fetched[file_name] if data is None else data for file_name, data in zip(file_names, datas)]
+
+    def write_many(self, files: List[Tuple[str, bytes]]) -> List[str]:
+        """
+        Write files to the storage (see StorageManager.write_many), invalidating their
+        cached copies.
+
+        :param files: Name and data of the files to create or update.
+        :return: Names of the files to read them, in the order of the files.
+        """
+        urls = self.storage.write_many(files)
+
+        for url in urls:
+            self._invalidate(url)
+
+        return urls
+
+    def delete_many(self, file_names: List[str]):
+        """
+        Delete files of the storage and their cached copies, the missing ones being ignored.
+
+        :param file_names: Names of the files to delete, as returned by write.
+        """
+        for file_name in file_names:
+            self._invalidate(file_name)
+
+        self.storage.delete_many(file_names)
+
+    def tier_many(self, file_names: List[str], tier: str):
+        """
+        Move files of the storage to an access tier, dropping their cached copies.
+
+        :param file_names: Names of the files to move, as returned by write.
+        :param tier: One of the tiers of the storage.
+        """
+        for file_name in file_names:
+            self._invalidate(file_name)
+
+        self.storage.tier_many(file_names, tier)
+
+    @staticmethod
+    def _is_cached(file_name: str) -> bool:
+        return STORAGE_CACHE_EXCLUDED.search(file_name) is None
+
+    def _path(self, file_name: str) -> str:
+        key = hashlib.sha256(file_name.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_directory, key[:2], key)
+
+    def _read_cached(self, file_name: str) -> Optional[bytes]:
+        path = self._path(file_name)
+
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Not cached, or pruned by another process meanwhile
+            return None
+
+        return data
+
+    def _fill(self, file_name: str, data: bytes):
+        path = self._path(file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        descriptor, tmp_path = tempfile.mkstemp(prefix=".", dir=os.path.dirname(path))
+
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+
+        # Another process filling the same blob replaces it with the same data
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._prune(self.max_bytes)
+            else:
+                self._size += len(data)
+
+            if self._size > self.max_bytes:
+                self._size = self._prune(int(self.max_bytes * STORAGE_CACHE_PRUNE_RATIO))
+
+    def _invalidate(self, file_name: str):
+        try:
+            os.remove(self._path(file_name))
+        except FileNotFoundError:
+            pass
+
+    def _prune(self, max_bytes: int) -> int:
+        """
+        Remove the least recently read entries until the cache holds at most max_bytes.
+        :return: The size of the cache
+        """
+        entries = []
+
+        for directory in os.scandir(self.cache_directory):
+            if not directory.is_dir():
+                continue
+
+            for entry in os.scandir(directory.path):
+                # Temporary files of fills in progress are skipped
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = 0
+
+        for _, entry_size, path in sorted(entries, reverse=True):
+            if size + entry_size <= max_bytes:
+                size += entry_size
+                continue
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        return size
 
 
 if "AZURE_STORAGE_CONNECTION_STRING" in os.environ:
@@ -113,6 +836,11 @@ if "AZURE_STORAGE_CONNECTION_STRING" in os.environ:
             os.environ["AZURE_STORAGE_CONTAINER"],
         )
 
+    if STORAGE_CACHE_DIRECTORY:
+        storage_manager = CachingStorageManager(
+            storage_manager, STORAGE_CACHE_DIRECTORY, STORAGE_CACHE_MAX_BYTES
+        )
+
 
 else:
     storage_manager = FileStorageManager(os.environ["FILE_STORAGE_DIRECTORY"])
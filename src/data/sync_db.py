@@ -1,15 +1,28 @@
+import logging
+from datetime import datetime
 from itertools import chain
-from typing import Dict
+from typing import Dict, List
 
-from sqlalchemy import MetaData, Table
+from sqlalchemy import MetaData, Table, inspect, text
 
 from src.configuration.model import ComponentsConfiguration
 from src.data.engine import engine
+from src.data.partition import (
+    PARTITION_MONTHS_AHEAD,
+    PARTITIONED_INFO_KEY,
+    ensure_partition,
+    is_partitioned_in_database,
+    next_month_start,
+)
+from src.data.state import initialize_component_states, state_metadata
 from src.data.table import (
     load_simple_table_from_configuration,
     load_parquetize_table_from_configuration,
+    obsolete_simple_table_indexes,
 )
 
+logger = logging.getLogger("SyncDB")
+
 
 def sync_db_from_configuration(
     configuration: ComponentsConfiguration,
@@ -23,14 +36,20 @@ def sync_db_from_configuration(
     metadata_obj = MetaData()
 
     tables = {}
+    obsolete_indexes = {}
 
     for name, component in chain(
         configuration.harvesters.items(),
         configuration.collectors.items(),
     ):
+        # SQLite has no native partitioning, the tables are left as a single heap there
         tables[name] = load_simple_table_from_configuration(
-            component.name, metadata_obj
+            component.name,
+            metadata_obj,
+            partitioned=component.table_partitioning == "month"
+            and engine.dialect.name == "postgresql",
         )
+        obsolete_indexes[component.name] = obsolete_simple_table_indexes(component.name)
 
         if component.parquetize:
             tables[component.parquetize_name] = load_parquetize_table_from_configuration(
@@ -38,5 +57,135 @@ def sync_db_from_configuration(
             )
 
     metadata_obj.create_all(engine)
+    state_metadata.create_all(engine)
+
+    _add_missing_columns(metadata_obj)
+
+    _add_missing_indexes(metadata_obj)
+
+    _drop_obsolete_indexes(metadata_obj, obsolete_indexes)
+
+    _create_partitions(metadata_obj)
+
+    initialize_component_states(
+        {
+            name: tables[name]
+            for name in chain(configuration.harvesters, configuration.collectors)
+        }
+    )
 
     return tables
+
+
+def _add_missing_indexes(metadata_obj: MetaData):
+    """
+    Create the indexes of the tables that existing tables were created without, create_all
+    only creating the indexes of the tables it creates. On Postgres they are built
+    concurrently (except on partitioned tables, where it is not supported), so the
+    components can keep writing to the table meanwhile.
+    :param metadata_obj: The metadata object
+    """
+    inspector = inspect(engine)
+
+    for table in metadata_obj.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+
+            logger.info(f"Creating index {index.name} on {table.name}")
+
+            concurrently = (
+                engine.dialect.name == "postgresql"
+                and table.dialect_options["postgresql"]["partition_by"] is None
+            )
+            index.dialect_options["postgresql"]["concurrently"] = concurrently
+
+            with engine.connect().execution_options(
+                isolation_level="AUTOCOMMIT"
+            ) as connection:
+                index.create(connection)
+
+
+def _drop_obsolete_indexes(metadata_obj: MetaData, obsolete_indexes: Dict[str, List[str]]):
+    """
+    Drop the indexes replaced by the ones of the tables (see _add_missing_indexes), once
+    the replacements are created. On Postgres they are dropped concurrently (except on
+    partitioned tables).
+    :param metadata_obj: The metadata object
+    :param obsolete_indexes: The obsolete index names, by table name
+    """
+    inspector = inspect(engine)
+
+    for table in metadata_obj.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+
+        for name in obsolete_indexes.get(table.name, []):
+            if name not in existing:
+                continue
+
+            logger.info(f"Dropping obsolete index {name} on {table.name}")
+
+            concurrently = (
+                engine.dialect.name == "postgresql"
+                and table.dialect_options["postgresql"]["partition_by"] is None
+            )
+
+            with engine.connect().execution_options(
+                isolation_level="AUTOCOMMIT"
+            ) as connection:
+                connection.execute(
+                    text(f'DROP INDEX {"CONCURRENTLY " if concurrently else ""}"{name}"')
+                )
+
+
+def _create_partitions(metadata_obj: MetaData):
+    """
+    Create the partitions of the current month and of the PARTITION_MONTHS_AHEAD next ones
+    for the partitioned tables (the others being created on write, see write_result). A
+    table created before its partitioning was configured stays a single heap.
+    :param metadata_obj: The metadata object
+    """
+    for table in metadata_obj.sorted_tables:
+        if table.dialect_options["postgresql"]["partition_by"] is None:
+            continue
+
+        if not is_partitioned_in_database(table.name):
+            logger.warning(
+                f"Table {table.name} was created unpartitioned, it stays unpartitioned"
+            )
+            continue
+
+        table.info[PARTITIONED_INFO_KEY] = True
+        month = datetime.now()
+
+        for _ in range(PARTITION_MONTHS_AHEAD + 1):
+            ensure_partition(table, month)
+            month = next_month_start(month)
+
+
+def _add_missing_columns(metadata_obj: MetaData):
+    """
+    Add the (nullable) columns of the tables that existing tables were created without,
+    create_all only creating the missing tables.
+    :param metadata_obj: The metadata object
+    """
+    inspector = inspect(engine)
+
+    with engine.connect() as connection:
+        for table in metadata_obj.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(
+                    text(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                    )
+                )
+
+        connection.commit()
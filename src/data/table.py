@@ -1,8 +1,11 @@
+from typing import List
+
 from sqlalchemy import (
     Column,
     JSON,
     TIMESTAMP,
     INTEGER,
+    FLOAT,
     Table,
     MetaData,
     VARCHAR,
@@ -14,7 +17,20 @@ from sqlalchemy.dialects.postgresql import JSONB
 JsonVariant = JSON().with_variant(JSONB, "postgresql")
 
 
-def load_simple_table_from_configuration(table_name: str, metadata_obj: MetaData):
+def obsolete_simple_table_indexes(table_name: str) -> List[str]:
+    """
+    Get the indexes of a simple table replaced by the ones of load_simple_table_from_configuration,
+    to drop from the tables created with them.
+
+    :param table_name: The table name
+    :return: The index names
+    """
+    return [f"idx_{table_name}_date"]
+
+
+def load_simple_table_from_configuration(
+    table_name: str, metadata_obj: MetaData, partitioned: bool = False
+):
     """
     Load/Create a simple table from a component configuration.
 
@@ -22,29 +38,51 @@ def load_simple_table_from_configuration(table_name: str, metadata_obj: MetaData
     The copy_id column is used to prevent storing the same data multiple times, instead, it stores the id of the row that contains the same data,
     leveraging the unique constraint on the hash column.
 
+    A partitioned table (Postgres only) is range partitioned by date, its primary key including the date
+    as required by Postgres. Its partitions are created by src.data.partition.
+
+    The date index covers all the columns base_query selects (on Postgres), so the latest and between-dates
+    queries are index-only scans, with or without null rows. copy_id has a partial index, on the copies only.
+
     @param table_name: The table name
     @param metadata_obj: The metadata object
+    @param partitioned: Whether the table is range partitioned by date
     @return: The table
     """
-    return Table(
+    table = Table(
         table_name,
         metadata_obj,
         Column("id", INTEGER, primary_key=True, autoincrement=True),
-        Column("date", TIMESTAMP, nullable=False),
+        Column("date", TIMESTAMP, nullable=False, primary_key=partitioned),
         Column("data", VARCHAR(512), nullable=True),
         Column("type", VARCHAR(24), nullable=True),
         Column("hash", VARCHAR(32), nullable=True),
         Column("copy_id", INTEGER, nullable=True),
-        Index(f"idx_{table_name}_date", "date"),
+        Index(
+            f"idx_{table_name}_date_covering",
+            "date",
+            postgresql_include=["id", "data", "type", "hash", "copy_id"],
+        ),
+        **({"postgresql_partition_by": "RANGE (date)"} if partitioned else {}),
+    )
+
+    Index(
+        f"idx_{table_name}_copy_id",
+        table.c.copy_id,
+        postgresql_where=table.c.copy_id.isnot(None),
+        sqlite_where=table.c.copy_id.isnot(None),
     )
 
+    return table
+
 
 def load_parquetize_table_from_configuration(table_name: str, metadata_obj: MetaData):
     """
     Load/Create a table for the parquetize process.
 
     A table for the parquetize process is a table that contains an id, a start_date, an end_date, a count,
-    and a data column. The data column contains the parquet file.
+    and a data column. The data column contains the parquet file. The codec, compression_ratio
+    (original_size / compressed_size) and encode_time (seconds) columns describe how the file was encoded.
 
     :param table_name: The table name
     :param metadata_obj: The metadata object
@@ -69,8 +107,37 @@ def load_parquetize_table_from_configuration(table_name: str, metadata_obj: Meta
         ),
         Column("keys", JsonVariant, nullable=True, index=True),
         Column("aggregation", VARCHAR(32), nullable=False),
+        Column("codec", VARCHAR(32), nullable=True),
+        Column("compression_ratio", FLOAT, nullable=True),
+        Column("encode_time", FLOAT, nullable=True),
         Index(
             f"{table_name}_aggregation_start_date_index", "aggregation", "start_date"
         ),
         Index(f"{table_name}_start_end_date_index", "start_date", "end_date"),
     )
+
+
+def load_component_state_table(metadata_obj: MetaData):
+    """
+    Load/Create the table holding the state of each component, updated with every row written
+    to the component table (see src.data.state), so it can be read by primary key instead of
+    ordering the component table.
+
+    The first_date is the date of the first row with data, the last_date and last_id the date and
+    id of the latest row (rows with null data included), count the number of rows. The source_id
+    and source_date of a harvester are the id and date of the last source row it processed.
+
+    :param metadata_obj: The metadata object
+    :return: The table
+    """
+    return Table(
+        "component_state",
+        metadata_obj,
+        Column("name", VARCHAR(128), primary_key=True),
+        Column("first_date", TIMESTAMP, nullable=True),
+        Column("last_date", TIMESTAMP, nullable=True),
+        Column("last_id", INTEGER, nullable=True),
+        Column("count", INTEGER, nullable=False, default=0),
+        Column("source_id", INTEGER, nullable=True),
+        Column("source_date", TIMESTAMP, nullable=True),
+    )
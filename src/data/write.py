@@ -1,24 +1,41 @@
 import hashlib
 import json
 from datetime import datetime
+from typing import Optional
 
 from sqlalchemy import Table
+from sqlalchemy.exc import DBAPIError
 
 from src.configuration.model import ComponentConfiguration
+from src.data.codec import encode_blob
 from src.data.engine import engine
+from src.data.partition import (
+    ensure_partition,
+    forget_partition,
+    is_missing_partition_error,
+    is_partitioned,
+)
+from src.data.retrieve import Data
+from src.data.state import update_component_state
 from src.data.storage import storage_manager
 
 
 def write_result(
-    configuration: ComponentConfiguration, table: Table, data, date: datetime
+    configuration: ComponentConfiguration,
+    table: Table,
+    data,
+    date: datetime,
+    source: Optional[Data] = None,
 ):
     """
     Write the result of a harvester to the database.
     If the data already exists, it will be overwritten.
+    The state of the component (see src.data.state) is updated in the same transaction.
     :param configuration: The configuration of the component
     :param table:  The table to write to
     :param data:  The data to write
     :param date:  The date of the data
+    :param source:  The last source row the result was harvested from, if any
     """
 
     if isinstance(data, str):
@@ -33,6 +50,16 @@ def write_result(
     else:
         md5_digest = hashlib.md5(data_bytes).hexdigest()
 
+    data_type = configuration.data_type
+
+    # The hash is the one of the data, whatever the codec it is stored with
+    if configuration.storage_codec is not None and data_bytes is not None:
+        data_bytes = encode_blob(configuration.name, data_bytes, configuration.storage_codec)
+        data_type = f"{data_type}+{configuration.storage_codec}"
+
+    if is_partitioned(table):
+        ensure_partition(table, date)
+
     with engine.connect() as connection:
         # Upload data to storage
         url = storage_manager.write(
@@ -40,10 +67,28 @@ def write_result(
             data_bytes,
         )
         # Insert data to database
-        connection.execute(
-            table.insert().values(
-                date=date, data=url, hash=md5_digest, type=configuration.data_type
-            )
+        insert = table.insert().values(date=date, data=url, hash=md5_digest, type=data_type)
+
+        try:
+            result = connection.execute(insert)
+        except DBAPIError as e:
+            if not is_partitioned(table) or not is_missing_partition_error(e):
+                raise
+
+            # The partition was dropped by another process since this one cached it
+            connection.rollback()
+            forget_partition(table, date)
+            ensure_partition(table, date)
+            result = connection.execute(insert)
+
+        update_component_state(
+            connection,
+            configuration.name,
+            date,
+            result.inserted_primary_key[0],
+            md5_digest is not None,
+            source_id=source and source.id,
+            source_date=source and source.date,
         )
 
         connection.commit()
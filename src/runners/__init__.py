@@ -2,3 +2,4 @@ from .run_collector import run_collector_on_schedule, run_collector
 from .run_handler import run_handlers
 from .run_harvester import run_harvester_on_schedule, run_harvester
 from .run_parquetize import run_parquetize, run_parquetize_on_schedule
+from .run_retention import run_retention, run_retention_on_schedule
@@ -3,13 +3,22 @@ import json
 import logging
 from socketserver import ThreadingMixIn
 from typing import Dict, List
+from urllib.parse import parse_qsl
 
 from sqlalchemy import Table
 
+from src.components import InvalidQuery
 from src.configuration.model import ComponentConfiguration
+from src.data.retrieve import Cursor
 
 logger = logging.getLogger("Handler")
 
+# Query parameter types that are not python builtins
+QUERY_PARAMETER_TYPES = {
+    "cursor": Cursor.decode,
+    "json": json.loads,
+}
+
 
 def _treat_query_parameters(
     query_parameters: Dict[str, str], component: ComponentConfiguration
@@ -20,8 +29,11 @@ def _treat_query_parameters(
         if key in query_parameters:
             # Parse query parameter
             try:
-                # noinspection PyUnresolvedReferences
-                value = __builtins__[value](query_parameters[key])
+                parse = QUERY_PARAMETER_TYPES.get(value)
+                if parse is None:
+                    # noinspection PyUnresolvedReferences
+                    parse = __builtins__[value]
+                value = parse(query_parameters[key])
             except ValueError:
                 return False, None
 
@@ -76,11 +88,7 @@ class HttpRequestHandler(http.server.SimpleHTTPRequestHandler):
 
         # Extract query parameters from path
         success, query_parameters = _treat_query_parameters(
-            dict(
-                parameter.split("=") for parameter in query_parameters_string.split("&")
-            )
-            if query_parameters_string
-            else {},
+            dict(parse_qsl(query_parameters_string)) if query_parameters_string else {},
             handler_config,
         )
 
@@ -88,18 +96,23 @@ class HttpRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.send_error(400, "Bad Request")
             return
 
-        self.send_response(200)
-
         logger.debug(
             f"Executing handler {handler_name} with parameters {query_parameters}"
         )
 
         # Execute handler
-        result = handler_config.component(self.tables).run(**query_parameters)
+        try:
+            result = handler_config.component(self.tables).run(**query_parameters)
+        except InvalidQuery as e:
+            self.send_error(400, "Bad Request", str(e))
+            return
+
         if result is None:
             self.send_error(404, "No data found for this specific query")
             return
 
+        self.send_response(200)
+
         if handler_config.data_type == "json":
             self.send_header("Content-type", "text/json")
             self.end_headers()
@@ -7,12 +7,13 @@ from sqlalchemy import Table
 
 from src.configuration.model import ComponentConfiguration
 from src.data.retrieve import (
+    prefetch_data,
+    retrieve_after_id,
     retrieve_latest_row,
-    retrieve_after_datetime,
     retrieve_between_datetime,
     retrieve_latest_rows_before_datetime,
-    retrieve_first_row,
 )
+from src.data.state import retrieve_component_state
 from src.data.write import write_result
 
 ZERO_DATE = datetime(1970, 1, 1)
@@ -20,15 +21,10 @@ ZERO_DATE = datetime(1970, 1, 1)
 
 logger = logging.getLogger("Harvester")
 
-_first_row_date_cache: Dict[str, Optional[datetime]] = {}
-
-
-def get_first_row_date(name: str, table: Table) -> Optional[datetime]:
-    """Get the first row date for a table, caching the result by name."""
-    if name not in _first_row_date_cache:
-        row = retrieve_first_row(table)
-        _first_row_date_cache[name] = row.date if row else None
-    return _first_row_date_cache[name]
+def get_first_row_date(name: str) -> Optional[datetime]:
+    """Get the date of the first row (with data) of a component, from its state."""
+    state = retrieve_component_state(name)
+    return state and state.first_date
 
 
 def run_harvester_on_schedule(
@@ -73,24 +69,28 @@ def source_range_to_period_and_limit(
         days = int(source_range.replace("d", ""))
         # Round latest date to the previous period
         latest_date = latest_date - timedelta(days=latest_date.day % days)
+        latest_date = latest_date.replace(hour=0, minute=0, second=0, microsecond=0)
         return latest_date, latest_date + timedelta(days=days), None
 
     elif "h" in source_range:
         hours = int(source_range.replace("h", ""))
         # Round latest date to the previous period
         latest_date = latest_date - timedelta(hours=latest_date.hour % hours)
+        latest_date = latest_date.replace(minute=0, second=0, microsecond=0)
         return latest_date, latest_date + timedelta(hours=hours), None
 
     elif "m" in source_range:
         minutes = int(source_range.replace("m", ""))
         # Round latest date to the previous period
         latest_date = latest_date - timedelta(minutes=latest_date.minute % minutes)
+        latest_date = latest_date.replace(second=0, microsecond=0)
         return latest_date, latest_date + timedelta(minutes=minutes), None
 
     elif "s" in source_range:
         seconds = int(source_range.replace("s", ""))
         # Round latest date to the previous period
         latest_date = latest_date - timedelta(seconds=latest_date.second % seconds)
+        latest_date = latest_date.replace(microsecond=0)
         return latest_date, latest_date + timedelta(seconds=seconds), None
 
 
@@ -107,53 +107,81 @@ def run_harvester(
     source_table = tables[harvester_config.source.name]
 
     # Get latest date harvested
-    latest_row = retrieve_latest_row(table, with_null=True)
+    state = retrieve_component_state(harvester_config.name)
+    source_state = retrieve_component_state(harvester_config.source.name)
 
-    if latest_row is None:
-        # In case the harvester has never been run, get the first row from the source table
-        row = retrieve_first_row(source_table)
+    if state is None or state.last_date is None:
+        # In case the harvester has never been run, start from the first row of the source
+        first_date = source_state and source_state.first_date
         # Minus one second to make sure we include the first row
-        latest_date = (row and (row.date - timedelta(seconds=1))) or ZERO_DATE
+        latest_date = (first_date and (first_date - timedelta(seconds=1))) or ZERO_DATE
     else:
-        latest_date = latest_row.date
+        latest_date = state.last_date
 
     # Clamp latest_date so we only look at source rows after each dependency's first datapoint.
     # This prevents the harvester from trying to process source data that predates its dependencies.
+    dependencies_start = None
+
     for dependency in harvester_config.dependencies:
-        dependency_table = tables[dependency.name]
-        first_dep_date = get_first_row_date(dependency.name, dependency_table)
+        first_dep_date = get_first_row_date(dependency.name)
         if first_dep_date is None:
             return False  # Dependency has no data yet, can't run
         if latest_date < first_dep_date - timedelta(seconds=1):
-            latest_date = first_dep_date - timedelta(seconds=1)
+            latest_date = dependencies_start = first_dep_date - timedelta(seconds=1)
 
     # Clamp for optional dependencies that have data, but don't block if they don't.
     for dependency in harvester_config.optional_dependencies:
-        dependency_table = tables[dependency.name]
-        first_dep_date = get_first_row_date(dependency.name, dependency_table)
+        first_dep_date = get_first_row_date(dependency.name)
         if first_dep_date is not None and latest_date < first_dep_date - timedelta(seconds=1):
-            latest_date = first_dep_date - timedelta(seconds=1)
+            latest_date = dependencies_start = first_dep_date - timedelta(seconds=1)
 
     # Get source range
     start_date, end_date, limit = source_range_to_period_and_limit(
         latest_date, harvester_config.source_range
     )
 
-    source_data = retrieve_between_datetime(source_table, start_date, end_date, limit)
+    if end_date and (
+        source_state is None
+        or source_state.last_date is None
+        or source_state.last_date <= end_date
+    ):
+        return False  # No new data to harvest, still building the same period
 
-    if not source_data:
+    if (
+        harvester_config.source_cursor == "id"
+        and state is not None
+        and state.source_id is not None
+    ):
+        # Resume right after the last source row processed, the period (if any) only
+        # bounding the rows read. Before the first source row is recorded, the dates are used.
+        source_data = retrieve_after_id(
+            source_table,
+            state.source_id,
+            limit,
+            after_date=dependencies_start,
+            until_date=end_date,
+        )
+    else:
+        # A period covers (start, end], so a row stamped on a boundary belongs to the
+        # period it ends, as the trajectory tables assume
+        source_data = retrieve_between_datetime(
+            source_table, start_date, end_date, limit, end_included=end_date is not None
+        )
+
+    if not source_data and not end_date:
         return False  # No new data to harvest
 
     if limit and harvester_config.source_range_strict and len(source_data) < limit:
         return False  # No new data to harvest, still building the amount of data specified by the limit
 
-    if end_date and not retrieve_after_datetime(table, latest_date, 1):
-        return False  # No new data to harvest, still building the same period
-
+    # A closed period without source data is still harvested (to an empty result)
+    # so the harvester moves on to the next period.
     storage_date = end_date or source_data[-1].date
 
     if limit == 1 and not end_date:
         source_data = source_data[0]
+    else:
+        prefetch_data(source_data)
 
     # Resolve required dependencies
     dependencies = harvester_config.dependencies
@@ -200,16 +228,22 @@ def run_harvester(
 
     result = harvester.run(source_data, **dependencies_data)
 
+    # The last source row processed, recorded in the state of the harvester
+    if isinstance(source_data, list):
+        last_source = source_data[-1] if source_data else None
+    else:
+        last_source = source_data
+
     if harvester_config.multiple_results:
         for item, source in zip(result, source_data):
-            write_result(harvester_config, table, item, source.date)
+            write_result(harvester_config, table, item, source.date, source=source)
     elif result is not None:
-        write_result(harvester_config, table, result, storage_date)
+        write_result(harvester_config, table, result, storage_date, source=last_source)
     else:
         logger.debug(
             f"Harvester {harvester_config.name} returned None, writing empty result to database since "
             "harvester should always yield consistent results on the same input."
         )
-        write_result(harvester_config, table, None, storage_date)
+        write_result(harvester_config, table, None, storage_date, source=last_source)
 
     return True
\ No newline at end of file
@@ -1,28 +1,44 @@
+import collections
 import concurrent.futures
 import json
 import logging
+import os
 import time
 from datetime import timedelta
 from io import BytesIO
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
 
-import polars
+import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 from jsonschema.exceptions import ValidationError
-from jsonschema.validators import validate
+from jsonschema.validators import validator_for
 from sqlalchemy import Table, select, column
 
 from src.configuration.model import (
     ComponentConfiguration,
+    ComponentParquetizeConfig,
     ComponentParquetizeGroupConfig,
+    ComponentParquetizeLayoutConfig,
 )
+from src.data.codec import decode_blob
 from src.data.engine import engine
+from src.data.state import retrieve_component_state
 from src.data.storage import storage_manager
 from src.runners._utils import (
     schedule_string_to_time_delta,
     round_datetime_to_previous_delta,
 )
+from src.utilities.parquet_schema import (
+    DATASET_METADATA_NAME,
+    DATE_COLUMN,
+    PERIOD_START_PARTITION,
+    conform_table,
+    hive_directory,
+    parquetize_arrow_schema,
+)
 
 logger = logging.getLogger("Parquetize")
 
@@ -67,135 +83,565 @@ def run_parquetize(
 
     logger.info(f"Running parquetize {component_config.name}")
 
-    with engine.connect() as connection:
-        delta = schedule_string_to_time_delta(parquetize_config.batch)
+    summarized = _summarized_aggregations(parquetize_config)
 
-        latest_parquet = connection.execute(
-            parquet_table.select().order_by(parquet_table.c.end_date.desc()).limit(1)
-        ).fetchone()
+    # Footers of the committed files to summarize, by aggregation, in commit order
+    summaries = collections.defaultdict(list)
 
-        latest_date = latest_parquet and latest_parquet[2]
+    try:
+        with engine.connect() as connection:
+            delta = schedule_string_to_time_delta(parquetize_config.batch)
 
-        if latest_date is None:
-            result = connection.execute(
-                source.select().order_by(source.c.date.asc()).limit(1)
+            latest_parquet = connection.execute(
+                parquet_table.select().order_by(parquet_table.c.end_date.desc()).limit(1)
             ).fetchone()
 
-            if not result:
+            latest_date = latest_parquet and latest_parquet[2]
+            state = retrieve_component_state(component_config.name)
+
+            if state is None or state.last_date is None:
                 raise ValueError(f"No data found in the source table {source.name}")
 
-            latest_date = result[1] - timedelta(seconds=1)
+            if latest_date is None:
+                if state.first_date is None:
+                    raise ValueError(f"No data found in the source table {source.name}")
 
-        end_date = connection.execute(
-            source.select().order_by(source.c.date.desc()).limit(1)
-        ).fetchone()[1]
+                latest_date = state.first_date - timedelta(seconds=1)
 
-        period_start = round_datetime_to_previous_delta(latest_date, delta)
-        while True:
-            logger.info(
-                f"Processing period {period_start} - {period_start + delta} for batching"
-            )
-            period_end = period_start + delta
+            end_date = state.last_date
+
+            period_start = round_datetime_to_previous_delta(latest_date, delta)
+            tasks = []
 
-            if period_end > end_date:
+            while True:
                 logger.info(
-                    f"End of data reached, last period: {period_start} - {end_date}, should re-run later"
+                    f"Processing period {period_start} - {period_start + delta} for batching"
                 )
-                break
-
-            _generate_batch(
-                component_config,
-                connection,
-                parquet_table,
-                period_end,
-                period_start,
-                source,
+                period_end = period_start + delta
+
+                if period_end > end_date:
+                    logger.info(
+                        f"End of data reached, last period: {period_start} - {end_date}, should re-run later"
+                    )
+                    break
+
+                tasks.append(
+                    (
+                        component_config.name,
+                        component_config.parquetize_name,
+                        parquetize_config,
+                        _fetch_batch_rows(connection, source, period_start, period_end),
+                        period_start,
+                        period_end,
+                    )
+                )
+
+                period_start = period_end
+
+            # Batches are committed in period order, so the latest one is where to resume
+            for values in _run_in_order(_generate_batch, tasks, _discard_files):
+                file_metadata = values.pop("file_metadata", None)
+
+                connection.execute(parquet_table.insert().values(**values))
+                connection.commit()
+
+                if file_metadata is not None and parquetize_config.batch in summarized:
+                    summaries[parquetize_config.batch].append(file_metadata)
+
+        with engine.connect() as connection:
+            for previous_group, group in zip(
+                [ComponentParquetizeGroupConfig(group=parquetize_config.batch)]
+                + parquetize_config.groups[:-1],
+                parquetize_config.groups,
+            ):
+                logger.info(f"Processing group {group}")
+                # Now we want to group the batch themselves
+                last_processed_batch = connection.execute(
+                    parquet_table.select()
+                    .where((column("aggregation") == group.group))
+                    .order_by(parquet_table.c.end_date.desc())
+                    .limit(1)
+                ).fetchone()
+
+                first_previous_group_batch = connection.execute(
+                    parquet_table.select()
+                    .where((column("aggregation") == previous_group.group))
+                    .order_by(parquet_table.c.end_date.asc())
+                    .limit(1)
+                ).fetchone()
+
+                last_unprocessed_batch = connection.execute(
+                    parquet_table.select()
+                    .where((column("aggregation") == previous_group.group))
+                    .order_by(parquet_table.c.end_date.desc())
+                    .limit(1)
+                ).fetchone()
+
+                if first_previous_group_batch is None:
+                    logger.info(f"No previous group {previous_group.group} found")
+                    continue
+
+                group_time_delta = schedule_string_to_time_delta(group.group)
+
+                start_date = round_datetime_to_previous_delta(
+                    (
+                        last_processed_batch[2]
+                        if last_processed_batch
+                        else first_previous_group_batch[1]
+                    ),
+                    group_time_delta,
+                )
+                end_date = last_unprocessed_batch[2]
+
+                group_start = start_date
+                tasks = []
+                consumed = set()
+
+                while True:
+                    logger.info(
+                        f"Processing group {group.group} {group_start} - {group_start + group_time_delta}"
+                    )
+                    group_end = group_start + group_time_delta
+                    if group_end > end_date:
+                        logger.info(
+                            f"End of data reached, last period: {start_date} - {end_date}, should re-run later"
+                        )
+                        break
+
+                    data_rows = _fetch_group_rows(
+                        connection, parquet_table, previous_group, group_start, group_end
+                    )
+
+                    if not group.keys:
+                        # The period bounds are inclusive: a row on the bound of the previous
+                        # period belongs to it, as it is deleted once the previous period is committed
+                        data_rows = [row for row in data_rows if row[0] not in consumed]
+                        consumed = {row[0] for row in data_rows}
+
+                    tasks.append(
+                        (
+                            component_config.name,
+                            group,
+                            parquetize_config.partitioning,
+                            parquetize_config.schema,
+                            parquetize_arrow_schema(
+                                parquetize_config.schema, parquetize_config.dictionary
+                            ),
+                            data_rows,
+                            group_start,
+                            group_end,
+                        )
+                    )
+
+                    group_start = group_end
+
+                for (*_, data_rows, group_start, group_end), values in zip(
+                    tasks, _run_in_order(_generate_group, tasks, _discard_files)
+                ):
+                    if values is None:
+                        continue
+
+                    files_metadata = [value.pop("file_metadata", None) for value in values]
+
+                    for value in values:
+                        connection.execute(parquet_table.insert().values(**value))
+
+                    if not group.keys:
+                        # Delete the processed data (period and batch)
+                        connection.execute(
+                            parquet_table.delete().where(
+                                parquet_table.c.start_date.between(group_start, group_end)
+                                & (column("aggregation") == previous_group.group)
+                            )
+                        )
+
+                    connection.commit()
+
+                    if not group.keys:
+                        # Delete files
+                        for row in data_rows:
+                            storage_manager.delete(row[0])
+
+                    if group.group in summarized and all(
+                        file_metadata is not None for file_metadata in files_metadata
+                    ):
+                        summaries[group.group].extend(files_metadata)
+
+    except Exception:
+        # The files committed before the failure are still summarized, without letting a
+        # failure to do so replace the one that aborted the run
+        for aggregation, files_metadata in summaries.items():
+            try:
+                _append_dataset_metadata(component_config.name, aggregation, files_metadata)
+            except Exception as e:
+                logger.exception(
+                    f"Cannot update the {DATASET_METADATA_NAME} of {component_config.name} {aggregation}: {e}"
+                )
+        raise
+
+    # Each _metadata is rewritten once per run, with the files committed by the run
+    for aggregation, files_metadata in summaries.items():
+        _append_dataset_metadata(component_config.name, aggregation, files_metadata)
+
+
+def _hive_value(value) -> str:
+    # Same null fallback and (URI) encoding as pyarrow
+    return "__HIVE_DEFAULT_PARTITION__" if value is None else quote(str(value), safe="")
+
+
+def _parquetize_file_name(
+    flat_directory: str,
+    component_name: str,
+    partitioning: str,
+    aggregation: str,
+    start,
+    end,
+    keys: dict = None,
+) -> Tuple[str, Optional[str]]:
+    """
+    Get the storage name of a parquetize file.
+    :return: The name, and the path relative to the directory of its aggregation in the
+    "hive" partitioning (None in the flat one)
+    """
+    period = f"{start.strftime('%Y-%m-%d_%H-%M-%S')}_to_{end.strftime('%Y-%m-%d_%H-%M-%S')}"
+    keys = keys or {}
+
+    if partitioning == "hive":
+        relative_path = "/".join(
+            [f"{PERIOD_START_PARTITION}={start.strftime('%Y-%m-%d')}"]
+            + [f"{key}={_hive_value(value)}" for key, value in keys.items()]
+            + [f"{period}.parquet"]
+        )
+        return f"{hive_directory(component_name, aggregation)}/{relative_path}", relative_path
+
+    keys_suffix = "".join([f"_{key}_{value}" for key, value in keys.items()])
+    return f"{flat_directory}/{period}{keys_suffix}.parquet", None
+
+
+def _file_metadata(data: bytes, relative_path: Optional[str]):
+    """Get the footer of a file to summarize, with its path, if it has one (hive partitioning)."""
+    if relative_path is None:
+        return None
+
+    metadata = pq.read_metadata(pa.BufferReader(data))
+    metadata.set_file_path(relative_path)
+    return metadata
+
+
+def _summarized_aggregations(parquetize_config: ComponentParquetizeConfig) -> set:
+    """
+    Get the aggregations whose files are kept, the files of an aggregation being deleted
+    once merged by the next group, unless it is keyed. The others are not summarized.
+    """
+    aggregations = [parquetize_config.batch] + [
+        group.group for group in parquetize_config.groups
+    ]
+    kept = [bool(group.keys) for group in parquetize_config.groups] + [True]
+
+    return {aggregation for aggregation, keep in zip(aggregations, kept) if keep}
+
+
+def _append_dataset_metadata(component_name: str, aggregation: str, files_metadata: list):
+    """
+    Append the footers of new files to the _metadata summary of an aggregation, which
+    readers use to plan a scan without listing nor opening the files. It is rewritten
+    once per run, with the files committed by the run.
+    :param component_name: The component name
+    :param aggregation: The aggregation
+    :param files_metadata: The footers of the files, with their relative paths
+    """
+    file_name = f"{hive_directory(component_name, aggregation)}/{DATASET_METADATA_NAME}"
+
+    try:
+        metadata = pq.read_metadata(
+            pa.BufferReader(storage_manager.read_buffer(storage_manager.url(file_name)))
+        )
+    except FileNotFoundError:
+        metadata = None
+
+    for file_metadata in files_metadata:
+        if metadata is None:
+            metadata = file_metadata
+            continue
+
+        try:
+            metadata.append_row_groups(file_metadata)
+        except RuntimeError:
+            logger.warning(
+                f"Schema of {component_name} {aggregation} changed, restarting its {DATASET_METADATA_NAME}"
             )
+            metadata = file_metadata
+
+    output = BytesIO()
+    metadata.write_metadata_file(output)
+    storage_manager.write(file_name, output.getvalue())
 
-            period_start = period_end
 
-    with engine.connect() as connection:
-        for previous_group, group in zip(
-            [ComponentParquetizeGroupConfig(group=parquetize_config.batch)]
-            + parquetize_config.groups[:-1],
-            parquetize_config.groups,
-        ):
-            logger.info(f"Processing group {group}")
-            # Now we want to group the batch themselves
-            last_processed_batch = connection.execute(
-                parquet_table.select()
-                .where((column("aggregation") == group.group))
-                .order_by(parquet_table.c.end_date.desc())
-                .limit(1)
-            ).fetchone()
+# Number of processes periods are spread over when several are pending (catching up)
+PARQUETIZE_WORKERS = int(os.environ.get("PARQUETIZE_WORKERS", os.cpu_count() or 1))
 
-            first_previous_group_batch = connection.execute(
-                parquet_table.select()
-                .where((column("aggregation") == previous_group.group))
-                .order_by(parquet_table.c.end_date.asc())
-                .limit(1)
-            ).fetchone()
+# Child files downloaded ahead of the one being merged in the group stage
+GROUP_DOWNLOAD_AHEAD = 4
+
+
+def _initialize_worker():
+    # The worker inherits the connections of the parent, which must not use nor close them
+    engine.dispose(close=False)
 
-            last_unprocessed_batch = connection.execute(
-                parquet_table.select()
-                .where((column("aggregation") == previous_group.group))
-                .order_by(parquet_table.c.end_date.desc())
-                .limit(1)
-            ).fetchone()
 
-            if first_previous_group_batch is None:
-                logger.info(f"No previous group {previous_group.group} found")
-                continue
+def _run_in_order(function, tasks: list, discard):
+    """
+    Run tasks, yielding their results in the order of the tasks. A single task is run
+    in this process, several (e.g. when catching up on many periods) on a process pool
+    of up to PARQUETIZE_WORKERS processes.
+    :param function: The function to run, it must not use the database
+    :param tasks: The arguments of each call
+    :param discard: Called on the results that were computed but not consumed, if
+    the consumer stops early or a previous task failed
+    :return: The results
+    """
+    workers = min(PARQUETIZE_WORKERS, len(tasks))
+
+    if workers <= 1:
+        for task in tasks:
+            yield function(*task)
+        return
+
+    logger.info(f"Running {len(tasks)} periods on {workers} processes")
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_initialize_worker
+    ) as executor:
+        futures = [executor.submit(function, *task) for task in tasks]
+        consumed = 0
+
+        try:
+            for future in futures:
+                result = future.result()
+                consumed += 1
+                yield result
+        finally:
+            for future in futures[consumed:]:
+                future.cancel()
+
+            for future in futures[consumed:]:
+                if not future.cancelled() and future.exception() is None:
+                    discard(future.result())
+
+
+def _discard_files(values):
+    """Delete the files of a result (batch row or group rows) that will not be committed."""
+    if values is None:
+        return
+
+    for value in values if isinstance(values, list) else [values]:
+        storage_manager.delete(value["data"])
+
+
+def _prefetch(function, items, ahead: int):
+    """Map a function over items in threads, keeping at most `ahead` results in advance."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=ahead) as executor:
+        futures = collections.deque()
+
+        for item in items:
+            futures.append(executor.submit(function, item))
+            if len(futures) > ahead:
+                yield futures.popleft().result()
+
+        while futures:
+            yield futures.popleft().result()
 
-            group_time_delta = schedule_string_to_time_delta(group.group)
 
-            start_date = round_datetime_to_previous_delta(
-                (
-                    last_processed_batch[2]
-                    if last_processed_batch
-                    else first_previous_group_batch[1]
-                ),
-                group_time_delta,
+# Rows written per row group of the group files (the pyarrow default). The group stage
+# buffers at most this many rows, whatever the size of the group.
+GROUP_ROW_GROUP_SIZE = 1024 * 1024
+
+# Rows buffered across the partitions of a keyed group before the largest is written
+GROUP_PARTITION_BUFFER_ROWS = 4 * GROUP_ROW_GROUP_SIZE
+
+
+def _writer_options(
+    layout: ComponentParquetizeLayoutConfig, schema: pa.Schema, row_group_size: int
+) -> dict:
+    """
+    Get the Parquet writer options of a layout.
+    :param layout: The layout
+    :param schema: The schema of the file
+    :param row_group_size: The number of rows per row group, the Bloom filters being sized for it
+    :return: The options
+    """
+    return dict(
+        compression=layout.compression,
+        compression_level=layout.compression_level,
+        use_dictionary=True,
+        write_statistics=True if layout.statistics is None else layout.statistics,
+        sorting_columns=(
+            pq.SortingColumn.from_ordering(
+                schema, [(key, "ascending") for key in layout.sort]
             )
-            end_date = last_unprocessed_batch[2]
+            if layout.sort
+            else None
+        ),
+        bloom_filter_options=(
+            {column_name: {"ndv": max(row_group_size, 1)} for column_name in layout.bloom_filter}
+            if layout.bloom_filter
+            else None
+        ),
+    )
 
-            group_start = start_date
 
-            while True:
-                logger.info(
-                    f"Processing group {group.group} {group_start} - {group_start + group_time_delta}"
-                )
-                group_end = group_start + group_time_delta
-                if group_end > end_date:
-                    logger.info(
-                        f"End of data reached, last period: {start_date} - {end_date}, should re-run later"
-                    )
-                    break
+def _sort_table(table: pa.Table, keys: List[str]) -> pa.Table:
+    """Sort a table on key columns (ascending, nulls last), dictionary columns on their values."""
+    if not keys:
+        return table
 
-                _generate_group(
-                    component_config.name,
-                    previous_group,
-                    group,
-                    parquetize_config.schema,
-                    connection,
-                    parquet_table,
-                    group_start,
-                    group_end,
-                )
+    sort_columns = []
 
-                group_start = group_end
+    for key in keys:
+        key_column = table[key]
+        if pa.types.is_dictionary(key_column.type):
+            key_column = key_column.cast(key_column.type.value_type)
+        sort_columns.append(key_column)
 
+    indices = pc.sort_indices(
+        pa.table(sort_columns, names=keys),
+        sort_keys=[(key, "ascending") for key in keys],
+    )
 
-def _generate_group(
-    parquetize_table: str,
-    previous_group: ComponentParquetizeGroupConfig,
-    group: ComponentParquetizeGroupConfig,
-    schema: dict,
-    connection,
-    parquet_table,
-    group_start,
-    group_end,
-):
+    return table.take(indices)
+
+
+class _BufferedParquetWriter:
+    """
+    Write tables to an in-memory Parquet file, buffering them to write row groups
+    of the size of the layout (GROUP_ROW_GROUP_SIZE by default), each sorted on the
+    sort keys of the layout.
+    """
+
+    def __init__(self, schema: pa.Schema, layout: ComponentParquetizeLayoutConfig):
+        self.row_group_size = layout.row_group_size or GROUP_ROW_GROUP_SIZE
+        self.sort = layout.sort
+        self.output = BytesIO()
+        self.writer = pq.ParquetWriter(
+            self.output, schema, **_writer_options(layout, schema, self.row_group_size)
+        )
+        self.buffer = []
+        self.buffered_rows = 0
+        self.num_rows = 0
+        # Time spent sorting, encoding and compressing, in seconds
+        self.encode_time = 0.0
+
+    def write(self, table: pa.Table):
+        self.buffer.append(table)
+        self.buffered_rows += table.num_rows
+        self.num_rows += table.num_rows
+
+        while self.buffered_rows >= self.row_group_size:
+            self._write_row_group(self.row_group_size)
+
+    def flush(self):
+        """Write all the buffered rows."""
+        if self.buffered_rows:
+            self._write_row_group(self.buffered_rows)
+
+    def close(self) -> bytes:
+        self.flush()
+        start = time.perf_counter()
+        self.writer.close()
+        self.encode_time += time.perf_counter() - start
+        return self.output.getvalue()
+
+    def _write_row_group(self, size: int):
+        start = time.perf_counter()
+
+        # Dictionaries are unified, otherwise Parquet falls back to plain encoding between tables
+        table = pa.concat_tables(self.buffer).unify_dictionaries()
+        self.writer.write_table(
+            _sort_table(table.slice(0, size), self.sort), row_group_size=size
+        )
+
+        remainder = table.slice(size)
+        self.buffer = [remainder] if remainder.num_rows else []
+        self.buffered_rows = remainder.num_rows
+
+        self.encode_time += time.perf_counter() - start
+
+
+def _partition_table(table: pa.Table, keys: List[str]):
+    """
+    Split a table on the values of key columns, in the order the values first appear.
+    Rows keep their order within a partition.
+    :param table: The table
+    :param keys: The key columns
+    :return: The (key values, partition) pairs
+    """
+    codes = np.zeros(table.num_rows, dtype=np.int64)
+    key_values = []
+
+    for key in keys:
+        key_column = table[key].combine_chunks()
+        if not pa.types.is_dictionary(key_column.type):
+            key_column = key_column.dictionary_encode()
+
+        # Nulls get the code after the last value of the dictionary
+        values = key_column.dictionary.to_pylist() + [None]
+        indices = pc.fill_null(key_column.indices, len(values) - 1).to_numpy()
+
+        codes = codes * len(values) + indices
+        key_values.append(values)
+
+    groups, first_rows, inverse, counts = np.unique(
+        codes, return_index=True, return_inverse=True, return_counts=True
+    )
+    table = table.take(pa.array(np.argsort(inverse, kind="stable")))
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    for group in np.argsort(first_rows):
+        code = int(groups[group])
+        values = []
+
+        for key_value in reversed(key_values):
+            code, index = divmod(code, len(key_value))
+            values.append(key_value[index])
+
+        yield tuple(reversed(values)), table.slice(offsets[group], counts[group])
+
+
+class _PartitionedParquetWriter:
+    """
+    Hash-partition tables on key columns, each partition being written to its own
+    _BufferedParquetWriter. When more than GROUP_PARTITION_BUFFER_ROWS rows are
+    buffered across partitions, the largest buffer is written.
+    """
+
+    def __init__(
+        self, schema: pa.Schema, keys: List[str], layout: ComponentParquetizeLayoutConfig
+    ):
+        self.schema = schema
+        self.keys = keys
+        self.layout = layout
+        self.partitions: Dict[tuple, _BufferedParquetWriter] = {}
+
+    def write(self, table: pa.Table):
+        if not table.num_rows:
+            return
+
+        for key, partition in _partition_table(table, self.keys):
+            if key not in self.partitions:
+                self.partitions[key] = _BufferedParquetWriter(self.schema, self.layout)
+
+            self.partitions[key].write(partition)
+
+        while (
+            sum(writer.buffered_rows for writer in self.partitions.values())
+            > GROUP_PARTITION_BUFFER_ROWS
+        ):
+            max(self.partitions.values(), key=lambda writer: writer.buffered_rows).flush()
+
+
+def _fetch_group_rows(
+    connection, parquet_table, previous_group, group_start, group_end
+) -> list:
     # Fetch data from the database within the specified date range
     data_query = (
         select(
@@ -212,195 +658,415 @@ def _generate_group(
         .order_by(parquet_table.c.start_date.asc())
     )
 
-    data_rows = connection.execute(data_query).fetchall()
+    return [tuple(row) for row in connection.execute(data_query).fetchall()]
+
 
+def _generate_group(
+    parquetize_table: str,
+    group: ComponentParquetizeGroupConfig,
+    partitioning: str,
+    schema: dict,
+    arrow_schema: pa.Schema,
+    data_rows: list,
+    group_start,
+    group_end,
+) -> Optional[List[dict]]:
+    """
+    Merge the files of the previous group into the file(s) of a group.
+    :return: The rows to insert in the parquetize table (and the footers of the files to
+    summarize, as file_metadata), or None if there is nothing to commit
+    """
     urls = [row[0] for row in data_rows]
-    datas = [BytesIO(storage_manager.read(url)) for url in urls]
 
-    table = None
+    if group.keys:
+        writer = _PartitionedParquetWriter(arrow_schema, group.keys, group.layout)
+    else:
+        writer = _BufferedParquetWriter(arrow_schema, group.layout)
 
-    for data in datas:
-        if table is None:
-            table = pq.read_table(data)
-        else:
-            table = pa.concat_tables(
-                [table, pq.read_table(data)], promote=True, safe=False
-            )
+    total_row_count = 0
 
-    total_row_count = table.num_rows
+    # Stream the files of the previous group batch by batch, downloading the next ones meanwhile
+    for data in _prefetch(storage_manager.read_buffer, urls, GROUP_DOWNLOAD_AHEAD):
+        parquet_file = pq.ParquetFile(pa.BufferReader(data))
 
-    if group.keys:
-        # if table is empty, skip
-        if total_row_count == 0:
-            return
-        polars_df = polars.from_arrow(table)
-        for partitioned in polars_df.partition_by(*group.keys):
-            keys = partitioned.select(group.keys).unique()
+        for batch in parquet_file.iter_batches(batch_size=GROUP_ROW_GROUP_SIZE):
+            # Batches written with inferred types (before the schema was fixed) are cast to it
+            table = conform_table(pa.Table.from_batches([batch]), arrow_schema)
+            total_row_count += table.num_rows
+            writer.write(table)
 
-            filtered_table = partitioned.to_arrow()
+    if not group.keys:
+        data = writer.close()
+
+        file_name, relative_path = _parquetize_file_name(
+            parquetize_table,
+            parquetize_table,
+            partitioning,
+            group.group,
+            group_start,
+            group_end,
+        )
+        url = storage_manager.write(file_name, data)
 
-            filtered_row_count = filtered_table.num_rows
-            output = BytesIO()
+        original_size = sum([row[4] for row in data_rows])
 
-            pq.write_table(
-                filtered_table,
-                output,
-                compression="gzip",
-                use_dictionary=True,
-                compression_level=9,
+        return [
+            dict(
+                start_date=group_start,
+                end_date=group_end,
+                data=url,
+                count=sum([row[2] for row in data_rows]),
+                skipped=sum([row[3] for row in data_rows]),
+                schema=schema,
+                aggregation=group.group,
+                original_size=original_size,
+                compressed_size=len(data),
+                codec=group.layout.compression,
+                compression_ratio=original_size / len(data),
+                encode_time=writer.encode_time,
+                file_metadata=_file_metadata(data, relative_path),
             )
+        ]
 
-            keys_suffix = "_".join(
-                [f"{key}_{value[0]}" for key, value in zip(group.keys, keys)]
-            )
-            url = storage_manager.write(
-                f"{parquetize_table}/{group_start.strftime('%Y-%m-%d_%H-%M-%S')}_to_{group_end.strftime('%Y-%m-%d_%H-%M-%S')}_{keys_suffix}.parquet",
-                output.getvalue(),
-            )
+    # if table is empty, skip
+    if total_row_count == 0:
+        return None
+
+    files = []
+
+    for key, partition_writer in writer.partitions.items():
+        keys = dict(zip(group.keys, key))
+        file_name, relative_path = _parquetize_file_name(
+            parquetize_table,
+            parquetize_table,
+            partitioning,
+            group.group,
+            group_start,
+            group_end,
+            keys,
+        )
+        files.append((file_name, partition_writer.close(), relative_path, keys, partition_writer))
 
-            original_size = (
-                sum([row[4] for row in data_rows])
-                / total_row_count
-                * filtered_row_count
-            )
+    # The files of the partitions are uploaded together
+    urls = storage_manager.write_many([(file_name, data) for file_name, data, *_ in files])
+    values = []
 
-            compressed_size = output.getbuffer().nbytes
-
-            connection.execute(
-                parquet_table.insert().values(
-                    start_date=group_start,
-                    end_date=group_end,
-                    data=url,
-                    count=filtered_row_count,
-                    skipped=0,
-                    schema=schema,
-                    aggregation=group.group,
-                    original_size=original_size,
-                    compressed_size=compressed_size,
-                    keys={key: value[0] for key, value in zip(group.keys, keys)},
-                )
-            )
-    else:
-        output = BytesIO()
-        pq.write_table(
-            table,
-            output,
-            compression="gzip",
-            use_dictionary=True,
-            compression_level=9,
-        )
+    for url, (_, data, relative_path, keys, partition_writer) in zip(urls, files):
+        filtered_row_count = partition_writer.num_rows
 
-        url = storage_manager.write(
-            f"{parquetize_table}/{group_start.strftime('%Y-%m-%d_%H-%M-%S')}_to_{group_end.strftime('%Y-%m-%d_%H-%M-%S')}.parquet",
-            output.getvalue(),
+        original_size = (
+            sum([row[4] for row in data_rows]) / total_row_count * filtered_row_count
         )
 
-        original_size = sum([row[4] for row in data_rows])
-        compressed_size = output.getbuffer().nbytes
-
-        connection.execute(
-            parquet_table.insert().values(
+        values.append(
+            dict(
                 start_date=group_start,
                 end_date=group_end,
                 data=url,
-                count=sum([row[2] for row in data_rows]),
-                skipped=sum([row[3] for row in data_rows]),
+                count=filtered_row_count,
+                skipped=0,
                 schema=schema,
                 aggregation=group.group,
                 original_size=original_size,
-                compressed_size=compressed_size,
+                compressed_size=len(data),
+                keys=keys,
+                codec=group.layout.compression,
+                compression_ratio=original_size / len(data),
+                encode_time=partition_writer.encode_time,
+                file_metadata=_file_metadata(data, relative_path),
             )
         )
 
-    if not group.keys:
-        # Delete the processed data (period and batch)
-        connection.execute(
-            parquet_table.delete().where(
-                parquet_table.c.start_date.between(group_start, group_end)
-                & (column("aggregation") == previous_group.group)
+    return values
+
+
+class _CachedValidators:
+    validators = {}
+
+
+# Python types of the JSON schema types, matched exactly (a bool is not an integer)
+_JSON_TYPES = {
+    "string": {str},
+    "integer": {int},
+    "number": {int, float},
+    "boolean": {bool},
+    "null": {type(None)},
+    "object": {dict},
+    "array": {list},
+}
+
+
+def _compile_schema(schema):
+    """
+    Compile a JSON schema to a plain Python check, if it only uses the "type", "items",
+    "properties" and "required" keywords. The check may reject values the schema
+    accepts (e.g. 1.0 as an integer) but never accepts invalid ones.
+    :param schema: The JSON schema
+    :return: The check, or None if the schema uses other keywords
+    """
+    if not isinstance(schema, dict) or not set(schema) <= {
+        "type",
+        "items",
+        "properties",
+        "required",
+    }:
+        return None
+
+    checks = []
+
+    if "type" in schema:
+        names = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        if not all(name in _JSON_TYPES for name in names):
+            return None
+
+        types = set().union(*(_JSON_TYPES[name] for name in names))
+        checks.append(lambda value: type(value) in types)
+
+    if "items" in schema:
+        item_check = _compile_schema(schema["items"])
+        if item_check is None:
+            return None
+
+        property_types = _flat_object_types(schema["items"])
+
+        if property_types is None:
+            checks.append(
+                lambda value: type(value) is not list or all(map(item_check, value))
+            )
+        else:
+            # Objects with only typed properties (e.g. snapshots of records) are
+            # checked one property at a time, on the set of types it has
+            checks.append(
+                lambda value: type(value) is not list
+                or (
+                    all(map(item_check, value))
+                    if any(type(item) is not dict for item in value)
+                    else all(
+                        {type(item[name]) for item in value if name in item} <= types
+                        for name, types in property_types.items()
+                    )
+                )
+            )
+
+    if "properties" in schema:
+        property_checks = {
+            name: _compile_schema(property_schema)
+            for name, property_schema in schema["properties"].items()
+        }
+        if None in property_checks.values():
+            return None
+
+        checks.append(
+            lambda value: type(value) is not dict
+            or all(
+                check(value[name])
+                for name, check in property_checks.items()
+                if name in value
             )
         )
 
-    connection.commit()
+    if "required" in schema:
+        required = list(schema["required"])
+        checks.append(
+            lambda value: type(value) is not dict
+            or all(name in value for name in required)
+        )
+
+    return lambda value: all(check(value) for check in checks)
 
-    if not group.keys:
-        # Delete files
-        for url in urls:
-            storage_manager.delete(url)
 
+def _flat_object_types(schema):
+    """
+    Get the types of the properties of an object schema whose properties only have a type.
+    :param schema: The JSON schema
+    :return: The Python types by property name, or None if the schema is not of this form
+    """
+    if (
+        not isinstance(schema, dict)
+        or not set(schema) <= {"type", "properties"}
+        or schema.get("type", "object") != "object"
+    ):
+        return None
 
-def fetch_data(row):
-    data = storage_manager.read(row[0])
-    return data, row[1]
+    property_types = {}
 
+    for name, property_schema in schema.get("properties", {}).items():
+        if not isinstance(property_schema, dict) or set(property_schema) != {"type"}:
+            return None
 
-def _generate_batch(
-    component_config, connection, parquet_table, period_end, period_start, source
-):
+        names = property_schema["type"]
+        names = names if isinstance(names, list) else [names]
+        if not all(type_name in _JSON_TYPES for type_name in names):
+            return None
+
+        property_types[name] = set().union(*(_JSON_TYPES[type_name] for type_name in names))
+
+    return property_types
+
+
+def _get_validator(schema: dict):
+    """
+    Get the validation functions of a JSON schema, built once per schema (`jsonschema.validate`
+    checks the schema and builds a validator on every call).
+    :param schema: The JSON schema
+    :return: A fast check telling if a value is valid, and the jsonschema validator to get the
+    error of the values the check rejects
+    """
+    key = json.dumps(schema, sort_keys=True)
+
+    if key not in _CachedValidators.validators:
+        validator_class = validator_for(schema)
+        validator_class.check_schema(schema)
+        validator = validator_class(schema)
+
+        _CachedValidators.validators[key] = (
+            _compile_schema(schema) or validator.is_valid,
+            validator,
+        )
+
+    return _CachedValidators.validators[key]
+
+
+def _snapshots_to_table(snapshots, schema: pa.Schema) -> pa.Table:
+    """
+    Convert validated snapshots (lists of records) to a single Arrow table with
+    a "date" column holding the date of the snapshot of each record. The fields of
+    the records absent from the schema are dropped, with a warning.
+    :param snapshots: The (records, date) pairs
+    :param schema: The Arrow schema of the records (see parquetize_arrow_schema)
+    :return: The table
+    """
+    rows = []
+    counts = []
+
+    for data, _ in snapshots:
+        rows.extend(data)
+        counts.append(len(data))
+
+    if not rows:
+        return schema.empty_table()
+
+    # Only the declared fields are stored, a new field must be added to the schema to be kept
+    undeclared = set().union(*rows).difference(schema.names)
+    if undeclared:
+        logger.warning(
+            f"Dropping the fields {sorted(undeclared)}, not declared in the parquetize schema"
+        )
+
+    arrays = []
+
+    for field in schema:
+        if field.name == DATE_COLUMN:
+            # The date is constant within a snapshot, repeat it instead of copying it in every record
+            dates = pa.array([date for _, date in snapshots], type=field.type)
+            arrays.append(dates.take(pa.array(np.repeat(np.arange(len(counts)), counts))))
+            continue
+
+        values = [row.get(field.name) for row in rows]
+
+        # String columns may also accept other types (e.g. older integer line ids)
+        value_type = field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+        if pa.types.is_string(value_type):
+            values = [
+                value if value is None or type(value) is str else str(value)
+                for value in values
+            ]
+
+        arrays.append(pa.array(values, type=field.type))
+
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _fetch_batch_rows(connection, source, period_start, period_end) -> list:
     # Fetch data from the database within the specified date range
-    data_query = select(source.c.data, source.c.date).where(
-        source.c.date.between(period_start, period_end)
+    data_query = (
+        select(source.c.data, source.c.date, source.c.type)
+        .where(source.c.date.between(period_start, period_end))
+        .order_by(source.c.date.asc())
     )
-    data_rows = connection.execute(data_query).fetchall()
 
-    # Using ThreadPoolExecutor to parallelize fetching
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Submit fetch tasks to the executor
-        future_to_row = {executor.submit(fetch_data, row): row for row in data_rows}
+    return [tuple(row) for row in connection.execute(data_query).fetchall()]
 
-        # Collect the results as they complete
-        responses = [
-            future.result() for future in concurrent.futures.as_completed(future_to_row)
-        ]
 
-        datas = [(json.loads(data), date) for data, date in responses]
+def _generate_batch(
+    component_name: str,
+    parquetize_name: str,
+    parquetize_config: ComponentParquetizeConfig,
+    data_rows: list,
+    period_start,
+    period_end,
+) -> dict:
+    """
+    Convert the snapshots of a period to a batch file.
+    :return: The row to insert in the parquetize table (and the footer of the file to
+    summarize, as file_metadata)
+    """
+    # Downloads are pipelined on the async storage, keeping the date order
+    responses = [
+        (decode_blob(data, row[2]), row[1])
+        for data, row in zip(
+            storage_manager.read_many([row[0] for row in data_rows]), data_rows
+        )
+    ]
 
-    not_skipped = 0
+    is_valid, validator = _get_validator(parquetize_config.schema)
     validated_datas = []
-    validate_schema = component_config.parquetize.schema
 
-    for data, date in datas:
+    for data, date in responses:
+        data = json.loads(data)
         try:
-            # Validate data once, without creating new structures for now
-            validate(data, validate_schema)
-            not_skipped += 1
-            # Use a list comprehension to handle transformation in one step
-            new_data = [{**item, "lineId": str(item["lineId"])} for item in data]
-            flattened = [{**item, "date": date} for item in new_data]
-            # Append the transformed data directly
-            validated_datas.extend(flattened)
+            if not is_valid(data):
+                validator.validate(data)
+            validated_datas.append((data, date))
         except ValidationError as val:
             logger.warning(f"Error validating data: {val}")
 
+    not_skipped = len(validated_datas)
+
     # Save the data to the parquet table
-    table = pa.Table.from_pylist(validated_datas)
+    table = _snapshots_to_table(
+        validated_datas,
+        parquetize_arrow_schema(parquetize_config.schema, parquetize_config.dictionary),
+    )
+    layout = parquetize_config.batch_layout
+    # Same default as pyarrow
+    row_group_size = layout.row_group_size or 1024 * 1024
+
+    start = time.perf_counter()
     output = BytesIO()
     pq.write_table(
-        table,
+        _sort_table(table, layout.sort),
         output,
-        compression="snappy",
-        use_dictionary=True,
+        row_group_size=row_group_size,
+        **_writer_options(layout, table.schema, min(row_group_size, table.num_rows)),
     )
-
-    url = storage_manager.write(
-        f"{component_config.parquetize_name}/{period_start.strftime('%Y-%m-%d_%H-%M-%S')}_to_{period_end.strftime('%Y-%m-%d_%H-%M-%S')}.parquet",
-        output.getvalue(),
+    encode_time = time.perf_counter() - start
+
+    file_name, relative_path = _parquetize_file_name(
+        parquetize_name,
+        component_name,
+        parquetize_config.partitioning,
+        parquetize_config.batch,
+        period_start,
+        period_end,
     )
+    url = storage_manager.write(file_name, output.getvalue())
 
     original_size = sum([len(data) for data, _ in responses])
     compressed_size = output.getbuffer().nbytes
 
-    connection.execute(
-        parquet_table.insert().values(
-            start_date=period_start,
-            end_date=period_end,
-            data=url,
-            count=not_skipped,
-            skipped=len(data_rows) - not_skipped,
-            schema=component_config.parquetize.schema,
-            aggregation=component_config.parquetize.batch,
-            original_size=original_size,
-            compressed_size=compressed_size,
-        )
+    return dict(
+        start_date=period_start,
+        end_date=period_end,
+        data=url,
+        count=not_skipped,
+        skipped=len(data_rows) - not_skipped,
+        schema=parquetize_config.schema,
+        aggregation=parquetize_config.batch,
+        original_size=original_size,
+        compressed_size=compressed_size,
+        codec=layout.compression,
+        compression_ratio=original_size / compressed_size,
+        encode_time=encode_time,
+        file_metadata=_file_metadata(output.getvalue(), relative_path),
     )
-    connection.commit()
@@ -0,0 +1,281 @@
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import Table, func, select, update
+
+from src.configuration.model import ComponentConfiguration
+from src.data.engine import engine
+from src.data.partition import drop_partition, is_partitioned, list_partitions
+from src.data.retrieve import retrieve_latest_rows_before_datetime
+from src.data.state import retrieve_component_state, update_released_component_state
+from src.data.storage import storage_manager
+from src.runners._utils import schedule_string_to_time_delta
+from src.runners.run_harvester import source_range_to_period_and_limit
+
+logger = logging.getLogger("Retention")
+
+# Rows released (pointers nulled, then blobs deleted or tiered) per transaction
+RETENTION_BATCH_SIZE = 1000
+
+# Delay between two retention runs of a component, in seconds
+RETENTION_INTERVAL = 3600
+
+
+def run_retention_on_schedule(
+    component_config: ComponentConfiguration,
+    harvesters: Dict[str, ComponentConfiguration],
+    tables: Dict[str, Table],
+):
+    logger.info(f"Running retention {component_config.name} on schedule")
+
+    while True:
+        logger.debug(f"Running retention {component_config.name}")
+        try:
+            run_retention(component_config, harvesters, tables)
+        except Exception as e:
+            logger.exception(f"Retention {component_config.name} failed: {e}")
+
+        time.sleep(RETENTION_INTERVAL)
+
+
+def run_retention(
+    component_config: ComponentConfiguration,
+    harvesters: Dict[str, ComponentConfiguration],
+    tables: Dict[str, Table],
+) -> int:
+    """
+    Release the raw blobs of a component older than its retention cutoff (see
+    retention_cutoff): their pointers (data and hash) are nulled in bulk, then the blobs
+    are deleted. The rows themselves are kept, so the dates harvesters resume from do
+    not change, but they are null rows from then on, skipped by every query on the
+    component (base_query). The monthly partitions of a partitioned table whose rows
+    were all released are then dropped.
+    With the action "tier", the blobs are moved to a cold access tier instead and only
+    their hash is nulled: they are no longer served, but their rows keep pointing to
+    them (data), so they can be restored. Their partitions are not dropped.
+
+    :param component_config: The component configuration
+    :param harvesters: The harvesters configuration, to find the ones using the component
+    :param tables: The tables
+    :return: The number of blobs released
+    """
+    retention_config = component_config.retention
+
+    assert (
+        retention_config is not None
+    ), f"Retention configuration is missing in the component configuration {component_config.name}"
+
+    if retention_config.action == "tier" and retention_config.tier not in storage_manager.tiers:
+        raise ValueError(
+            f"Cannot move blobs of {component_config.name} to the tier {retention_config.tier}, "
+            f"the storage tiers are {storage_manager.tiers}"
+        )
+
+    table = tables[component_config.name]
+    cutoff = retention_cutoff(component_config, harvesters, tables)
+
+    if cutoff is None:
+        logger.info(f"Nothing to release for {component_config.name} yet")
+        return 0
+
+    logger.info(f"Releasing blobs of {component_config.name} before {cutoff}")
+
+    with engine.connect() as connection:
+        # Copies have no blob of their own, they only need to stop pointing to their original
+        connection.execute(
+            update(table)
+            .where(table.c.date < cutoff)
+            .where(table.c.copy_id.isnot(None))
+            .values(copy_id=None)
+        )
+        connection.commit()
+
+        # Originals still referenced by copies after the cutoff are kept
+        referenced = select(table.c.copy_id).where(table.c.copy_id.isnot(None))
+        released = 0
+
+        if retention_config.action == "tier":
+            # Tiered blobs keep their pointer, the null rows (and their empty blobs) are left
+            releasable = table.c.hash.isnot(None)
+            released_values = dict(hash=None)
+        else:
+            releasable = table.c.data.isnot(None)
+            released_values = dict(data=None, hash=None)
+
+        while True:
+            rows = connection.execute(
+                select(table.c.id, table.c.data)
+                .where(table.c.date < cutoff)
+                .where(releasable)
+                .where(table.c.id.notin_(referenced))
+                .order_by(table.c.date.asc())
+                .limit(RETENTION_BATCH_SIZE)
+            ).fetchall()
+
+            if not rows:
+                break
+
+            connection.execute(
+                update(table)
+                .where(table.c.id.in_([row.id for row in rows]))
+                .values(**released_values)
+            )
+            connection.commit()
+
+            # Rows stop being served first, so none is read from a missing or tiered blob
+            if retention_config.action == "tier":
+                storage_manager.tier_many([row.data for row in rows], retention_config.tier)
+            else:
+                storage_manager.delete_many([row.data for row in rows])
+
+            released += len(rows)
+
+    logger.info(f"Released {released} blobs of {component_config.name}")
+
+    dropped_count = 0
+
+    if is_partitioned(table):
+        dropped_count = _drop_released_partitions(component_config.name, table, cutoff)
+
+    # The first row with data moved, and dropped partitions removed rows
+    update_released_component_state(component_config.name, table, dropped_count)
+
+    return released
+
+
+def _drop_released_partitions(component_name: str, table: Table, cutoff: datetime) -> int:
+    """
+    Drop the monthly partitions of a table before a cutoff whose rows were all released,
+    unless they hold the latest row of the table (where a harvester resumes from).
+    :param component_name: The component name
+    :param table: The partitioned table
+    :param cutoff: The retention cutoff
+    :return: The number of rows dropped
+    """
+    state = retrieve_component_state(component_name)
+    last_date = state and state.last_date
+    dropped_count = 0
+
+    for name, start, end in list_partitions(table):
+        if end > cutoff or (last_date is not None and last_date < end):
+            break
+
+        with engine.connect() as connection:
+            # Originals still referenced by copies are not released
+            count, kept = connection.execute(
+                select(
+                    func.count(),
+                    func.count().filter(
+                        table.c.data.isnot(None) | table.c.copy_id.isnot(None)
+                    ),
+                )
+                .select_from(table)
+                .where(table.c.date >= start)
+                .where(table.c.date < end)
+            ).one()
+
+        if kept:
+            continue
+
+        logger.info(f"Dropping partition {name} of {table.name}")
+        drop_partition(table, name)
+        dropped_count += count
+
+    return dropped_count
+
+
+def retention_cutoff(
+    component_config: ComponentConfiguration,
+    harvesters: Dict[str, ComponentConfiguration],
+    tables: Dict[str, Table],
+) -> Optional[datetime]:
+    """
+    Get the date before which the raw blobs of a component can be released. It is the
+    earliest of:
+    - the current date minus the KEEP duration of the retention policy,
+    - the end of the last parquetized period, if the component is parquetized,
+    - for each harvester using the component as source, the start of the next period
+      it will harvest (if read by id, also the last source row it processed and the
+      earliest row after it, as a row committed late can have an earlier date),
+    - for each harvester using the component as (optional) dependency, the date of the
+      oldest of the latest rows (DEPENDENCIES_LIMIT) it gets before its last harvest.
+    Handlers are not taken into account, they only see the rows after the cutoff.
+
+    :param component_config: The component configuration
+    :param harvesters: The harvesters configuration
+    :param tables: The tables
+    :return: The cutoff, or None if no blob can be released (e.g. a harvester using the
+    component never ran)
+    """
+    table = tables[component_config.name]
+    cutoffs = [datetime.now() - schedule_string_to_time_delta(component_config.retention.keep)]
+
+    if component_config.parquetize is not None:
+        parquet_table = tables[component_config.parquetize_name]
+
+        with engine.connect() as connection:
+            # Where parquetize resumes, all the records before are in parquetize files
+            parquetized = connection.execute(
+                select(func.max(parquet_table.c.end_date))
+            ).scalar()
+
+        if parquetized is None:
+            return None
+
+        cutoffs.append(parquetized)
+
+    for harvester_config in harvesters.values():
+        dependencies = list(
+            zip(harvester_config.dependencies, harvester_config.dependencies_limit)
+        ) + list(
+            zip(
+                harvester_config.optional_dependencies,
+                harvester_config.optional_dependencies_limit
+                or [1] * len(harvester_config.optional_dependencies),
+            )
+        )
+        limits = [
+            limit
+            for dependency, limit in dependencies
+            if dependency.name == component_config.name
+        ]
+        is_source = (
+            harvester_config.source is not None
+            and harvester_config.source.name == component_config.name
+        )
+
+        if not limits and not is_source:
+            continue
+
+        state = retrieve_component_state(harvester_config.name)
+
+        if state is None or state.last_date is None:
+            return None
+
+        if is_source:
+            start_date, _, _ = source_range_to_period_and_limit(
+                state.last_date, harvester_config.source_range
+            )
+            cutoffs.append(start_date)
+
+            # Read by id, the rows left to harvest are the ones after the last source row
+            if harvester_config.source_cursor == "id" and state.source_id is not None:
+                cutoffs.append(state.source_date)
+
+                with engine.connect() as connection:
+                    pending = connection.execute(
+                        select(func.min(table.c.date)).where(table.c.id > state.source_id)
+                    ).scalar()
+
+                if pending is not None:
+                    cutoffs.append(pending)
+
+        for limit in limits:
+            needed = retrieve_latest_rows_before_datetime(table, state.last_date, limit)
+
+            if needed:
+                cutoffs.append(needed[-1].date)
+
+    return min(cutoffs)
@@ -1,67 +1,192 @@
-import json
+import hashlib
 import os
-from datetime import datetime, timedelta
-from functools import lru_cache
-from tempfile import NamedTemporaryFile
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from io import BytesIO
+from zipfile import ZipFile
 
-import geopandas as gpd
+import numpy as np
 import pandas as pd
+import polars as pl
 from google.transit import gtfs_realtime_pb2
 from gtfs_parquet import read_parquet
+from gtfs_parquet.ops.stops import get_stop_times
+from gtfs_parquet.ops.trips import get_trips
 from pytz import timezone
 
+from src.data.retrieve import Data
 
-@lru_cache(maxsize=32)
-def load_gtfs_parquet_feed(zip_bytes: bytes):
+GTFS_CACHE_DIRECTORY = os.environ.get(
+    "GTFS_CACHE_DIRECTORY",
+    os.path.join(tempfile.gettempdir(), "gtfs_parquet_cache"),
+)
+
+# Upper bound of the parsed feeds kept in memory, measured with polars' estimated size.
+GTFS_CACHE_MAX_BYTES = 2 * 1024**3
+
+# Number of extracted feeds kept on disk.
+GTFS_CACHE_MAX_FILES = 16
+
+
+class _CachedFeeds:
+    feeds = OrderedDict()
+    size = 0
+    lock = threading.Lock()
+
+
+def load_gtfs_parquet_feed(gtfs: Data):
     """
-    Load GTFS feed from a parquet zip archive.
-    @param zip_bytes: A parquet zip file in bytes
+    Load GTFS feed from a gtfs_parquet row.
+    Feeds are cached by the content hash of the row, so a cache hit neither downloads
+    the archive nor parses it again. On a miss, the archive is extracted once per node
+    to a local directory which is then read (memory-mapped) by polars.
+    @param gtfs: A row holding a parquet zip archive
     @return: gtfs_parquet Feed
     """
-    tmp = NamedTemporaryFile(delete=False, suffix=".zip")
-    tmp.write(zip_bytes)
-    tmp.close()
+    key = gtfs.hash or hashlib.md5(gtfs._url.encode("utf-8")).hexdigest()
 
-    feed = read_parquet(tmp.name)
+    with _CachedFeeds.lock:
+        if key in _CachedFeeds.feeds:
+            _CachedFeeds.feeds.move_to_end(key)
+            return _CachedFeeds.feeds[key][0]
 
-    os.unlink(tmp.name)
+    feed = read_parquet(_local_feed_directory(key, gtfs))
+    size = sum(table.estimated_size() for table in feed.tables().values())
+
+    with _CachedFeeds.lock:
+        if key not in _CachedFeeds.feeds:
+            _CachedFeeds.feeds[key] = (feed, size)
+            _CachedFeeds.size += size
+
+        while _CachedFeeds.size > GTFS_CACHE_MAX_BYTES and len(_CachedFeeds.feeds) > 1:
+            _, (_, evicted_size) = _CachedFeeds.feeds.popitem(last=False)
+            _CachedFeeds.size -= evicted_size
 
     return feed
 
 
-def load_gtfs_realtime_from_bytes_to_df(gtfs_realtime_bytes: bytes):
+def _local_feed_directory(key: str, gtfs: Data) -> str:
+    """
+    Get the local directory holding the extracted parquet files of a feed, extracting
+    it if needed. The directory is filled under a temporary name then renamed, so
+    concurrent processes never see a partial feed.
     """
-    Load GTFS realtime feed from bytes to dataframe
+    directory = os.path.join(GTFS_CACHE_DIRECTORY, key)
+
+    if os.path.isdir(directory):
+        os.utime(directory)
+        return directory
+
+    os.makedirs(GTFS_CACHE_DIRECTORY, exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(prefix=f".{key}-", dir=GTFS_CACHE_DIRECTORY)
+
+    # A local archive is opened in place rather than read to memory
+    with ZipFile(gtfs.path or BytesIO(gtfs.data)) as zip_file:
+        for entry in zip_file.namelist():
+            if entry.endswith(".parquet"):
+                with zip_file.open(entry) as src, open(
+                    os.path.join(tmp_directory, os.path.basename(entry)), "wb"
+                ) as f:
+                    shutil.copyfileobj(src, f)
+
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        # Another process extracted the same feed in the meantime
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+
+    _prune_local_feeds()
+
+    return directory
+
+
+def _prune_local_feeds():
+    directories = sorted(
+        (
+            entry
+            for entry in os.scandir(GTFS_CACHE_DIRECTORY)
+            if entry.is_dir() and not entry.name.startswith(".")
+        ),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+
+    for entry in directories[GTFS_CACHE_MAX_FILES:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def load_gtfs_realtime_from_bytes_to_df(
+    gtfs_realtime_bytes: bytes, all_stop_time_updates: bool = False
+):
+    """
+    Load GTFS realtime trip updates from bytes to dataframe.
+    The feed is decoded in a single pass straight into preallocated column arrays.
+    By default, one row is kept per trip: its next stop (first stop time update with an
+    arrival time). With all_stop_time_updates, one row is kept per stop time update.
     @param gtfs_realtime_bytes: GTFS realtime feed in bytes
+    @param all_stop_time_updates: Whether to keep every stop time update of each trip
     @return: GTFS realtime feed in dataframe
     """
     # noinspection PyUnresolvedReferences
     rt_feed = gtfs_realtime_pb2.FeedMessage()
     rt_feed.ParseFromString(gtfs_realtime_bytes)
 
-    trip_updates = []
+    trip_updates = [
+        entity.trip_update for entity in rt_feed.entity if entity.HasField("trip_update")
+    ]
+
+    if all_stop_time_updates:
+        size = sum(len(trip_update.stop_time_update) for trip_update in trip_updates)
+    else:
+        size = len(trip_updates)
+
+    trip_id = np.empty(size, dtype=object)
+    start_time = np.empty(size, dtype=object)
+    start_date = np.empty(size, dtype=object)
+    stop_id = np.empty(size, dtype=object)
+    stop_sequence = np.empty(size, dtype=np.int64)
+    arrival_delay = np.empty(size, dtype=np.int64)
+    arrival_time = np.empty(size, dtype=np.int64)
 
-    for entity in rt_feed.entity:
-        if entity.HasField("trip_update"):
-            trip_update = entity.trip_update
-            next_stops = [
-                a for a in trip_update.stop_time_update if a.arrival.time != 0
-            ]
-            if len(next_stops) == 0:
+    row = 0
+
+    for trip_update in trip_updates:
+        trip = trip_update.trip
+
+        for stop_time_update in trip_update.stop_time_update:
+            arrival = stop_time_update.arrival
+
+            if not all_stop_time_updates and arrival.time == 0:
                 continue
 
-            trip_updates.append(
-                {
-                    "trip_id": trip_update.trip.trip_id,
-                    "start_time": trip_update.trip.start_time,
-                    "start_date": trip_update.trip.start_date,
-                    "stop_id": next_stops[0].stop_id,
-                    "arrival_delay": next_stops[0].arrival.delay,
-                    "arrival_time": next_stops[0].arrival.time,
-                }
-            )
+            trip_id[row] = trip.trip_id
+            start_time[row] = trip.start_time
+            start_date[row] = trip.start_date
+            stop_id[row] = stop_time_update.stop_id
+            stop_sequence[row] = stop_time_update.stop_sequence
+            arrival_delay[row] = arrival.delay
+            arrival_time[row] = arrival.time
+            row += 1
+
+            if not all_stop_time_updates:
+                break
 
-    return pd.DataFrame(trip_updates)
+    columns = {
+        "trip_id": trip_id,
+        "start_time": start_time,
+        "start_date": start_date,
+        "stop_id": stop_id,
+        "arrival_delay": arrival_delay,
+        "arrival_time": arrival_time,
+    }
+
+    if all_stop_time_updates:
+        columns["stop_sequence"] = stop_sequence
+
+    return pd.DataFrame({name: values[:row] for name, values in columns.items()})
 
 
 def schedule_from_gtfs(gtfs_feed, start_timestamp: int, end_timestamp: int):
@@ -72,12 +197,6 @@ def schedule_from_gtfs(gtfs_feed, start_timestamp: int, end_timestamp: int):
     )
     end_date = datetime.utcfromtimestamp(end_timestamp).astimezone(tz=brussels_timezone)
 
-    source_date = end_date.date()
-
-    stops = gtfs_feed.get_stops(source_date).to_pandas()[
-        ["stop_id", "stop_name", "stop_lat", "stop_lon"]
-    ]
-
     output_data = []
 
     if start_date.day != end_date.day:
@@ -93,89 +212,195 @@ def schedule_from_gtfs(gtfs_feed, start_timestamp: int, end_timestamp: int):
 
         output_data += compute_data_for_one_date(
             gtfs_feed,
-            stops,
             midnight,
             end_date - timedelta(seconds=1)
         )
-        output_data += compute_data_for_one_date(gtfs_feed, stops, start_date, midnight)
+        output_data += compute_data_for_one_date(gtfs_feed, start_date, midnight)
     else:
-        output_data += compute_data_for_one_date(gtfs_feed, stops, start_date, end_date)
+        output_data += compute_data_for_one_date(gtfs_feed, start_date, end_date)
 
-    output_df = pd.DataFrame(output_data)
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "id": str(index),
+                "type": "Feature",
+                "properties": stop,
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [stop["stop_lon"], stop["stop_lat"]],
+                },
+            }
+            for index, stop in enumerate(output_data)
+        ],
+    }
 
-    gdf = gpd.GeoDataFrame(
-        output_df,
-        geometry=gpd.points_from_xy(output_df.stop_lon, output_df.stop_lat),
-    )
 
-    return json.loads(gdf.to_json())
+def compute_data_for_one_date(gtfs_feed, start_date, end_date):
+    index = get_schedule_index(gtfs_feed, start_date.date())
 
+    return index.schedule(_seconds_of_day(start_date), _seconds_of_day(end_date))
 
-def compute_data_for_one_date(gtfs_feed, stops, start_date, end_date):
-    source_date = start_date.date()
 
-    trips = gtfs_feed.get_trips(source_date).to_pandas()
-    stop_times = gtfs_feed.get_stop_times(source_date).to_pandas()
+def _seconds_of_day(date: datetime) -> int:
+    return date.hour * 3600 + date.minute * 60 + date.second
 
-    # arrival_time/departure_time are timedeltas from gtfs_parquet
-    start_td = pd.to_timedelta(start_date.strftime("%H:%M:%S"))
-    end_td = pd.to_timedelta(end_date.strftime("%H:%M:%S"))
 
-    stop_times = stop_times[
-        (stop_times["departure_time"] >= start_td)
-        & (stop_times["arrival_time"] <= end_td)
-    ]
+class IntervalIndex:
+    """
+    Index of intervals (e.g. trip legs or stop dwells, in seconds of the service day)
+    answering which intervals are active at a time or overlap a window in logarithmic
+    time. Intervals are sorted by start and augmented with the running maximum of
+    their ends: every interval before the first running maximum reaching a time ends
+    before it, every interval after the last start before a time starts after it, so
+    only the slice in between has to be checked.
+    """
+
+    def __init__(self, starts, ends):
+        starts = np.asarray(starts)
+        ends = np.asarray(ends)
+
+        self.order = np.argsort(starts, kind="stable")
+        self.starts = starts[self.order]
+        self.ends = ends[self.order]
+        self.max_ends = np.maximum.accumulate(self.ends) if len(ends) else self.ends
+
+    def active_at(self, time) -> np.ndarray:
+        """
+        Intervals strictly containing a time (start < time < end).
+        :param time: The time
+        :return: The positions of the intervals, in their original order
+        """
+        first = np.searchsorted(self.max_ends, time, side="right")
+        last = np.searchsorted(self.starts, time, side="left")
+
+        return self._select(first, last, self.ends[first:last] > time)
+
+    def overlapping(self, start, end) -> np.ndarray:
+        """
+        Intervals overlapping a window, bounds included (start <= interval end and
+        interval start <= end).
+        :param start: Start of the window
+        :param end: End of the window
+        :return: The positions of the intervals, in their original order
+        """
+        first = np.searchsorted(self.max_ends, start, side="left")
+        last = np.searchsorted(self.starts, end, side="right")
 
-    stop_times = stop_times.merge(trips, on="trip_id")
-
-    # Keep only required columns if they exist, otherwise ignore.
-    stop_times = stop_times[
-        list(
-            set(stop_times.columns).intersection(
-                [
-                    "trip_id",
-                    "arrival_time",
-                    "departure_time",
-                    "stop_id",
-                    "route_id",
-                    "trip_headsign",
-                    "trip_short_name",
-                ]
+        return self._select(first, last, self.ends[first:last] >= start)
+
+    def _select(self, first, last, mask) -> np.ndarray:
+        if first >= last:
+            return np.empty(0, dtype=np.int64)
+
+        return np.sort(self.order[first:last][mask])
+
+
+class ScheduleIndex:
+    """
+    Stop times of one service day, with the trip and stop attributes needed by the
+    schedules already joined, sorted by departure and with integer-second columns.
+    A schedule window query is then an interval index lookup plus a gather.
+    """
+
+    STOP_COLUMNS = ["stop_id", "stop_name", "stop_lat", "stop_lon"]
+    TRIP_COLUMNS = ["trip_id", "route_id", "trip_headsign", "trip_short_name"]
+
+    def __init__(self, gtfs_feed, service_date: date):
+        trips = get_trips(gtfs_feed, service_date)
+        trips = trips.select([c for c in self.TRIP_COLUMNS if c in trips.columns])
+
+        stop_times = (
+            get_stop_times(gtfs_feed, service_date)
+            .select(["trip_id", "stop_id", "arrival_time", "departure_time"])
+            .drop_nulls(["arrival_time", "departure_time"])
+            .join(trips, on="trip_id")
+            .join(gtfs_feed.stops.select(self.STOP_COLUMNS), on="stop_id")
+            .with_columns(
+                pl.col("arrival_time").dt.total_seconds().alias("arrival_seconds"),
+                pl.col("departure_time").dt.total_seconds().alias("departure_seconds"),
             )
+            .sort("departure_seconds")
         )
-    ]
-    stop_times = stop_times.merge(stops, on="stop_id")
-    output_data = []
-    for (stop_id, stop_name, stop_lat, stop_lon), group in stop_times.groupby(
-        ["stop_id", "stop_name", "stop_lat", "stop_lon"]
-    ):
-        # Convert timedeltas to HH:MM:SS strings for JSON output
-        schedule_cols = list(
-            set(group.columns).intersection(
-                [
-                    "trip_id",
-                    "arrival_time",
-                    "departure_time",
-                    "route_id",
-                    "trip_headsign",
-                    "trip_short_name",
-                ]
-            )
+
+        self.stop_times = stop_times.with_columns(
+            _format_seconds(pl.col("arrival_seconds")).alias("arrival_time"),
+            _format_seconds(pl.col("departure_seconds")).alias("departure_time"),
         )
-        schedule_df = group[schedule_cols].copy()
-        for col in ["arrival_time", "departure_time"]:
-            if col in schedule_df.columns:
-                schedule_df[col] = schedule_df[col].apply(
-                    lambda x: str(x).split(" ")[-1] if pd.notna(x) else None
-                )
-
-        output_data.append(
-            {
-                "stop_id": stop_id,
-                "stop_name": stop_name,
-                "stop_lat": stop_lat,
-                "stop_lon": stop_lon,
-                "schedule": schedule_df.to_dict(orient="records"),
-            }
+        self.schedule_columns = trips.columns + ["arrival_time", "departure_time"]
+
+        # A stop time is in a window if the vehicle is at the stop during the window
+        self.dwells = IntervalIndex(
+            stop_times["arrival_seconds"].to_numpy(),
+            stop_times["departure_seconds"].to_numpy(),
         )
-    return output_data
+
+    def between(self, start_seconds: int, end_seconds: int) -> pl.DataFrame:
+        """
+        Stop times departing at or after start_seconds and arriving at or before end_seconds.
+        :param start_seconds: Start of the window, in seconds since the start of the service day
+        :param end_seconds: End of the window, in seconds since the start of the service day
+        :return: The stop times, sorted by departure
+        """
+        return self.stop_times[self.dwells.overlapping(start_seconds, end_seconds)]
+
+    def schedule(self, start_seconds: int, end_seconds: int) -> list:
+        """
+        Schedule of every stop served between two times of the service day.
+        :param start_seconds: Start of the window, in seconds since the start of the service day
+        :param end_seconds: End of the window, in seconds since the start of the service day
+        :return: One item per stop, holding the stop attributes and its schedule
+        """
+        return (
+            self.between(start_seconds, end_seconds)
+            .group_by(self.STOP_COLUMNS, maintain_order=True)
+            .agg(pl.struct(self.schedule_columns).alias("schedule"))
+            .sort(self.STOP_COLUMNS)
+            .to_dicts()
+        )
+
+
+class _CachedScheduleIndexes:
+    indexes = OrderedDict()
+    lock = threading.Lock()
+
+
+# Number of (feed, service day) schedule indexes kept in memory.
+SCHEDULE_INDEX_CACHE_SIZE = 8
+
+
+def get_schedule_index(gtfs_feed, service_date: date) -> ScheduleIndex:
+    """
+    Get the schedule index of a feed for a service day, building it on first use.
+    @param gtfs_feed: gtfs_parquet Feed
+    @param service_date: The service day
+    @return: The schedule index
+    """
+    key = (id(gtfs_feed), service_date)
+
+    with _CachedScheduleIndexes.lock:
+        if key in _CachedScheduleIndexes.indexes:
+            _CachedScheduleIndexes.indexes.move_to_end(key)
+            return _CachedScheduleIndexes.indexes[key][1]
+
+    index = ScheduleIndex(gtfs_feed, service_date)
+
+    with _CachedScheduleIndexes.lock:
+        # Keep a reference to the feed so its id cannot be reused while cached
+        _CachedScheduleIndexes.indexes[key] = (gtfs_feed, index)
+
+        while len(_CachedScheduleIndexes.indexes) > SCHEDULE_INDEX_CACHE_SIZE:
+            _CachedScheduleIndexes.indexes.popitem(last=False)
+
+    return index
+
+
+def _format_seconds(seconds: pl.Expr) -> pl.Expr:
+    """Format a number of seconds as a GTFS HH:MM:SS time."""
+    return pl.format(
+        "{}:{}:{}",
+        *[
+            part.cast(pl.Int64).cast(pl.Utf8).str.zfill(2)
+            for part in (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+        ],
+    )
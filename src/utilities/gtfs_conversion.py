@@ -0,0 +1,142 @@
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Union
+
+logger = logging.getLogger("GTFSConversion")
+
+# Maximum number of conversions running at the same time in this process
+GTFS_CONVERSION_WORKERS = int(os.environ.get("GTFS_CONVERSION_WORKERS", 1))
+
+# Workers are replaced after this many conversions, to give back the memory
+# fragmented by large feeds.
+GTFS_CONVERSION_TASKS_PER_WORKER = 20
+
+# Shared memory blocks are files in this directory (Linux), which lets the
+# gtfs-parquet parser open the input zip by path without copying it to disk.
+SHARED_MEMORY_DIRECTORY = "/dev/shm"
+
+
+def _work(connection):
+    """
+    Loop of a conversion worker: receive the path of a GTFS zip (a local file or a
+    shared memory block), send back its tables as Parquet bytes (or the error message).
+    """
+    from gtfs_parquet import parse_gtfs, to_parquet_bytes
+
+    while True:
+        path = connection.recv()
+
+        if path is None:
+            return
+
+        try:
+            feed = parse_gtfs(path)
+            connection.send((to_parquet_bytes(feed), None))
+        except Exception as e:
+            connection.send((None, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self):
+        # Share the resource tracker of the parent, which creates and unlinks the blocks
+        resource_tracker.ensure_running()
+
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_work, args=(child_connection,), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        self.tasks = 0
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class _WorkerPool:
+    idle: List[_Worker] = []
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(GTFS_CONVERSION_WORKERS)
+
+
+def convert_gtfs_to_parquet(gtfs_zip: Union[bytes, str], timeout: float) -> Dict[str, bytes]:
+    """
+    Convert a GTFS zip to Parquet in a long-lived worker process. The worker is
+    spawned on first use and reused by the following conversions, it is killed
+    if a conversion exceeds the timeout and replaced after
+    GTFS_CONVERSION_TASKS_PER_WORKER conversions.
+    :param gtfs_zip: The GTFS zip file in bytes, or its path if it is a local file (read
+    by the worker in place, instead of being copied to shared memory)
+    :param timeout: The maximum duration of the conversion in seconds
+    :return: The Parquet file of each table, by table name
+    :raises TimeoutError: If the conversion did not finish in time
+    :raises RuntimeError: If the conversion failed
+    """
+    with _WorkerPool.slots:
+        with _WorkerPool.lock:
+            worker = _WorkerPool.idle.pop() if _WorkerPool.idle else None
+
+        # An idle worker has nothing to send, a readable connection means it died
+        if worker is not None and (worker.connection.poll() or not worker.process.is_alive()):
+            worker.kill()
+            worker = None
+
+        if worker is None:
+            worker = _Worker()
+
+        shared_memory = None
+
+        try:
+            if isinstance(gtfs_zip, str):
+                path = gtfs_zip
+            else:
+                shared_memory = SharedMemory(create=True, size=max(len(gtfs_zip), 1))
+                shared_memory.buf[: len(gtfs_zip)] = gtfs_zip
+                path = os.path.join(SHARED_MEMORY_DIRECTORY, shared_memory.name)
+
+            worker.connection.send(path)
+
+            if not worker.connection.poll(timeout):
+                worker.kill()
+                raise TimeoutError(f"GTFS conversion timed out after {timeout}s")
+
+            try:
+                tables, error = worker.connection.recv()
+            except (EOFError, OSError):
+                worker.kill()
+                raise RuntimeError(
+                    f"GTFS conversion worker died (exit code {worker.process.exitcode})"
+                )
+        finally:
+            if shared_memory is not None:
+                shared_memory.close()
+                shared_memory.unlink()
+
+        worker.tasks += 1
+
+        if worker.tasks >= GTFS_CONVERSION_TASKS_PER_WORKER:
+            logger.debug("Recycling GTFS conversion worker")
+            worker.stop()
+        else:
+            with _WorkerPool.lock:
+                _WorkerPool.idle.append(worker)
+
+        if error is not None:
+            raise RuntimeError(f"GTFS conversion failed: {error}")
+
+        return tables
@@ -1,11 +1,11 @@
 from datetime import datetime
 from typing import Dict
 
-import pandas as pd
-from geopandas import GeoDataFrame
+from geopandas import GeoDataFrame, points_from_xy
 from sqlalchemy import Table
 
-from src.data.retrieve import retrieve_between_datetime
+from src.data.retrieve import Cursor
+from src.utilities.trajectory import read_trajectory_page, TRAJECTORY_DATE_COLUMN
 
 
 def gdf_to_mf_json(
@@ -109,13 +109,24 @@ def _encode_temporal_properties(
     return temporal_properties_data
 
 
-def     fetch_geojsons_and_return_mf_json(
+def fetch_geojsons_and_return_mf_json(
     table: Table,
     id_column: str,
     start_timestamp: int = None,
     end_timestamp: int = None,
     columns_to_drop: list = None,
+    trajectory_table: Table = None,
+    cursor: Cursor = None,
 ):
+    """
+    Build the MF-JSON trajectories of every vehicle seen between two timestamps.
+    When a trajectory table is given, materialised periods are read from it instead
+    of re-parsing every GeoJSON snapshot of the source table.
+
+    Long windows are paginated: the response then holds a "next" continuation token
+    that must be passed back as cursor (with the same timestamps) to get the next page.
+    Vehicles seen only once are dropped, unless the window spans several pages.
+    """
     if end_timestamp is None and start_timestamp is not None:
         end_timestamp = start_timestamp + 60 * 60
     elif start_timestamp is None and end_timestamp is not None:
@@ -124,35 +135,41 @@ def     fetch_geojsons_and_return_mf_json(
         start_timestamp = datetime.utcnow().timestamp() - 60 * 60
         end_timestamp = datetime.utcnow().timestamp()
 
-    datas = retrieve_between_datetime(
+    df, next_cursor = read_trajectory_page(
+        trajectory_table,
         table,
         datetime.utcfromtimestamp(int(start_timestamp)),
         datetime.utcfromtimestamp(int(end_timestamp)),
-        limit=2000,
+        columns_to_drop,
+        cursor,
     )
 
-    if not datas:
+    if df.empty and next_cursor is None:
         return
 
-    df = GeoDataFrame()
+    pagination = {"next": next_cursor.encode()} if next_cursor is not None else {}
 
-    for item in datas:
-        gdf_for_one_time = GeoDataFrame.from_features(item.data["features"])
-        gdf_for_one_time["datetimes"] = item.date.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-        df = pd.concat([df, gdf_for_one_time])
+    if df.empty:
+        return {"features": [], "type": "FeatureCollection", **pagination}
 
-    if columns_to_drop:
-        df.drop(columns=columns_to_drop, inplace=True, errors="ignore")
-
-    # Drop where only one row for id_column
-    df = df.groupby(id_column).filter(lambda x: len(x) > 1)
-    df = df.reset_index(drop=True)
+    # Drop where only one row for id_column. Only done when the window fits in a single
+    # page, as a vehicle seen once on a page may have more positions on the others.
+    if cursor is None and next_cursor is None:
+        df = df[df.groupby(id_column)[id_column].transform("size") > 1]
+        df = df.reset_index(drop=True)
 
     if len(df) == 0:
         return {
             "features": [],
             "type": "FeatureCollection",
+            **pagination,
         }
 
+    df["datetimes"] = df[TRAJECTORY_DATE_COLUMN].dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    gdf = GeoDataFrame(
+        df.drop(columns=["lon", "lat", TRAJECTORY_DATE_COLUMN]),
+        geometry=points_from_xy(df["lon"], df["lat"]),
+    )
 
-    return gdf_to_mf_json(df, id_column, "datetimes")
+    return {**gdf_to_mf_json(gdf, id_column, "datetimes"), **pagination}
@@ -0,0 +1,162 @@
+import json
+import logging
+from typing import List
+
+import pyarrow as pa
+
+logger = logging.getLogger("ParquetSchema")
+
+# Column added to every parquetized record, holding the date of its snapshot
+DATE_COLUMN = "date"
+DATE_TYPE = pa.timestamp("us")
+
+# Root directory of the parquetize files written with the "hive" partitioning:
+# component=<name>/aggregation=<aggregation>/period_start=<date>/[<key>=<value>/]<file>
+HIVE_DIRECTORY = "parquetize"
+PERIOD_START_PARTITION = "period_start"
+
+# Summary of the footers of all the files of an aggregation, in the "hive" partitioning
+DATASET_METADATA_NAME = "_metadata"
+
+_SCALAR_TYPES = {
+    "string": pa.string(),
+    "integer": pa.int64(),
+    "number": pa.float64(),
+    "boolean": pa.bool_(),
+}
+
+
+class _CachedArrowSchemas:
+    schemas = {}
+
+
+def json_schema_to_arrow_type(schema: dict) -> pa.DataType:
+    """
+    Translate a JSON schema to the Arrow type of the values it validates. Nullable
+    types ("null" in a list of types) map to the type itself, since Arrow columns are
+    nullable. A list of types containing "string" maps to a string, the other values
+    being stored as their string representation.
+    :param schema: The JSON schema
+    :return: The Arrow type
+    """
+    names = schema.get("type")
+    names = names if isinstance(names, list) else [names]
+    names = [name for name in names if name != "null"]
+
+    if "string" in names:
+        return pa.string()
+
+    if set(names) == {"integer", "number"}:
+        return pa.float64()
+
+    if len(names) != 1:
+        raise ValueError(f"Cannot derive an Arrow type from the JSON schema {schema}")
+
+    name = names[0]
+
+    if name == "object" and "properties" in schema:
+        return pa.struct(
+            [
+                pa.field(key, json_schema_to_arrow_type(value))
+                for key, value in schema["properties"].items()
+            ]
+        )
+
+    if name == "array" and isinstance(schema.get("items"), dict):
+        return pa.list_(json_schema_to_arrow_type(schema["items"]))
+
+    if name in _SCALAR_TYPES:
+        return _SCALAR_TYPES[name]
+
+    raise ValueError(f"Cannot derive an Arrow type from the JSON schema {schema}")
+
+
+def parquetize_arrow_schema(schema: dict, dictionary: List[str] = None) -> pa.Schema:
+    """
+    Get the Arrow schema of the parquetized records of a component. The JSON schema
+    of its snapshots must be an array of objects, each property becoming a column,
+    followed by the date column.
+    :param schema: The JSON schema of a snapshot
+    :param dictionary: The (string) columns to dictionary encode
+    :return: The Arrow schema
+    """
+    dictionary = dictionary or []
+    key = json.dumps([schema, dictionary], sort_keys=True)
+
+    if key not in _CachedArrowSchemas.schemas:
+        items = schema.get("items")
+
+        if schema.get("type") != "array" or not isinstance(items, dict):
+            raise ValueError("The parquetize schema must be an array of objects")
+
+        record_type = json_schema_to_arrow_type(items)
+
+        if not pa.types.is_struct(record_type):
+            raise ValueError("The parquetize schema must be an array of objects")
+
+        fields = []
+
+        for field in record_type:
+            if field.name in dictionary:
+                field = field.with_type(pa.dictionary(pa.int32(), field.type))
+            fields.append(field)
+
+        fields.append(pa.field(DATE_COLUMN, DATE_TYPE))
+
+        _CachedArrowSchemas.schemas[key] = pa.schema(fields)
+
+    return _CachedArrowSchemas.schemas[key]
+
+
+def conform_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """
+    Cast a table to a schema: columns are reordered and cast, missing columns are
+    filled with nulls and columns absent from the schema are dropped, with a warning.
+    Used on Parquet files written before the schema was fixed, or rebuilt through Polars.
+    :param table: The table
+    :param schema: The schema
+    :return: The table with the schema
+    """
+    if table.schema.equals(schema):
+        return table
+
+    undeclared = set(table.column_names).difference(schema.names)
+    if undeclared:
+        logger.warning(
+            f"Dropping the columns {sorted(undeclared)}, not declared in the parquetize schema"
+        )
+
+    columns = []
+
+    for field in schema:
+        if field.name not in table.column_names:
+            columns.append(pa.nulls(table.num_rows, field.type))
+            continue
+
+        column = table[field.name]
+
+        if column.type == field.type:
+            columns.append(column)
+            continue
+
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+
+        if pa.types.is_dictionary(field.type):
+            column = column.cast(field.type.value_type, safe=False).dictionary_encode()
+        else:
+            column = column.cast(field.type, safe=False)
+
+        columns.append(column)
+
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def hive_directory(component_name: str, aggregation: str) -> str:
+    """
+    Get the directory of the parquetize files of an aggregation in the "hive" partitioning.
+    :param component_name: The component name
+    :param aggregation: The aggregation (batch or group, e.g. "1d")
+    :return: The directory
+    """
+    return f"{HIVE_DIRECTORY}/component={component_name}/aggregation={aggregation}"
@@ -0,0 +1,257 @@
+import concurrent.futures
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Table
+
+from src.data.retrieve import (
+    Cursor,
+    Data,
+    retrieve_between_datetime,
+    retrieve_page_between_datetime,
+)
+
+# Each materialised trajectory row covers the period (date - TRAJECTORY_PERIOD, date].
+# It must match the SOURCE_RANGE of the trajectory harvesters ("1h").
+TRAJECTORY_PERIOD = timedelta(hours=1)
+
+TRAJECTORY_DATE_COLUMN = "date"
+
+TRAJECTORY_ROW_GROUP_SIZE = 32_768
+
+# Long windows are returned in pages of at most this period.
+TRAJECTORY_PAGE_PERIOD = timedelta(hours=1)
+
+SNAPSHOT_LIMIT = 2000
+
+# Raw snapshot reads are split in chunks fetched concurrently.
+SNAPSHOT_CHUNK_PERIOD = timedelta(minutes=10)
+SNAPSHOT_CHUNK_WORKERS = 6
+
+
+def geojsons_to_trajectory_frame(
+    datas: List[Data], columns_to_drop: list = None
+) -> pd.DataFrame:
+    """
+    Flatten per-snapshot GeoJSON point collections into a single positions frame.
+    Each feature becomes one row holding its properties, its coordinates (lon/lat)
+    and the date of the snapshot it comes from.
+    :param datas: The snapshots
+    :param columns_to_drop: Properties to discard
+    :return: The positions frame (empty if no snapshot has features)
+    """
+    frames = []
+
+    for item in datas:
+        features = item.data["features"]
+        if not features:
+            continue
+
+        gdf = gpd.GeoDataFrame.from_features(features)
+        frame = pd.DataFrame(gdf.drop(columns="geometry"))
+        frame["lon"] = gdf.geometry.x.values
+        frame["lat"] = gdf.geometry.y.values
+        frame[TRAJECTORY_DATE_COLUMN] = item.date
+        frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame()
+
+    df = pd.concat(frames, ignore_index=True)
+
+    if columns_to_drop:
+        df = df.drop(columns=columns_to_drop, errors="ignore")
+
+    return df
+
+
+def trajectory_frame_to_parquet(df: pd.DataFrame, id_column: str) -> bytes:
+    """
+    Encode a positions frame as Parquet, sorted by date then trajectory id so that
+    row group statistics on the date column allow time range pushdown.
+    :param df: The positions frame
+    :param id_column: The trajectory identifier column
+    :return: The Parquet file in bytes
+    """
+    df = df[df[id_column].notna()].sort_values([TRAJECTORY_DATE_COLUMN, id_column])
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    output = BytesIO()
+    pq.write_table(
+        table,
+        output,
+        compression="zstd",
+        use_dictionary=True,
+        row_group_size=TRAJECTORY_ROW_GROUP_SIZE,
+    )
+
+    return output.getvalue()
+
+
+def read_trajectory_page(
+    trajectory_table: Optional[Table],
+    snapshot_table: Table,
+    start_date: datetime,
+    end_date: datetime,
+    columns_to_drop: list = None,
+    cursor: Cursor = None,
+) -> Tuple[pd.DataFrame, Optional[Cursor]]:
+    """
+    Read one page of positions between two dates. A page covers at most
+    TRAJECTORY_PAGE_PERIOD of the window, starting at the cursor if one is given.
+    Periods materialised in the trajectory table are read from Parquet with a
+    pushed-down date filter, the remaining (not yet materialised) parts of the page
+    fall back to the raw snapshots.
+    :param trajectory_table: The materialised trajectory table, if any
+    :param snapshot_table: The per-snapshot GeoJSON table
+    :param start_date: The start of the window (excluded)
+    :param end_date: The end of the window (included)
+    :param columns_to_drop: Properties to discard
+    :param cursor: Where the previous page stopped
+    :return: The positions frame and the cursor of the next page (None on the last page)
+    """
+    cursor_id = None
+
+    if cursor is not None:
+        start_date = max(start_date, cursor.date)
+        cursor_id = cursor.id
+
+    page_end = min(end_date, start_date + TRAJECTORY_PAGE_PERIOD)
+
+    materialised = []
+
+    if trajectory_table is not None:
+        materialised = (
+            retrieve_between_datetime(
+                trajectory_table,
+                start_date,
+                page_end + TRAJECTORY_PERIOD,
+                limit=SNAPSHOT_LIMIT,
+            )
+            or []
+        )
+
+    frames = []
+    position = start_date
+    next_cursor = None
+
+    for item in materialised:
+        period_start = item.date - TRAJECTORY_PERIOD
+        period_end = min(item.date, page_end)
+
+        if period_start > position:
+            frame, next_cursor = _read_snapshots(
+                snapshot_table, position, period_start, columns_to_drop, cursor_id
+            )
+            frames.append(frame)
+            if next_cursor is not None:
+                break
+
+        frames.append(
+            pq.read_table(
+                pa.BufferReader(item.buffer),
+                filters=[
+                    (TRAJECTORY_DATE_COLUMN, ">", max(position, period_start)),
+                    (TRAJECTORY_DATE_COLUMN, "<=", period_end),
+                ],
+            ).to_pandas()
+        )
+
+        position = max(position, period_end)
+        cursor_id = None
+
+    if next_cursor is None and position < page_end:
+        frame, next_cursor = _read_snapshots(
+            snapshot_table, position, page_end, columns_to_drop, cursor_id
+        )
+        frames.append(frame)
+
+    if next_cursor is None and page_end < end_date:
+        next_cursor = Cursor(date=page_end)
+
+    frames = [frame for frame in frames if not frame.empty]
+
+    if not frames:
+        return pd.DataFrame(), next_cursor
+
+    df = pd.concat(frames, ignore_index=True)
+
+    if columns_to_drop:
+        df = df.drop(columns=columns_to_drop, errors="ignore")
+
+    return df, next_cursor
+
+
+def _read_snapshots(
+    snapshot_table: Table,
+    start_date: datetime,
+    end_date: datetime,
+    columns_to_drop: list = None,
+    after_id: Optional[int] = None,
+) -> Tuple[pd.DataFrame, Optional[Cursor]]:
+    """
+    Read the raw snapshots between two dates. The range is split in chunks of
+    SNAPSHOT_CHUNK_PERIOD which are fetched and parsed concurrently. If a chunk
+    reaches SNAPSHOT_LIMIT, the read stops at its last snapshot and a cursor
+    pointing there is returned instead of silently truncating the result.
+    """
+    chunks = []
+    chunk_start = start_date
+
+    while chunk_start < end_date:
+        chunk_end = min(end_date, chunk_start + SNAPSHOT_CHUNK_PERIOD)
+        chunks.append((chunk_start, chunk_end, after_id if not chunks else None))
+        chunk_start = chunk_end
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=SNAPSHOT_CHUNK_WORKERS
+    ) as executor:
+        futures = [
+            executor.submit(
+                _read_snapshot_chunk, snapshot_table, *chunk, columns_to_drop
+            )
+            for chunk in chunks
+        ]
+
+        frames = []
+
+        for future in futures:
+            frame, last = future.result()
+            frames.append(frame)
+
+            if last is not None:
+                for remaining in futures:
+                    remaining.cancel()
+                return _concat(frames), Cursor(date=last.date, id=last.id)
+
+    return _concat(frames), None
+
+
+def _read_snapshot_chunk(
+    snapshot_table: Table,
+    start_date: datetime,
+    end_date: datetime,
+    after_id: Optional[int],
+    columns_to_drop: list = None,
+) -> Tuple[pd.DataFrame, Optional[Data]]:
+    datas = retrieve_page_between_datetime(
+        snapshot_table, start_date, end_date, SNAPSHOT_LIMIT, after_id=after_id
+    )
+
+    if not datas:
+        return pd.DataFrame(), None
+
+    last = datas[-1] if len(datas) == SNAPSHOT_LIMIT else None
+
+    return geojsons_to_trajectory_frame(datas, columns_to_drop), last
+
+
+def _concat(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    frames = [frame for frame in frames if not frame.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# The database and the storage are configured from the environment on first use, so
+# they are pointed to a temporary directory before anything from src is imported.
+# DATABASE_URL can be set to run the tests on PostgreSQL instead of SQLite.
+TEST_DIRECTORY = tempfile.mkdtemp(prefix="components-tests-")
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{TEST_DIRECTORY}/db.sqlite3")
+os.environ.pop("AZURE_STORAGE_CONNECTION_STRING", None)
+os.environ.pop("STORAGE_CACHE_DIRECTORY", None)
+os.environ["FILE_STORAGE_DIRECTORY"] = os.path.join(TEST_DIRECTORY, "files")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.configuration.model import (  # noqa: E402
+    ComponentConfiguration,
+    ComponentsConfiguration,
+)
+from src.data.engine import engine  # noqa: E402
+from src.data.sync_db import sync_db_from_configuration  # noqa: E402
+
+
+@pytest.fixture
+def postgres():
+    """Skip a test unless it runs on PostgreSQL (DATABASE_URL)."""
+    if engine.dialect.name != "postgresql":
+        pytest.skip("Requires a PostgreSQL DATABASE_URL")
+
+
+@pytest.fixture
+def make_component():
+    """
+    Build the configuration of a component, named uniquely so that every test has
+    its own tables. A component without source is a collector, a harvester otherwise.
+    """
+
+    def make(component=None, source=None, **kwargs) -> ComponentConfiguration:
+        kwargs.setdefault("data_type", "json")
+        kwargs.setdefault("data_format", "json")
+        kwargs.setdefault("schedule", None)
+        kwargs.setdefault("source_range", None)
+        kwargs.setdefault("dependencies", [])
+        kwargs.setdefault("dependencies_limit", [])
+
+        return ComponentConfiguration(
+            name=f"test_{uuid.uuid4().hex[:12]}",
+            component=component,
+            source=source,
+            **kwargs,
+        )
+
+    return make
+
+
+@pytest.fixture
+def sync_components():
+    """Create the tables and the states of components, as the runners do on start."""
+
+    def sync(*components: ComponentConfiguration):
+        # A pooled SQLite connection can reflect the schema it last read (PRAGMA), missing
+        # the indexes created since by another one, so the reflection gets a new one
+        engine.dispose()
+
+        return sync_db_from_configuration(
+            ComponentsConfiguration(
+                handlers={},
+                harvesters={c.name: c for c in components if c.source is not None},
+                collectors={c.name: c for c in components if c.source is None},
+                parquetize={c.name: c for c in components if c.parquetize is not None},
+                retention={c.name: c for c in components if c.retention is not None},
+            )
+        )
+
+    return sync
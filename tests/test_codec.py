@@ -0,0 +1,144 @@
+import json
+import threading
+import uuid
+
+import pytest
+import zstandard
+
+import src.data.codec as codec
+from src.data.codec import (
+    ZSTD_DICTIONARY_DIRECTORY,
+    _CachedDictionaries,
+    decode_blob,
+    encode_blob,
+    split_data_type,
+)
+from src.data.storage import storage_manager
+
+
+def snapshot(i: int) -> bytes:
+    return json.dumps(
+        [{"lineId": str(line), "distance": i * line, "status": "running"} for line in range(20)]
+    ).encode()
+
+
+@pytest.fixture
+def component_name(monkeypatch):
+    monkeypatch.setattr(codec, "ZSTD_DICTIONARY_SAMPLES", 10)
+    return f"test_{uuid.uuid4().hex[:12]}"
+
+
+def test_split_data_type():
+    assert split_data_type("json+zstd") == ("json", "zstd")
+    assert split_data_type("json") == ("json", None)
+    assert split_data_type(None) == (None, None)
+
+
+def test_gzip_round_trip(component_name):
+    data = snapshot(1)
+
+    assert decode_blob(encode_blob(component_name, data, "gzip"), "json+gzip") == data
+
+
+def test_unknown_codec(component_name):
+    with pytest.raises(ValueError):
+        encode_blob(component_name, b"data", "lz4")
+    with pytest.raises(ValueError):
+        decode_blob(b"data", "json+lz4")
+
+
+def test_zstd_uses_the_dictionary_once_trained(component_name):
+    blobs = [(snapshot(i), encode_blob(component_name, snapshot(i), "zstd")) for i in range(12)]
+
+    # Trained on the 10th blob, which is the first compressed with it
+    dictionary_ids = [zstandard.get_frame_parameters(blob).dict_id for _, blob in blobs]
+    assert dictionary_ids[:9] == [0] * 9
+    assert dictionary_ids[9] != 0 and dictionary_ids[9:] == [dictionary_ids[9]] * 3
+
+    # Decompressed by another process, reading the dictionary from the storage
+    _CachedDictionaries.dictionaries.pop(dictionary_ids[9])
+    for data, blob in blobs:
+        assert decode_blob(blob, "json+zstd") == data
+
+
+def test_zstd_training_is_retried_on_the_next_samples(component_name, monkeypatch):
+    train = zstandard.train_dictionary
+    calls = []
+
+    def train_once(*args, **kwargs):
+        calls.append(len(args[1]))
+        if len(calls) == 1:
+            raise zstandard.ZstdError("not enough samples")
+        return train(*args, **kwargs)
+
+    monkeypatch.setattr(codec.zstandard, "train_dictionary", train_once)
+
+    blobs = [encode_blob(component_name, snapshot(i), "zstd") for i in range(21)]
+
+    assert calls == [10, 20]
+    assert zstandard.get_frame_parameters(blobs[18]).dict_id == 0
+    assert zstandard.get_frame_parameters(blobs[19]).dict_id != 0
+
+
+def test_zstd_dictionary_ids_are_not_reused(component_name, monkeypatch):
+    used = storage_manager.write(f"{ZSTD_DICTIONARY_DIRECTORY}/{40000}", b"dictionary")
+    draws = iter([40000 - 32768, 40001 - 32768])
+    monkeypatch.setattr(codec.secrets, "randbelow", lambda _: next(draws))
+
+    blobs = [encode_blob(component_name, snapshot(i), "zstd") for i in range(10)]
+
+    assert zstandard.get_frame_parameters(blobs[9]).dict_id == 40001
+    assert storage_manager.read(used) == b"dictionary"
+
+
+def train(dictionary_id: int) -> zstandard.ZstdCompressionDict:
+    return zstandard.train_dictionary(
+        4096, [snapshot(i) for i in range(10)], dict_id=dictionary_id, level=3
+    )
+
+
+def test_zstd_dictionary_stored_meanwhile_is_used(component_name):
+    blobs = [encode_blob(component_name, snapshot(i), "zstd") for i in range(9)]
+
+    # Trained and stored by another process writing the component
+    stored = train(50000)
+    storage_manager.write(f"{ZSTD_DICTIONARY_DIRECTORY}/50000", stored.as_bytes())
+    storage_manager.write(f"{ZSTD_DICTIONARY_DIRECTORY}/{component_name}", stored.as_bytes())
+
+    blobs.append(encode_blob(component_name, snapshot(9), "zstd"))
+
+    assert zstandard.get_frame_parameters(blobs[-1]).dict_id == 50000
+    assert decode_blob(blobs[-1], "json+zstd") == snapshot(9)
+
+
+def test_zstd_training_does_not_block_decoding(component_name, monkeypatch):
+    other = train(60000)
+    storage_manager.write(f"{ZSTD_DICTIONARY_DIRECTORY}/60000", other.as_bytes())
+    blob = zstandard.ZstdCompressor(dict_data=other).compress(snapshot(1))
+
+    training = threading.Event()
+    decoded = threading.Event()
+    train_dictionary = zstandard.train_dictionary
+
+    def slow_train(*args, **kwargs):
+        training.set()
+        decoded.wait(5)
+        return train_dictionary(*args, **kwargs)
+
+    monkeypatch.setattr(codec.zstandard, "train_dictionary", slow_train)
+
+    writer = threading.Thread(
+        target=lambda: [encode_blob(component_name, snapshot(i), "zstd") for i in range(10)]
+    )
+    writer.start()
+    assert training.wait(5)
+
+    results = []
+    reader = threading.Thread(target=lambda: results.append(decode_blob(blob, "json+zstd")))
+    reader.start()
+    reader.join(2)
+    finished = not reader.is_alive()
+
+    decoded.set()
+    writer.join()
+    assert finished and results == [snapshot(1)]
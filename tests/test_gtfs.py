@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import pytest
+from google.transit import gtfs_realtime_pb2
+
+from src.utilities.gtfs import IntervalIndex, load_gtfs_realtime_from_bytes_to_df
+
+
+@pytest.fixture
+def intervals():
+    random = np.random.default_rng(0)
+    starts = random.integers(0, 1000, 500)
+    ends = starts + random.integers(0, 120, 500)
+    return starts, ends
+
+
+def test_active_at_matches_a_scan(intervals):
+    starts, ends = intervals
+    index = IntervalIndex(starts, ends)
+
+    for time in [-1, 0, 5, 250, 999, 1060, 1200]:
+        expected = np.flatnonzero((starts < time) & (time < ends))
+        assert np.array_equal(index.active_at(time), expected)
+
+
+def test_overlapping_matches_a_scan(intervals):
+    starts, ends = intervals
+    index = IntervalIndex(starts, ends)
+
+    for start, end in [(-10, -1), (0, 0), (100, 160), (500, 500), (990, 1500), (2000, 3000)]:
+        expected = np.flatnonzero((start <= ends) & (starts <= end))
+        assert np.array_equal(index.overlapping(start, end), expected)
+
+
+def test_bounds():
+    index = IntervalIndex([10, 20], [20, 30])
+
+    # An interval is active strictly inside its bounds, but overlaps a window on them
+    assert index.active_at(20).tolist() == []
+    assert index.active_at(15).tolist() == [0]
+    assert index.overlapping(20, 20).tolist() == [0, 1]
+    assert index.overlapping(31, 40).tolist() == []
+
+
+def test_empty_index():
+    index = IntervalIndex([], [])
+
+    assert index.active_at(10).tolist() == []
+    assert index.overlapping(0, 10).tolist() == []
+
+
+def load_next_stops_row_wise(gtfs_realtime_bytes: bytes) -> pd.DataFrame:
+    """The row-wise decoder the columnar one replaced, one dict per trip."""
+    rt_feed = gtfs_realtime_pb2.FeedMessage()
+    rt_feed.ParseFromString(gtfs_realtime_bytes)
+
+    trip_updates = []
+
+    for entity in rt_feed.entity:
+        if entity.HasField("trip_update"):
+            trip_update = entity.trip_update
+            next_stops = [a for a in trip_update.stop_time_update if a.arrival.time != 0]
+            if len(next_stops) == 0:
+                continue
+
+            trip_updates.append(
+                {
+                    "trip_id": trip_update.trip.trip_id,
+                    "start_time": trip_update.trip.start_time,
+                    "start_date": trip_update.trip.start_date,
+                    "stop_id": next_stops[0].stop_id,
+                    "arrival_delay": next_stops[0].arrival.delay,
+                    "arrival_time": next_stops[0].arrival.time,
+                }
+            )
+
+    return pd.DataFrame(trip_updates)
+
+
+@pytest.fixture
+def realtime_feed() -> bytes:
+    random = np.random.default_rng(0)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+
+    for trip in range(50):
+        entity = feed.entity.add(id=str(trip))
+
+        if trip % 10 == 0:
+            entity.vehicle.trip.trip_id = f"vehicle_{trip}"
+            continue
+
+        trip_update = entity.trip_update
+        trip_update.trip.trip_id = f"trip_{trip}"
+        trip_update.trip.start_time = f"{trip % 24:02d}:00:00"
+        trip_update.trip.start_date = "20240501"
+
+        for sequence in range(int(random.integers(0, 6))):
+            stop_time_update = trip_update.stop_time_update.add(
+                stop_id=f"stop_{sequence}", stop_sequence=sequence
+            )
+            # Passed stops (and the trips with no stop left) have no arrival time
+            if trip % 7 != 0 and sequence >= trip % 3:
+                stop_time_update.arrival.time = 1714550400 + 60 * trip + sequence
+                stop_time_update.arrival.delay = int(random.integers(-60, 600))
+
+    return feed.SerializeToString()
+
+
+def test_realtime_next_stops_match_the_row_wise_decoder(realtime_feed):
+    pd.testing.assert_frame_equal(
+        load_gtfs_realtime_from_bytes_to_df(realtime_feed),
+        load_next_stops_row_wise(realtime_feed),
+    )
+
+
+def test_realtime_all_stop_time_updates(realtime_feed):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(realtime_feed)
+    expected = [
+        (
+            entity.trip_update.trip.trip_id,
+            update.stop_id,
+            update.stop_sequence,
+            update.arrival.time,
+        )
+        for entity in feed.entity
+        if entity.HasField("trip_update")
+        for update in entity.trip_update.stop_time_update
+    ]
+
+    df = load_gtfs_realtime_from_bytes_to_df(realtime_feed, all_stop_time_updates=True)
+
+    columns = ["trip_id", "stop_id", "stop_sequence", "arrival_time"]
+    assert list(df[columns].itertuples(index=False, name=None)) == expected
+
+
+def test_realtime_empty_feed_keeps_the_columns():
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+
+    df = load_gtfs_realtime_from_bytes_to_df(feed.SerializeToString())
+
+    assert df.empty
+    assert list(df.columns) == [
+        "trip_id",
+        "start_time",
+        "start_date",
+        "stop_id",
+        "arrival_delay",
+        "arrival_time",
+    ]
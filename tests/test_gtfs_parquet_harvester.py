@@ -0,0 +1,137 @@
+import json
+import zipfile
+from datetime import datetime
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+
+import components.gtfs_parquet_harvester as gtfs_parquet_harvester
+from components.gtfs_parquet_harvester import MANIFEST_NAME, GTFSParquetHarvester
+from src.data.retrieve import retrieve_between_datetime, retrieve_latest_row
+from src.data.write import write_result
+from src.runners.run_harvester import run_harvester
+
+GTFS_FILES = {
+    "agency.txt": "agency_id,agency_name,agency_url,agency_timezone\n"
+    "A,Agency,http://example.com,Europe/Brussels\n",
+    "stops.txt": "stop_id,stop_name,stop_lat,stop_lon\nS1,One,50.8,4.3\nS2,Two,50.9,4.4\n",
+    "routes.txt": "route_id,agency_id,route_short_name,route_type\nR1,A,1,3\n",
+    "calendar.txt": "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,"
+    "start_date,end_date\nSV,1,1,1,1,1,1,1,20240101,20301231\n",
+    "trips.txt": "route_id,service_id,trip_id\nR1,SV,T1\n",
+    "stop_times.txt": "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+    "T1,08:00:00,08:00:00,S1,1\nT1,08:10:00,08:10:00,S2,2\n",
+}
+
+
+def gtfs_zip(**changes) -> bytes:
+    output = BytesIO()
+
+    with zipfile.ZipFile(output, "w") as archive:
+        for name, content in {**GTFS_FILES, **changes}.items():
+            archive.writestr(name, content)
+
+    return output.getvalue()
+
+
+def feed(data: bytes):
+    """A source or previous row, as given to the harvester."""
+    return SimpleNamespace(path=None, data=data)
+
+
+def members(archive: bytes) -> dict:
+    with zipfile.ZipFile(BytesIO(archive)) as parquet_zip:
+        return {name: parquet_zip.read(name) for name in parquet_zip.namelist()}
+
+
+def gtfs_zip_of(archive_members: dict) -> bytes:
+    output = BytesIO()
+
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as archive:
+        for name, content in archive_members.items():
+            archive.writestr(name, content)
+
+    return output.getvalue()
+
+
+@pytest.fixture
+def converted(monkeypatch):
+    """Record the GTFS files each conversion is given."""
+    calls = []
+    convert = gtfs_parquet_harvester.convert_gtfs_to_parquet
+
+    def record(gtfs, timeout):
+        with zipfile.ZipFile(BytesIO(gtfs) if isinstance(gtfs, bytes) else gtfs) as archive:
+            calls.append(sorted(archive.namelist()))
+        return convert(gtfs, timeout)
+
+    monkeypatch.setattr(gtfs_parquet_harvester, "convert_gtfs_to_parquet", record)
+    return calls
+
+
+def test_first_run_converts_every_file(converted):
+    archive = members(GTFSParquetHarvester().run(feed(gtfs_zip())))
+
+    assert converted == [sorted(GTFS_FILES)]
+    assert set(json.loads(archive[MANIFEST_NAME])) == set(GTFS_FILES)
+    assert {"stops.parquet", "trips.parquet", "stop_times.parquet"} <= archive.keys()
+
+
+def test_unchanged_feed_is_skipped(converted):
+    harvester = GTFSParquetHarvester()
+    previous = harvester.run(feed(gtfs_zip()))
+
+    assert harvester.run(feed(gtfs_zip()), gtfs_parquet=feed(previous)) is None
+    assert len(converted) == 1
+
+
+def test_changed_files_only_are_converted(converted):
+    harvester = GTFSParquetHarvester()
+    previous = members(harvester.run(feed(gtfs_zip())))
+
+    stops = GTFS_FILES["stops.txt"] + "S3,Three,51.0,4.5\n"
+    archive = members(
+        harvester.run(
+            feed(gtfs_zip(**{"stops.txt": stops})),
+            gtfs_parquet=feed(gtfs_zip_of(previous)),
+        )
+    )
+
+    assert converted[-1] == ["stops.txt"]
+    assert archive.keys() == previous.keys()
+    assert archive["stops.parquet"] != previous["stops.parquet"]
+    for name in previous.keys() - {"stops.parquet", MANIFEST_NAME}:
+        assert archive[name] == previous[name]
+
+    manifest, previous_manifest = json.loads(archive[MANIFEST_NAME]), json.loads(
+        previous[MANIFEST_NAME]
+    )
+    assert manifest["stops.txt"] != previous_manifest["stops.txt"]
+    assert {k: v for k, v in manifest.items() if k != "stops.txt"} == {
+        k: v for k, v in previous_manifest.items() if k != "stops.txt"
+    }
+
+
+def test_unchanged_feed_keeps_the_previous_archive(make_component, sync_components):
+    collector = make_component(data_type="binary")
+    harvester = make_component(GTFSParquetHarvester, source=collector, data_type="binary")
+    harvester.optional_dependencies = [harvester]
+    tables = sync_components(collector, harvester)
+
+    write_result(collector, tables[collector.name], gtfs_zip(), datetime(2024, 5, 1))
+    assert run_harvester(harvester, tables)
+    archive = retrieve_latest_row(tables[harvester.name])
+
+    write_result(collector, tables[collector.name], gtfs_zip(), datetime(2024, 5, 2))
+    assert run_harvester(harvester, tables)
+    assert not run_harvester(harvester, tables)
+
+    # The unchanged feed is stored as a null row, the archive stays the latest with data
+    rows = retrieve_between_datetime(tables[harvester.name], datetime(2024, 1, 1), None, 10)
+    assert [row.date for row in rows] == [datetime(2024, 5, 1)]
+    assert retrieve_latest_row(tables[harvester.name]) == archive
+    assert retrieve_latest_row(tables[harvester.name], with_null=True).date == datetime(
+        2024, 5, 2
+    )
+
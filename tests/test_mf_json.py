@@ -0,0 +1,77 @@
+import importlib
+from datetime import datetime, timedelta
+
+from src.data.retrieve import Cursor
+from src.data.write import write_result
+from src.utilities.mf_json import fetch_geojsons_and_return_mf_json
+
+START = datetime(2024, 5, 1)
+
+
+def snapshot(uuids):
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [4.35, 50.85]},
+                "properties": {"uuid": uuid, "lineId": "1"},
+            }
+            for uuid in uuids
+        ],
+    }
+
+
+def positions(response):
+    return sorted(
+        (feature["properties"]["uuid"], date)
+        for feature in response["features"]
+        for date in feature["temporalGeometry"]["datetimes"]
+    )
+
+
+def test_paginated_positions_match_a_single_page(make_component, sync_components, monkeypatch):
+    collector = make_component()
+    table = sync_components(collector)[collector.name]
+
+    # "b" is seen once on each page of an hour
+    for minute in range(5, 180, 10):
+        uuids = ["a"]
+        if minute in (35, 95):
+            uuids.append("b")
+        write_result(collector, table, snapshot(uuids), START + timedelta(minutes=minute))
+
+    start = int((START - datetime(1970, 1, 1)).total_seconds())
+    end = start + 3 * 3600
+
+    pages = []
+    cursor = None
+
+    while True:
+        page = fetch_geojsons_and_return_mf_json(table, "uuid", start, end, cursor=cursor)
+        pages.append(page)
+        if "next" not in page:
+            break
+        cursor = Cursor.decode(page["next"])
+
+    trajectory = importlib.import_module("src.utilities.trajectory")
+    monkeypatch.setattr(trajectory, "TRAJECTORY_PAGE_PERIOD", timedelta(hours=3))
+    single_page = fetch_geojsons_and_return_mf_json(table, "uuid", start, end)
+
+    assert len(pages) == 3 and "next" not in single_page
+    assert sorted(p for page in pages for p in positions(page)) == positions(single_page)
+    assert {uuid for uuid, _ in positions(single_page)} == {"a", "b"}
+
+
+def test_single_page_drops_vehicles_seen_once(make_component, sync_components):
+    collector = make_component()
+    table = sync_components(collector)[collector.name]
+
+    for minute in range(5, 60, 10):
+        uuids = ["a", "b"] if minute == 35 else ["a"]
+        write_result(collector, table, snapshot(uuids), START + timedelta(minutes=minute))
+
+    start = int((START - datetime(1970, 1, 1)).total_seconds())
+    response = fetch_geojsons_and_return_mf_json(table, "uuid", start, start + 3600)
+
+    assert {uuid for uuid, _ in positions(response)} == {"a"}
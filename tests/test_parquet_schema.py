@@ -0,0 +1,36 @@
+import logging
+
+import pyarrow as pa
+
+from src.utilities.parquet_schema import conform_table
+
+
+def test_conform_table_casts_fills_and_reorders():
+    schema = pa.schema(
+        [
+            pa.field("lineId", pa.dictionary(pa.int32(), pa.string())),
+            pa.field("distance", pa.float64()),
+            pa.field("active", pa.bool_()),
+        ]
+    )
+    table = pa.table({"distance": pa.array([1, 2]), "lineId": pa.array(["a", "b"])})
+
+    conformed = conform_table(table, schema)
+
+    assert conformed.schema == schema
+    assert conformed.to_pydict() == {
+        "lineId": ["a", "b"],
+        "distance": [1.0, 2.0],
+        "active": [None, None],
+    }
+
+
+def test_conform_table_warns_of_undeclared_columns(caplog):
+    schema = pa.schema([pa.field("distance", pa.float64())])
+    table = pa.table({"distance": [1.0], "speed": [3]})
+
+    with caplog.at_level(logging.WARNING):
+        conformed = conform_table(table, schema)
+
+    assert conformed.column_names == ["distance"]
+    assert "['speed']" in caplog.text
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from src.configuration.model import ComponentRetentionConfig
+from src.data.engine import engine
+from src.data.partition import (
+    ensure_partition,
+    is_partitioned,
+    list_partitions,
+    month_start,
+    next_month_start,
+    partition_name,
+)
+from src.data.retrieve import retrieve_between_datetime
+from src.data.state import retrieve_component_state
+from src.data.write import write_result
+from src.runners.run_retention import run_retention
+
+
+def test_month_bounds():
+    assert month_start(datetime(2024, 5, 17, 13, 2, 1, 5)) == datetime(2024, 5, 1)
+    assert next_month_start(datetime(2024, 5, 17, 13)) == datetime(2024, 6, 1)
+    assert next_month_start(datetime(2024, 12, 31, 23, 59)) == datetime(2025, 1, 1)
+    assert partition_name("stib_vehicle_distance", datetime(2024, 5, 17)) == (
+        "stib_vehicle_distance_p202405"
+    )
+
+
+def test_partitioning_is_only_used_on_postgres(make_component, sync_components):
+    collector = make_component(table_partitioning="month")
+    table = sync_components(collector)[collector.name]
+
+    write_result(collector, table, [1], datetime(2024, 5, 1))
+
+    assert is_partitioned(table) == (engine.dialect.name == "postgresql")
+    assert len(retrieve_between_datetime(table, datetime(2024, 1, 1), None, 10)) == 1
+
+
+def test_partitions_are_created_on_write(postgres, make_component, sync_components):
+    collector = make_component(table_partitioning="month")
+    table = sync_components(collector)[collector.name]
+    ahead = [start for _, start, _ in list_partitions(table)]
+
+    for date in [datetime(2024, 3, 31, 23, 59), datetime(2024, 5, 1), datetime(2024, 5, 20)]:
+        write_result(collector, table, [1], date)
+
+    # Writing again in a month with a partition costs nothing
+    ensure_partition(table, datetime(2024, 5, 2))
+
+    partitions = list_partitions(table)
+    assert is_partitioned(table)
+    assert [start for _, start, _ in partitions] == sorted(
+        [datetime(2024, 3, 1), datetime(2024, 5, 1)] + ahead
+    )
+    assert partitions[0] == (
+        partition_name(table.name, datetime(2024, 3, 1)),
+        datetime(2024, 3, 1),
+        datetime(2024, 4, 1),
+    )
+
+
+def test_retention_drops_released_partitions(postgres, make_component, sync_components):
+    collector = make_component(
+        table_partitioning="month", retention=ComponentRetentionConfig(keep="7d")
+    )
+    table = sync_components(collector)[collector.name]
+
+    dates = [datetime(2024, 3, 10) + timedelta(days=10 * i) for i in range(8)]
+    for date in dates:
+        write_result(collector, table, [1], date)
+
+    assert run_retention(collector, {}, {collector.name: table}) == len(dates)
+
+    # Every partition was released, but the one of the latest row is kept
+    starts = [start for _, start, _ in list_partitions(table)]
+    assert datetime(2024, 3, 1) not in starts and datetime(2024, 4, 1) not in starts
+    assert datetime(2024, 5, 1) in starts
+    assert retrieve_between_datetime(table, datetime(2024, 1, 1), None, 10) == []
+    assert retrieve_component_state(collector.name).last_date == dates[-1]
+
+
+def test_write_recreates_a_partition_dropped_by_another_process(
+    postgres, make_component, sync_components
+):
+    collector = make_component(table_partitioning="month")
+    table = sync_components(collector)[collector.name]
+    write_result(collector, table, [1], datetime(2024, 5, 1))
+
+    # Dropped by the retention of another process, still cached by this one
+    name = partition_name(table.name, datetime(2024, 5, 1))
+    with engine.connect() as connection:
+        connection.execute(text(f'ALTER TABLE "{table.name}" DETACH PARTITION "{name}"'))
+        connection.execute(text(f'DROP TABLE "{name}"'))
+        connection.commit()
+
+    write_result(collector, table, [2], datetime(2024, 5, 20))
+
+    assert name in [partition for partition, _, _ in list_partitions(table)]
+    rows = retrieve_between_datetime(table, datetime(2024, 4, 1), None, 10)
+    assert [row.date for row in rows] == [datetime(2024, 5, 20)]
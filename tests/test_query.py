@@ -0,0 +1,205 @@
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pytest
+
+import src.data.query as query
+from components.parquetize_query_handler import ParquetizeQueryHandler
+from src.components import InvalidQuery
+from src.configuration.model import (
+    ComponentParquetizeConfig,
+    ComponentParquetizeGroupConfig,
+)
+from src.data.engine import engine
+from src.data.query import (
+    _is_covered,
+    parquetize_dataset,
+    query_parquetize,
+    select_parquetize_files,
+)
+from src.data.write import write_result
+from src.runners.run_parquetize import run_parquetize
+
+SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"lineId": {"type": "string"}, "distance": {"type": "integer"}},
+    },
+}
+
+D = datetime
+
+
+def test_is_covered():
+    covered = [(D(2024, 5, 1, 2), D(2024, 5, 1, 3)), (D(2024, 5, 1, 0), D(2024, 5, 1, 2))]
+
+    assert _is_covered(covered, D(2024, 5, 1, 0), D(2024, 5, 1, 3))
+    assert _is_covered(covered, D(2024, 5, 1, 1), D(2024, 5, 1, 2))
+    assert not _is_covered(covered, D(2024, 5, 1, 2), D(2024, 5, 1, 4))
+    assert not _is_covered([], D(2024, 5, 1, 0), D(2024, 5, 1, 1))
+    assert not _is_covered(
+        [(D(2024, 5, 1, 0), D(2024, 5, 1, 1)), (D(2024, 5, 1, 2), D(2024, 5, 1, 3))],
+        D(2024, 5, 1, 0),
+        D(2024, 5, 1, 3),
+    )
+
+
+@pytest.fixture
+def parquetize_table(make_component, sync_components):
+    component = make_component(
+        parquetize=ComponentParquetizeConfig(
+            batch="1h",
+            groups=[
+                ComponentParquetizeGroupConfig(group="1d"),
+                ComponentParquetizeGroupConfig(group="7d", keys=["lineId"]),
+            ],
+            schema=SCHEMA,
+        )
+    )
+    table = sync_components(component)[component.parquetize_name]
+
+    def insert(aggregation, start, period, keys=None):
+        with engine.connect() as connection:
+            connection.execute(
+                table.insert().values(
+                    start_date=start,
+                    end_date=start + period,
+                    data=f"{aggregation}/{start.isoformat()}/{keys}",
+                    count=0,
+                    skipped=0,
+                    original_size=0,
+                    compressed_size=0,
+                    schema=SCHEMA,
+                    aggregation=aggregation,
+                    keys=keys,
+                )
+            )
+            connection.commit()
+
+    # 1h batches of the 2nd, merged in a 1d file for the 1st, keyed 7d files before
+    for line in ["1", "2"]:
+        insert("7d", D(2024, 4, 24), timedelta(days=7), {"lineId": line})
+    insert("1d", D(2024, 5, 1), timedelta(days=1))
+    for hour in range(3):
+        insert("1h", D(2024, 5, 2, hour), timedelta(hours=1))
+
+    return table
+
+
+def test_select_prefers_coarser_files(parquetize_table):
+    files = select_parquetize_files(parquetize_table, D(2024, 5, 1, 12), D(2024, 5, 2, 1, 30))
+
+    assert [url for *_, url in files] == [
+        "1d/2024-05-01T00:00:00/None",
+        "1h/2024-05-02T00:00:00/None",
+        "1h/2024-05-02T01:00:00/None",
+    ]
+
+
+def test_select_keyed_files_only_with_their_filters(parquetize_table):
+    start, end = D(2024, 4, 26), D(2024, 5, 1, 6)
+
+    assert [url for *_, url in select_parquetize_files(parquetize_table, start, end)] == [
+        "1d/2024-05-01T00:00:00/None"
+    ]
+    assert [
+        url
+        for *_, url in select_parquetize_files(
+            parquetize_table, start, end, {"lineId": ["2"]}
+        )
+    ] == [
+        "7d/2024-04-24T00:00:00/{'lineId': '2'}",
+        "1d/2024-05-01T00:00:00/None",
+    ]
+
+
+@pytest.fixture
+def parquetized(make_component, sync_components):
+    component = make_component(
+        parquetize=ComponentParquetizeConfig(batch="1h", groups=[], schema=SCHEMA)
+    )
+    tables = sync_components(component)
+
+    for minute in range(0, 150, 10):
+        write_result(
+            component,
+            tables[component.name],
+            [{"lineId": str(minute % 3), "distance": minute}],
+            D(2024, 5, 1) + timedelta(minutes=minute),
+        )
+
+    run_parquetize(component, tables)
+
+    return component, tables[component.parquetize_name]
+
+
+def test_query_filters_and_projects(parquetized):
+    _, table = parquetized
+
+    result = query_parquetize(
+        table, D(2024, 5, 1), D(2024, 5, 1, 1, 30), ["distance"], {"lineId": [1]}
+    )
+
+    assert result.to_pydict() == {"distance": [10, 40, 70]}
+
+
+@pytest.mark.parametrize(
+    "columns, filters",
+    [
+        (["speed"], None),
+        (None, {"speed": [1]}),
+        (None, {"distance": ["far"]}),
+        (None, {"distance": [1, "a"]}),
+    ],
+)
+def test_query_rejects_invalid_columns_and_values(parquetized, columns, filters):
+    _, table = parquetized
+
+    with pytest.raises(ValueError):
+        query_parquetize(table, D(2024, 5, 1), D(2024, 5, 2), columns, filters)
+
+
+def test_handler_answers_invalid_queries_with_a_400(parquetized):
+    _, table = parquetized
+
+    class Handler(ParquetizeQueryHandler):
+        TABLE = table.name
+
+    handler = Handler({table.name: table})
+    start = int((D(2024, 5, 1) - D(1970, 1, 1)).total_seconds())
+
+    assert isinstance(pa.ipc.open_stream(handler.run(start, start + 3600)).read_all(), pa.Table)
+    with pytest.raises(InvalidQuery):
+        handler.run(start, start + 3600, columns="speed")
+    with pytest.raises(InvalidQuery):
+        handler.run(start, start + 3600, filters=["1"])
+
+
+@pytest.mark.parametrize(
+    "parameters",
+    [
+        dict(),
+        dict(start_timestamp=1714521600),
+        dict(end_timestamp=1714525200),
+        dict(start_timestamp=1714525200, end_timestamp=1714521600),
+        dict(start_timestamp=1714521600, end_timestamp=1714521600),
+    ],
+)
+def test_handler_answers_missing_or_reversed_timestamps_with_a_400(parquetized, parameters):
+    _, table = parquetized
+
+    class Handler(ParquetizeQueryHandler):
+        TABLE = table.name
+
+    with pytest.raises(InvalidQuery):
+        Handler({table.name: table}).run(**parameters)
+
+
+def test_dataset_requires_a_root_on_non_local_storage(parquetized, monkeypatch):
+    component, _ = parquetized
+
+    monkeypatch.setattr(query, "storage_manager", object())
+
+    with pytest.raises(ValueError):
+        parquetize_dataset(component, "1h")
@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.components import Harvester
+from src.data.retrieve import retrieve_between_datetime
+from src.data.write import write_result
+from src.data.state import retrieve_component_state
+from src.runners.run_harvester import run_harvester, source_range_to_period_and_limit
+
+
+class EchoHarvester(Harvester):
+    """Return the dates of the source rows it is given."""
+
+    def run(self, source, **kwargs):
+        source = source if isinstance(source, list) else [source]
+        return [row.date.isoformat() for row in source]
+
+
+class IdHarvester(Harvester):
+    """Record the ids of the source rows it is given."""
+
+    ids = []
+
+    def run(self, source, **kwargs):
+        source = source if isinstance(source, list) else [source]
+        self.ids.extend(row.id for row in source)
+        return [row.id for row in source]
+
+
+def harvest_all(harvester, tables):
+    """Run a harvester until it has nothing left to harvest, return its results."""
+    while run_harvester(harvester, tables):
+        pass
+
+    return retrieve_between_datetime(
+        tables[harvester.name], datetime(2000, 1, 1), None, 1000
+    )
+
+
+@pytest.mark.parametrize("source_cursor", ["date", "id"])
+def test_period_includes_rows_on_its_end_boundary(
+    make_component, sync_components, source_cursor
+):
+    collector = make_component()
+    harvester = make_component(
+        EchoHarvester, source=collector, source_range="1h", source_cursor=source_cursor
+    )
+    tables = sync_components(collector, harvester)
+
+    dates = [
+        datetime(2024, 5, 1, 10),
+        datetime(2024, 5, 1, 10, 20),
+        datetime(2024, 5, 1, 11),
+        datetime(2024, 5, 1, 11, 40),
+        datetime(2024, 5, 1, 12),
+        datetime(2024, 5, 1, 12, 30),
+        datetime(2024, 5, 1, 13),
+    ]
+    for date in dates:
+        write_result(collector, tables[collector.name], [1], date)
+
+    # The period ending at 13:00 is only closed by a later row
+    results = harvest_all(harvester, tables)
+    assert [result.date for result in results] == [
+        datetime(2024, 5, 1, 10),
+        datetime(2024, 5, 1, 11),
+        datetime(2024, 5, 1, 12),
+    ]
+
+    write_result(collector, tables[collector.name], [1], datetime(2024, 5, 1, 13, 5))
+
+    results = harvest_all(harvester, tables)
+    harvested = [datetime.fromisoformat(date) for result in results for date in result.data]
+
+    # Every row is harvested once, a row on a boundary by the period it ends
+    assert harvested == dates
+    assert [result.date for result in results] == [
+        datetime(2024, 5, 1, 10),
+        datetime(2024, 5, 1, 11),
+        datetime(2024, 5, 1, 12),
+        datetime(2024, 5, 1, 13),
+    ]
+    for result in results:
+        assert all(
+            result.date - timedelta(hours=1) < date <= result.date
+            for date in map(datetime.fromisoformat, result.data)
+        )
+
+
+D = datetime(2024, 5, 15, 10, 25, 30, 500)
+
+
+@pytest.mark.parametrize(
+    "source_range, period",
+    [
+        (None, (D, None, 1)),
+        ("100", (D, None, 100)),
+        (5, (D, None, 5)),
+        ("3d", (datetime(2024, 5, 15), datetime(2024, 5, 18), None)),
+        ("6h", (datetime(2024, 5, 15, 6), datetime(2024, 5, 15, 12), None)),
+        ("15m", (datetime(2024, 5, 15, 10, 15), datetime(2024, 5, 15, 10, 30), None)),
+        ("20s", (datetime(2024, 5, 15, 10, 25, 20), datetime(2024, 5, 15, 10, 25, 40), None)),
+    ],
+)
+def test_source_range_to_period_and_limit(source_range, period):
+    assert source_range_to_period_and_limit(D, source_range) == period
+
+
+def test_period_is_closed_by_a_later_source_row(make_component, sync_components):
+    collector = make_component()
+    harvester = make_component(EchoHarvester, source=collector, source_range="1h")
+    tables = sync_components(collector, harvester)
+
+    write_result(collector, tables[collector.name], [1], datetime(2024, 5, 1, 10, 10))
+    write_result(collector, tables[collector.name], [1], datetime(2024, 5, 1, 11))
+
+    # A row on the end of the period does not close it, more rows may share its date
+    assert not run_harvester(harvester, tables)
+
+    write_result(collector, tables[collector.name], [1], datetime(2024, 5, 1, 13, 30))
+
+    # The period without source rows is still harvested, to move on to the next one
+    results = harvest_all(harvester, tables)
+    assert [(result.date, result.data) for result in results] == [
+        (datetime(2024, 5, 1, 11), ["2024-05-01T10:10:00", "2024-05-01T11:00:00"]),
+        (datetime(2024, 5, 1, 12), []),
+        (datetime(2024, 5, 1, 13), []),
+    ]
+    assert not run_harvester(harvester, tables)
+
+
+def test_id_cursor_reads_rows_sharing_a_date_once(make_component, sync_components):
+    collector = make_component()
+    harvester = make_component(
+        IdHarvester, source=collector, source_range="2", source_cursor="id"
+    )
+    tables = sync_components(collector, harvester)
+
+    for minute in [0, 0, 0, 1, 1, 2, 2, 2]:
+        write_result(
+            collector, tables[collector.name], [1], datetime(2024, 5, 1, 10, minute)
+        )
+
+    source = retrieve_between_datetime(
+        tables[collector.name], datetime(2000, 1, 1), None, 1000
+    )
+    # Results sharing a date share a blob, so the ids are recorded by the harvester
+    IdHarvester.ids.clear()
+    harvest_all(harvester, tables)
+
+    assert IdHarvester.ids == [row.id for row in source]
+    assert retrieve_component_state(harvester.name).source_id == source[-1].id
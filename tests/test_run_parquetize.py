@@ -0,0 +1,277 @@
+import importlib
+import itertools
+import logging
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from jsonschema.validators import validator_for
+
+from src.configuration.model import (
+    ComponentParquetizeConfig,
+    ComponentParquetizeGroupConfig,
+)
+from src.data.engine import engine
+from src.data.query import parquetize_dataset
+from src.data.write import write_result
+from src.runners.run_parquetize import (
+    _compile_schema,
+    _partition_table,
+    _snapshots_to_table,
+    run_parquetize,
+)
+from src.utilities.parquet_schema import parquetize_arrow_schema
+
+SCHEMAS = [
+    {"type": "integer"},
+    {"type": ["string", "null"]},
+    {"type": "array", "items": {"type": "number"}},
+    {
+        "type": "object",
+        "properties": {"id": {"type": "string"}, "speed": {"type": "number"}},
+        "required": ["id"],
+    },
+    {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "lineId": {"type": ["string", "integer"]},
+                "distance": {"type": "number"},
+                "active": {"type": "boolean"},
+            },
+        },
+    },
+]
+
+VALUES = [
+    None,
+    True,
+    0,
+    1.0,
+    2.5,
+    "a",
+    [],
+    [1, 2.5],
+    [1, "a"],
+    {},
+    {"id": "a"},
+    {"id": 1},
+    {"id": "a", "speed": 3},
+    {"id": "a", "speed": "fast"},
+    [{"lineId": "1", "distance": 2.0}],
+    [{"lineId": 1, "distance": 2}, {"lineId": "2", "active": False}],
+    [{"lineId": 1.5}],
+    [{"distance": True}],
+    [{"lineId": "1"}, 3],
+]
+
+
+@pytest.mark.parametrize("schema", SCHEMAS)
+def test_compiled_schema_never_accepts_invalid_values(schema):
+    check = _compile_schema(schema)
+    validator = validator_for(schema)(schema)
+
+    assert check is not None
+    for value in VALUES:
+        if check(value):
+            assert validator.is_valid(value), value
+
+
+@pytest.mark.parametrize("schema, value", list(itertools.product(SCHEMAS, VALUES)))
+def test_compiled_schema_matches_jsonschema_on_exact_types(schema, value):
+    # Only an integral float (as an integer) may be rejected while valid
+    if type(value) is float and value.is_integer():
+        return
+
+    assert _compile_schema(schema)(value) == validator_for(schema)(schema).is_valid(value)
+
+
+@pytest.mark.parametrize(
+    "schema",
+    [
+        {"type": "string", "minLength": 1},
+        {"type": "date"},
+        {"type": "array", "items": {"enum": [1, 2]}},
+        {"properties": {"id": {"pattern": "^[a-z]+$"}}},
+        "not a schema",
+    ],
+)
+def test_schema_with_other_keywords_is_not_compiled(schema):
+    assert _compile_schema(schema) is None
+
+
+RECORDS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "lineId": {"type": ["string", "integer"]},
+            "distance": {"type": "number"},
+        },
+    },
+}
+
+
+def test_snapshots_to_table_columns():
+    schema = parquetize_arrow_schema(RECORDS_SCHEMA, ["lineId"])
+    snapshots = [
+        ([{"lineId": 1, "distance": 2.0}, {"lineId": "2"}], datetime(2024, 5, 1, 10)),
+        ([], datetime(2024, 5, 1, 10, 1)),
+        ([{"distance": 3.5}], datetime(2024, 5, 1, 10, 2)),
+    ]
+
+    table = _snapshots_to_table(snapshots, schema)
+
+    assert table.schema == schema
+    assert table.to_pydict() == {
+        "lineId": ["1", "2", None],
+        "distance": [2.0, None, 3.5],
+        "date": [datetime(2024, 5, 1, 10)] * 2 + [datetime(2024, 5, 1, 10, 2)],
+    }
+
+
+def test_snapshots_to_table_warns_of_undeclared_fields(caplog):
+    schema = parquetize_arrow_schema(RECORDS_SCHEMA)
+    snapshots = [([{"lineId": "1", "speed": 3}, {"color": "red"}], datetime(2024, 5, 1))]
+
+    with caplog.at_level(logging.WARNING):
+        table = _snapshots_to_table(snapshots, schema)
+
+    assert table.column_names == ["lineId", "distance", "date"]
+    assert "['color', 'speed']" in caplog.text
+
+
+def test_snapshots_to_table_without_records():
+    schema = parquetize_arrow_schema(RECORDS_SCHEMA)
+
+    assert _snapshots_to_table([([], datetime(2024, 5, 1))], schema) == pa.table(
+        {name: pa.array([], type) for name, type in zip(schema.names, schema.types)}
+    )
+
+
+def test_partition_table_on_one_key():
+    table = pa.table({"lineId": ["b", "a", "b", None, "a"], "n": [0, 1, 2, 3, 4]})
+
+    partitions = [(key, part["n"].to_pylist()) for key, part in _partition_table(table, ["lineId"])]
+
+    # In the order the values first appear, rows keeping their order
+    assert partitions == [(("b",), [0, 2]), (("a",), [1, 4]), ((None,), [3])]
+
+
+def test_partition_table_on_several_keys():
+    table = pa.table(
+        {
+            "lineId": pa.array(["1", "1", "2", "1", "2"]).dictionary_encode(),
+            "direction": [0, 1, 0, 0, None],
+            "n": [0, 1, 2, 3, 4],
+        }
+    )
+
+    partitions = {
+        key: part["n"].to_pylist()
+        for key, part in _partition_table(table, ["lineId", "direction"])
+    }
+
+    assert partitions == {("1", 0): [0, 3], ("1", 1): [1], ("2", 0): [2], ("2", None): [4]}
+
+
+def test_dataset_metadata_is_written_once_per_run(
+    make_component, sync_components, monkeypatch
+):
+    component = make_component(
+        parquetize=ComponentParquetizeConfig(
+            batch="1h",
+            groups=[
+                ComponentParquetizeGroupConfig(group="1d"),
+                ComponentParquetizeGroupConfig(group="7d", keys=["lineId"]),
+            ],
+            schema=RECORDS_SCHEMA,
+            partitioning="hive",
+        )
+    )
+    tables = sync_components(component)
+    parquet_table = tables[component.parquetize_name]
+
+    # The package exports the function under the name of its module
+    module = importlib.import_module("src.runners.run_parquetize")
+    rewrites = []
+    append = module._append_dataset_metadata
+
+    def record(component_name, aggregation, files_metadata):
+        rewrites.append((aggregation, len(files_metadata)))
+        append(component_name, aggregation, files_metadata)
+
+    monkeypatch.setattr(module, "_append_dataset_metadata", record)
+
+    start = datetime(2024, 5, 1)
+    for day in range(2):
+        for minute in range(0, 24 * 60, 30):
+            write_result(
+                component,
+                tables[component.name],
+                [{"lineId": str(minute % 2), "distance": minute}],
+                start + timedelta(days=day, minutes=minute),
+            )
+        write_result(component, tables[component.name], [], start + timedelta(days=day + 1))
+
+        rewrites.clear()
+        run_parquetize(component, tables)
+
+        with engine.connect() as connection:
+            files = connection.execute(
+                parquet_table.select().where(parquet_table.c.aggregation == "1d")
+            ).fetchall()
+
+        assert [aggregation for aggregation, _ in rewrites] == ["1d"]
+        assert rewrites[0][1] > 0
+        assert parquetize_dataset(component, "1d").count_rows() == sum(
+            pq.read_metadata(file.data).num_rows for file in files
+        )
+
+
+def test_dataset_metadata_failure_does_not_hide_the_run_failure(
+    make_component, sync_components, monkeypatch, caplog
+):
+    component = make_component(
+        parquetize=ComponentParquetizeConfig(
+            batch="1h",
+            groups=[
+                ComponentParquetizeGroupConfig(group="1d", keys=["lineId"]),
+                ComponentParquetizeGroupConfig(group="2d"),
+            ],
+            schema=RECORDS_SCHEMA,
+            partitioning="hive",
+        )
+    )
+    tables = sync_components(component)
+
+    module = importlib.import_module("src.runners.run_parquetize")
+    fetch_group_rows = module._fetch_group_rows
+
+    # The 2d stage fails once the 1d files are committed, and so does their summary
+    def fetch_or_fail(connection, parquet_table, previous_group, *args):
+        if previous_group.group == "1d":
+            raise ValueError("2d stage failed")
+        return fetch_group_rows(connection, parquet_table, previous_group, *args)
+
+    def append_fails(component_name, aggregation, files_metadata):
+        raise OSError("storage unavailable")
+
+    monkeypatch.setattr(module, "_fetch_group_rows", fetch_or_fail)
+    monkeypatch.setattr(module, "_append_dataset_metadata", append_fails)
+
+    start = datetime(2024, 5, 1)
+    for minute in range(0, 4 * 24 * 60, 30):
+        write_result(
+            component,
+            tables[component.name],
+            [{"lineId": str(minute % 2), "distance": minute}],
+            start + timedelta(minutes=minute),
+        )
+
+    with pytest.raises(ValueError, match="2d stage failed"):
+        run_parquetize(component, tables)
+
+    assert "storage unavailable" in caplog.text
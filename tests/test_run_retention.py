@@ -0,0 +1,211 @@
+import importlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.components import Harvester
+from src.configuration.model import ComponentParquetizeConfig, ComponentRetentionConfig
+from src.data.engine import engine
+from src.data.storage import storage_manager
+from src.data.retrieve import retrieve_between_datetime
+from src.data.state import retrieve_component_state
+from src.data.write import write_result
+from src.runners.run_harvester import run_harvester
+from src.runners.run_retention import retention_cutoff, run_retention
+
+START = datetime(2024, 5, 1)
+
+
+class CountHarvester(Harvester):
+    def run(self, source, **kwargs):
+        return [len(source) if isinstance(source, list) else 1]
+
+
+@pytest.fixture
+def collector(make_component):
+    return make_component(retention=ComponentRetentionConfig(keep="7d"))
+
+
+def write_snapshots(collector, tables, minutes):
+    for minute in minutes:
+        write_result(
+            collector, tables[collector.name], [minute], START + timedelta(minutes=minute)
+        )
+
+
+def harvesters_of(*harvesters):
+    return {harvester.name: harvester for harvester in harvesters}
+
+
+def test_cutoff_without_users_is_the_keep_duration(collector, sync_components):
+    tables = sync_components(collector)
+    write_snapshots(collector, tables, range(0, 60, 10))
+
+    cutoff = retention_cutoff(collector, {}, tables)
+
+    assert abs(cutoff - (datetime.now() - timedelta(days=7))) < timedelta(minutes=1)
+
+
+def test_cutoff_waits_for_parquetize(make_component, sync_components):
+    collector = make_component(
+        retention=ComponentRetentionConfig(keep="7d"),
+        parquetize=ComponentParquetizeConfig(
+            batch="1h", groups=[], schema={"type": "array", "items": {"type": "object"}}
+        ),
+    )
+    tables = sync_components(collector)
+    write_snapshots(collector, tables, range(0, 180, 10))
+
+    assert retention_cutoff(collector, {}, tables) is None
+
+    parquet_table = tables[collector.parquetize_name]
+    with engine.connect() as connection:
+        connection.execute(
+            parquet_table.insert().values(
+                start_date=START,
+                end_date=START + timedelta(hours=1),
+                data="file",
+                count=0,
+                skipped=0,
+                original_size=0,
+                compressed_size=0,
+                schema={},
+                aggregation="1h",
+            )
+        )
+        connection.commit()
+
+    assert retention_cutoff(collector, {}, tables) == START + timedelta(hours=1)
+
+
+@pytest.mark.parametrize("source_cursor", ["date", "id"])
+def test_cutoff_waits_for_the_next_period_of_harvesters(
+    collector, make_component, sync_components, source_cursor
+):
+    harvester = make_component(
+        CountHarvester, source=collector, source_range="1h", source_cursor=source_cursor
+    )
+    tables = sync_components(collector, harvester)
+    write_snapshots(collector, tables, range(10, 200, 10))
+
+    # A harvester that never ran needs every row
+    assert retention_cutoff(collector, harvesters_of(harvester), tables) is None
+
+    while run_harvester(harvester, tables):
+        pass
+
+    # The periods up to 03:00 are harvested, the rows after are still needed
+    assert retrieve_component_state(harvester.name).last_date == START + timedelta(hours=3)
+    assert retention_cutoff(collector, harvesters_of(harvester), tables) == (
+        START + timedelta(hours=3)
+    )
+
+
+def test_cutoff_keeps_the_rows_of_dependencies(collector, make_component, sync_components):
+    source = make_component()
+    harvester = make_component(
+        CountHarvester,
+        source=source,
+        dependencies=[collector],
+        dependencies_limit=[3],
+    )
+    tables = sync_components(source, collector, harvester)
+    write_snapshots(collector, tables, range(0, 100, 10))
+    write_result(source, tables[source.name], [1], START + timedelta(minutes=65))
+
+    assert run_harvester(harvester, tables)
+
+    # The 3 latest rows before the harvest at 01:05 are the ones of 00:40 to 01:00
+    assert retention_cutoff(collector, harvesters_of(harvester), tables) == (
+        START + timedelta(minutes=40)
+    )
+
+
+def test_retention_releases_the_blobs_before_the_cutoff(
+    collector, make_component, sync_components
+):
+    harvester = make_component(CountHarvester, source=collector, source_range="1h")
+    tables = sync_components(collector, harvester)
+    write_snapshots(collector, tables, range(10, 200, 10))
+
+    while run_harvester(harvester, tables):
+        pass
+
+    table = tables[collector.name]
+    paths = [row.path for row in retrieve_between_datetime(table, START, None, 100)]
+    released = run_retention(collector, harvesters_of(harvester), tables)
+
+    rows = retrieve_between_datetime(table, START, None, 100)
+    assert released == 17
+    assert [row.date for row in rows] == [START + timedelta(minutes=m) for m in (180, 190)]
+    assert sum(os.path.exists(path) for path in paths) == 2
+
+    state = retrieve_component_state(collector.name)
+    assert state.first_date == START + timedelta(minutes=180)
+    assert state.last_date == START + timedelta(minutes=190)
+
+
+def test_cutoff_keeps_late_rows_of_id_cursor_harvesters(
+    collector, make_component, sync_components
+):
+    harvester = make_component(
+        CountHarvester, source=collector, source_range="1h", source_cursor="id"
+    )
+    tables = sync_components(collector, harvester)
+    write_snapshots(collector, tables, range(10, 200, 10))
+
+    while run_harvester(harvester, tables):
+        pass
+
+    # Committed late, after the rows harvested up to 03:00 but with an earlier date
+    write_snapshots(collector, tables, [95])
+
+    assert retention_cutoff(collector, harvesters_of(harvester), tables) == (
+        START + timedelta(minutes=95)
+    )
+
+    run_retention(collector, harvesters_of(harvester), tables)
+    rows = retrieve_between_datetime(tables[collector.name], START, None, 100)
+    assert [row.date for row in rows][0] == START + timedelta(minutes=95)
+
+
+class TieringStorage:
+    """The test storage, with access tiers recording the blobs moved to them."""
+
+    tiers = ("Hot", "Archive")
+
+    def __init__(self):
+        self.tiered = []
+
+    def tier_many(self, file_names, tier):
+        self.tiered.extend((file_name, tier) for file_name in file_names)
+
+    def __getattr__(self, name):
+        return getattr(storage_manager, name)
+
+
+def test_tiered_blobs_keep_their_pointer(make_component, sync_components, monkeypatch):
+    collector = make_component(
+        retention=ComponentRetentionConfig(keep="7d", action="tier", tier="Archive")
+    )
+    tables = sync_components(collector)
+    table = tables[collector.name]
+    write_snapshots(collector, tables, range(0, 60, 10))
+    write_result(collector, table, None, START + timedelta(minutes=60))
+
+    storage = TieringStorage()
+    module = importlib.import_module("src.runners.run_retention")
+    monkeypatch.setattr(module, "storage_manager", storage)
+
+    assert run_retention(collector, {}, tables) == 6
+    # Nothing left to release on the next run
+    assert run_retention(collector, {}, tables) == 0
+
+    with engine.connect() as connection:
+        rows = connection.execute(table.select().order_by(table.c.id)).fetchall()
+
+    assert retrieve_between_datetime(table, START, None, 100) == []
+    assert all(row.hash is None for row in rows)
+    assert storage.tiered == [(row.data, "Archive") for row in rows[:6]]
+    assert all(os.path.exists(row.data) for row in rows)
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, update
+
+from src.data.engine import engine
+from src.data.state import (
+    component_state_table,
+    refresh_component_state,
+    retrieve_component_state,
+    update_released_component_state,
+)
+from src.data.write import write_result
+
+START = datetime(2024, 5, 1)
+
+
+def write_snapshots(collector, table, minutes):
+    for minute in minutes:
+        write_result(collector, table, [minute], START + timedelta(minutes=minute))
+
+
+def test_writes_update_the_state(make_component, sync_components):
+    collector = make_component()
+    table = sync_components(collector)[collector.name]
+
+    write_snapshots(collector, table, [20, 10, 30])
+
+    state = retrieve_component_state(collector.name)
+    assert state.first_date == START + timedelta(minutes=10)
+    assert state.last_date == START + timedelta(minutes=30)
+    assert state.count == 3
+
+
+def test_refresh_matches_the_written_state(make_component, sync_components):
+    collector = make_component()
+    table = sync_components(collector)[collector.name]
+    write_snapshots(collector, table, range(0, 60, 10))
+    written = retrieve_component_state(collector.name)
+
+    with engine.connect() as connection:
+        connection.execute(
+            delete(component_state_table).where(component_state_table.c.name == collector.name)
+        )
+        connection.commit()
+
+    refresh_component_state(collector.name, table)
+
+    assert retrieve_component_state(collector.name) == written
+
+
+def test_released_state_keeps_the_last_row(make_component, sync_components):
+    collector = make_component()
+    table = sync_components(collector)[collector.name]
+    write_snapshots(collector, table, range(0, 60, 10))
+
+    # Retention released the rows before 00:30, then a row was written before its update
+    with engine.connect() as connection:
+        connection.execute(
+            update(table)
+            .where(table.c.date < START + timedelta(minutes=30))
+            .values(data=None, hash=None)
+        )
+        connection.commit()
+    write_snapshots(collector, table, [60])
+
+    update_released_component_state(collector.name, table, dropped_count=2)
+
+    state = retrieve_component_state(collector.name)
+    assert state.first_date == START + timedelta(minutes=30)
+    assert state.last_date == START + timedelta(minutes=60)
+    assert state.count == 5
@@ -0,0 +1,84 @@
+import os
+import sys
+
+import pytest
+
+from src.data.storage import (
+    AsyncAzureBlobManager,
+    AzureBlobManager,
+    CachingStorageManager,
+    FileStorageManager,
+    run_async,
+)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return CachingStorageManager(
+        FileStorageManager(str(tmp_path / "files")), str(tmp_path / "cache"), 1024**2
+    )
+
+
+def test_async_reads_go_through_the_cache(cache):
+    url = run_async(cache.aio.write("a/b", b"data"))
+
+    assert run_async(cache.aio.read_many([url])) == [b"data"]
+
+    # Read from the cache once the blob is gone from the storage
+    os.remove(url)
+    assert run_async(cache.aio.read(url)) == b"data"
+    assert cache.read(url) == b"data"
+
+
+def test_async_writes_and_deletes_invalidate_the_cache(cache):
+    url = cache.write("a/b", b"old")
+    assert cache.read(url) == b"old"
+
+    run_async(cache.aio.write_many([("a/b", b"new")]))
+    assert cache.read(url) == b"new"
+
+    run_async(cache.aio.delete(url))
+    with pytest.raises(FileNotFoundError):
+        cache.read(url)
+
+
+@pytest.mark.parametrize(
+    "file_name, cached",
+    [
+        ("component/2024-05-01_10-00-00", True),
+        ("hive/component=a/aggregation=1d/_metadata", False),
+        ("hive/component=a/aggregation=1d/date=2024-05-01/part.parquet", True),
+        ("zstd_dictionaries/component", False),
+        ("zstd_dictionaries/123456", True),
+    ],
+)
+def test_blobs_rewritten_in_place_are_not_cached(cache, file_name, cached):
+    url = cache.write(file_name, b"old")
+    assert cache.read(url) == b"old"
+
+    # Rewritten by another node, which only invalidates its own cache
+    cache.storage.write(file_name, b"new")
+
+    expected = b"old" if cached else b"new"
+    assert cache.read(url) == expected
+    assert bytes(cache.read_buffer(url)) == expected
+    assert cache.read_many([url]) == [expected]
+    assert run_async(cache.aio.read(url)) == expected
+    with open(cache.local_path(url), "rb") as file:
+        assert file.read() == expected
+
+
+def test_async_azure_storage_requires_aiohttp(monkeypatch):
+    monkeypatch.setitem(sys.modules, "aiohttp", None)
+
+    with pytest.raises(ImportError, match="aiohttp"):
+        AsyncAzureBlobManager("UseDevelopmentStorage=true", "container")
+
+
+def test_sync_azure_storage_does_not_require_aiohttp(monkeypatch):
+    monkeypatch.setitem(sys.modules, "aiohttp", None)
+
+    storage = AzureBlobManager("UseDevelopmentStorage=true", "container")
+
+    with pytest.raises(ImportError, match="aiohttp"):
+        storage.aio
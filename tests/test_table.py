@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from src.data.engine import engine
+from src.data.retrieve import base_query
+
+START = datetime(2024, 5, 1)
+
+
+def explain(query) -> str:
+    """Get the plan of a query, on PostgreSQL once the table is vacuumed (visibility map)."""
+    sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            # The planner is kept from preferring a sequential scan on a small table
+            connection.execute(text("SET enable_seqscan = off"))
+            rows = connection.execute(text(f"EXPLAIN (COSTS OFF) {sql}")).fetchall()
+            return "\n".join(row[0] for row in rows)
+
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+        return "\n".join(row[-1] for row in rows)
+
+
+def test_date_queries_use_the_covering_index(make_component, sync_components):
+    collector = make_component()
+    table = sync_components(collector)[collector.name]
+
+    with engine.connect() as connection:
+        connection.execute(
+            insert(table),
+            [
+                dict(
+                    date=START + timedelta(seconds=20 * i),
+                    data=f"{collector.name}/{i}",
+                    type="json",
+                    hash=None if i % 50 == 0 else f"{i:032x}",
+                )
+                for i in range(20_000)
+            ],
+        )
+        connection.commit()
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if engine.dialect.name == "postgresql":
+            connection.execute(text(f'VACUUM ANALYZE "{table.name}"'))
+        else:
+            connection.execute(text("ANALYZE"))
+
+    between = explain(
+        base_query(table)
+        .where(table.c.date > START + timedelta(hours=1))
+        .where(table.c.date <= START + timedelta(hours=2))
+        .order_by(table.c.date.asc())
+        .limit(1000)
+    )
+    latest = explain(base_query(table).order_by(table.c.date.desc()).limit(1))
+
+    index = f"idx_{table.name}_date_covering"
+
+    if engine.dialect.name == "postgresql":
+        assert f"Index Only Scan using {index} on {table.name}" in between
+        assert f"Index Only Scan Backward using {index} on {table.name}" in latest
+    else:
+        assert f"SEARCH {table.name} USING INDEX {index} (date>? AND date<?)" in between
+        assert f"SCAN {table.name} USING INDEX {index}" in latest